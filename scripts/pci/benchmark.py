@@ -0,0 +1,269 @@
+import os
+import sys
+import json
+import time
+import glob
+import shutil
+import argparse
+import platform
+import subprocess
+from datetime import datetime
+
+from generer_jeu_test import generer_jeu
+from serveur_test import demarrer_serveur
+from instrumentation import rapport_execution
+
+DOSSIER_SCRIPTS = os.path.dirname(os.path.abspath(__file__))
+
+# Fichier où sont accumulés les résultats de chaque exécution
+HISTORIQUE_FILE = "benchmark_historique.json"
+
+ETAPES = ["telechargement", "decompression", "cpg", "conversion", "duckdb_import", "duckdb_export",
+          "optimisation", "extraction", "qualite", "flatgeobuf"]
+
+# Étapes qui s'appuient sur ogr2ogr, ignorées s'il est introuvable
+ETAPES_OGR2OGR = ("conversion", "flatgeobuf")
+
+
+def taille_fichiers(dossier, extensions=None, exclure=()):
+    """Retourne (nombre de fichiers, taille totale en octets) pour les extensions demandées"""
+    nombre = 0
+    octets = 0
+    if not os.path.isdir(dossier):
+        return 0, 0
+    for root, dirs, files in os.walk(dossier):
+        dirs[:] = [d for d in dirs if os.path.join(root, d) not in exclure]
+        for file in files:
+            if extensions is None or file.lower().endswith(extensions):
+                nombre += 1
+                octets += os.path.getsize(os.path.join(root, file))
+    return nombre, octets
+
+
+def taille_exports(donnees):
+    """Retourne (nombre de fichiers, taille totale en octets) des exports Parquet du répertoire donnees (lots et fusion)"""
+    fichiers = glob.glob(os.path.join(donnees, "*.parquet"))
+    return len(fichiers), sum(os.path.getsize(f) for f in fichiers)
+
+
+def executer_etape(cmd, journal):
+    """
+    Exécute une commande en mesurant sa durée et le pic de mémoire résidente.
+    Les sorties de la commande sont redirigées vers le fichier journal.
+
+    Returns:
+        tuple: (code retour, durée en secondes, pic RSS en Mo ou None si indisponible)
+    """
+    with open(journal, 'wb') as sortie:
+        debut = time.perf_counter()
+        processus = subprocess.Popen(cmd, stdout=sortie, stderr=subprocess.STDOUT)
+    if hasattr(os, 'wait4'):
+        _, statut, usage = os.wait4(processus.pid, 0)
+        processus.returncode = os.waitstatus_to_exitcode(statut)
+        # ru_maxrss est exprimé en kilo-octets sous Linux et en octets sous macOS
+        diviseur = 1024 * 1024 if platform.system() == 'Darwin' else 1024
+        rss_max = usage.ru_maxrss / diviseur
+    else:
+        processus.wait()
+        rss_max = None
+    return processus.returncode, time.perf_counter() - debut, rss_max
+
+
+def commandes_etapes(travail, tsv, millesime, workers, journal, departements, duckdb_exe=None):
+    """Construit la commande et la mesure des entrées de chaque étape du pipeline"""
+    donnees = os.path.join(travail, "donnees")
+    fusion = os.path.join(donnees, "cloudcadastrefusion.parquet")
+    base = os.path.join(travail, "cloudcadastre.duckdb")
+    python = sys.executable
+    variables = ['--variable', f'my_workspace={travail}', '--variable', f'millesime={millesime}']
+    if duckdb_exe:
+        variables += ['--duckdb', duckdb_exe]
+
+    def script(nom):
+        return os.path.join(DOSSIER_SCRIPTS, nom)
+
+    commandes = {
+        "telechargement": ([python, script("telechargement.py"), '--tsv', tsv, '--output', donnees,
+                            '--workers', str(workers), '--format', 'shp'],
+                           lambda: taille_fichiers(donnees, ('.zip',))),
+        "decompression": ([python, script("unzip_agglist.py"), '--quiet', '--processes', str(workers),
+                           '--input', donnees, '--output', os.path.join(travail, "listes")],
+                          lambda: taille_fichiers(donnees, ('.zip',))),
+        "cpg": ([python, script("create_cpg_file.py"), '--input', donnees],
+                lambda: taille_fichiers(donnees, ('.shp',))),
+        "conversion": ([python, script("convert_shp_to_parquet.py"), '--workers', str(workers), '--overwrite',
+                        '--root', donnees],
+                       lambda: taille_fichiers(donnees, ('.shp', '.dbf'))),
+        "duckdb_import": ([python, script("executer_sql.py"), '--sql', script("duckdb_convert_pci.sql"),
+                           '--base', base] + variables,
+                          lambda: taille_fichiers(donnees, ('.parquet',))),
+        "duckdb_export": ([python, script("executer_sql.py"), '--sql', script("duckdb_export_pci.sql"),
+                           '--base', base] + variables,
+                          lambda: (1, os.path.getsize(base) if os.path.exists(base) else 0)),
+        "optimisation": ([python, script("optimisation_parquet.py"), '--workers', str(workers), '--input', donnees],
+                         lambda: taille_exports(donnees)),
+        "extraction": ([python, script("extraction_multiple.py"), '--workers', str(workers), '--input', fusion,
+                        '--output', os.path.join(travail, "extraits"), '--departements', ','.join(departements)],
+                       lambda: (1, os.path.getsize(fusion) if os.path.exists(fusion) else 0)),
+        "qualite": ([python, script("controle_qualite.py"), '--workers', str(workers), '--input', donnees,
+                     '--output', os.path.join(travail, "qualite.json")],
+                    lambda: taille_exports(donnees)),
+        "flatgeobuf": ([python, script("export_flatgeobuf.py"), '--workers', str(workers), '--overwrite',
+                        '--input', donnees, '--output', os.path.join(travail, "flatgeobuf")],
+                       lambda: taille_exports(donnees)),
+    }
+    # toutes les étapes alimentent le même journal d'instrumentation
+    for cmd, _ in commandes.values():
+        cmd += ['--journal', journal]
+    return commandes
+
+
+def version_code():
+    """Identifie la version du code mesurée (commit git courant si disponible)"""
+    try:
+        resultat = subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=DOSSIER_SCRIPTS,
+                                  capture_output=True, text=True)
+        if resultat.returncode == 0:
+            return resultat.stdout.strip()
+    except OSError:
+        pass
+    return "inconnue"
+
+
+def lancer_benchmark(args):
+    """Génère le jeu de test, le sert localement et mesure chaque étape demandée"""
+    travail = os.path.abspath(args.work)
+    source = os.path.join(travail, "source")
+    if os.path.exists(travail) and not args.keep:
+        shutil.rmtree(travail)
+    os.makedirs(travail, exist_ok=True)
+
+    departements = [d.strip() for d in args.departements.split(',') if d.strip()]
+    print(f"Génération du jeu de test dans {source}...")
+    debut = time.perf_counter()
+    _, nb_archives, octets_source = generer_jeu(source, args.millesime, departements, args.communes,
+                                                args.parcelles, args.sommets, args.graine)
+    print(f"{nb_archives} archives générées ({octets_source / 1e6:.1f} Mo) en {time.perf_counter() - debut:.1f}s")
+
+    os.makedirs(os.path.join(travail, "journaux"), exist_ok=True)
+    serveur, url = demarrer_serveur(source)
+    tsv = os.path.join(travail, "url_sources_test.tsv")
+    with open(tsv, 'w', encoding='utf-8') as f:
+        f.write("format\tmillesime\tsource\n")
+        f.write(f"shp\t{args.millesime}\t{url}data/etalab-cadastre/{args.millesime}/shp/departements/\n")
+
+    etapes = [e.strip() for e in args.stages.split(',')] if args.stages else ETAPES
+    journal_execution = os.path.join(travail, "journaux", "execution.jsonl")
+    commandes = commandes_etapes(travail, tsv, args.millesime, args.workers, journal_execution, departements,
+                                 args.duckdb)
+    resultats = []
+    try:
+        for etape in etapes:
+            cmd, mesurer_entrees = commandes[etape]
+            if etape in ETAPES_OGR2OGR and not shutil.which('ogr2ogr'):
+                print(f"- {etape}: ignorée (ogr2ogr introuvable)")
+                resultats.append({"etape": etape, "statut": "ignoree"})
+                continue
+
+            journal = os.path.join(travail, "journaux", f"{etape}.log")
+            code, duree, rss_max = executer_etape(cmd, journal)
+            fichiers, octets = mesurer_entrees()
+            _, disque = taille_fichiers(travail, exclure=(source,))
+            resultat = {
+                "etape": etape,
+                "statut": "ok" if code == 0 else "echec",
+                "code_retour": code,
+                "duree_s": round(duree, 3),
+                "rss_max_mo": round(rss_max, 1) if rss_max is not None else None,
+                "fichiers": fichiers,
+                "octets": octets,
+                "debit_mo_s": round(octets / 1e6 / duree, 2) if duree > 0 else None,
+                "fichiers_s": round(fichiers / duree, 1) if duree > 0 else None,
+                "disque_mo": round(disque / 1e6, 1),
+                "journal": journal,
+            }
+            resultats.append(resultat)
+            print(f"- {etape}: {resultat['statut']} en {duree:.1f}s, {resultat['debit_mo_s']} Mo/s, "
+                  f"RSS max {resultat['rss_max_mo']} Mo, disque {resultat['disque_mo']} Mo")
+    finally:
+        serveur.shutdown()
+
+    return {
+        "date": datetime.now().isoformat(timespec='seconds'),
+        "version": version_code(),
+        "libelle": args.label,
+        "parametres": {
+            "millesime": args.millesime, "departements": departements, "communes": args.communes,
+            "parcelles": args.parcelles, "sommets": args.sommets, "graine": args.graine, "workers": args.workers,
+            "octets_source": octets_source, "archives": nb_archives,
+        },
+        "etapes": resultats,
+        "rapport": rapport_execution([journal_execution]) if os.path.exists(journal_execution) else None,
+    }
+
+
+def charger_historique(chemin):
+    """Charge l'historique des exécutions précédentes"""
+    if not os.path.exists(chemin):
+        return []
+    with open(chemin, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def comparer(reference, execution):
+    """Affiche l'évolution de la durée, du débit et de la mémoire de chaque étape entre deux exécutions"""
+    print(f"\nComparaison {reference['version']} ({reference['date']}) -> {execution['version']} ({execution['date']})")
+    if reference["parametres"] != execution["parametres"]:
+        print("Attention: les paramètres du jeu de test diffèrent entre les deux exécutions.")
+    etapes_reference = {e["etape"]: e for e in reference["etapes"]}
+    for etape in execution["etapes"]:
+        avant = etapes_reference.get(etape["etape"])
+        if not avant or avant.get("statut") != "ok" or etape.get("statut") != "ok":
+            print(f"- {etape['etape']}: non comparable")
+            continue
+        evolution = (etape["duree_s"] - avant["duree_s"]) / avant["duree_s"] * 100 if avant["duree_s"] else 0
+        print(f"- {etape['etape']}: {avant['duree_s']}s -> {etape['duree_s']}s ({evolution:+.1f}%), "
+              f"RSS max {avant['rss_max_mo']} -> {etape['rss_max_mo']} Mo")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mesure les performances du pipeline sur un jeu de données fictif servi localement")
+    parser.add_argument('--work', default='./benchmark', help='Répertoire de travail (par défaut: ./benchmark)')
+    parser.add_argument('--history', default=HISTORIQUE_FILE,
+                        help=f"Fichier JSON d'historique des mesures (par défaut: {HISTORIQUE_FILE})")
+    parser.add_argument('--label', default='', help="Libellé associé à l'exécution dans l'historique")
+    parser.add_argument('--stages', help=f"Étapes à mesurer séparées par des virgules (par défaut: {','.join(ETAPES)})")
+    parser.add_argument('--millesime', default='2025-04-01', help='Millésime du jeu de test (par défaut: 2025-04-01)')
+    parser.add_argument('--departements', default='59,2A,971', help='Départements générés (par défaut: 59,2A,971)')
+    parser.add_argument('--communes', type=int, default=5, help='Nombre de communes par département (par défaut: 5)')
+    parser.add_argument('--parcelles', type=int, default=500, help='Nombre de parcelles par commune (par défaut: 500)')
+    parser.add_argument('--sommets', type=int, default=8, help='Nombre de sommets par polygone (par défaut: 8)')
+    parser.add_argument('--graine', type=int, default=0, help='Graine du générateur aléatoire (par défaut: 0)')
+    parser.add_argument('--workers', type=int, default=4, help='Nombre de workers passé à chaque étape (par défaut: 4)')
+    parser.add_argument('--duckdb', help='Chemin du client duckdb (par défaut: module Python duckdb)')
+    parser.add_argument('--keep', action='store_true', help='Conserve le répertoire de travail existant')
+    parser.add_argument('--compare', action='store_true', help="Compare le résultat avec l'exécution précédente de l'historique")
+    args = parser.parse_args()
+
+    if args.stages:
+        inconnues = [e for e in args.stages.split(',') if e.strip() not in ETAPES]
+        if inconnues:
+            print(f"Erreur: étapes inconnues {inconnues}, étapes disponibles: {', '.join(ETAPES)}")
+            return 1
+
+    execution = lancer_benchmark(args)
+
+    historique = charger_historique(args.history)
+    historique.append(execution)
+    with open(args.history, 'w', encoding='utf-8') as f:
+        json.dump(historique, f, indent=2, ensure_ascii=False)
+    print(f"\nRésultats ajoutés à {args.history} ({len(historique)} exécutions)")
+
+    if args.compare and len(historique) > 1:
+        comparer(historique[-2], execution)
+
+    return 0 if all(e["statut"] != "echec" for e in execution["etapes"]) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,353 @@
+import os
+import sys
+import glob
+import json
+import time
+import random
+import struct
+import argparse
+
+import requests
+
+from serveur_test import demarrer_serveur
+from lecture_distante import FichierHttp, fusionner_plages, ECART_FUSION
+from instrumentation import statistiques
+from detection_changements import motif_parquet
+
+# Signature des fichiers FlatGeobuf (le dernier octet porte la version corrective)
+MAGIC_FLATGEOBUF = b'fgb\x03fgb'
+
+# Taille d'un noeud du R-tree compacté : emprise (4 x float64) et décalage (uint64)
+TAILLE_NOEUD_RTREE = 40
+
+# Taille de la première lecture d'un fichier FlatGeobuf (en-tête et haut de l'index)
+LECTURE_INITIALE = 16384
+
+
+def intersecte(a, b):
+    """Indique si deux emprises (xmin, ymin, xmax, ymax) se chevauchent"""
+    return a[0] <= b[2] and a[2] >= b[0] and a[1] <= b[3] and a[3] >= b[1]
+
+
+def champ_flatbuffer(tampon, table, indice):
+    """Retourne la position d'un champ d'une table FlatBuffers, ou None s'il est absent"""
+    vtable = table - struct.unpack_from('<i', tampon, table)[0]
+    longueur = struct.unpack_from('<H', tampon, vtable)[0]
+    if 4 + 2 * indice >= longueur:
+        return None
+    decalage = struct.unpack_from('<H', tampon, vtable + 4 + 2 * indice)[0]
+    return table + decalage if decalage else None
+
+
+def lire_entete_flatgeobuf(fichier):
+    """
+    Lit l'en-tête d'un fichier FlatGeobuf distant.
+
+    Seuls les champs utiles à une recherche par emprise sont décodés : nombre d'entités,
+    taille des noeuds de l'index, emprise et code EPSG.
+
+    Returns:
+        dict: champs de l'en-tête et position de l'index et des entités dans le fichier
+    """
+    tampon = fichier.lire(0, LECTURE_INITIALE)
+    if tampon[:7] != MAGIC_FLATGEOBUF:
+        raise ValueError(f"{fichier.url} n'est pas un fichier FlatGeobuf")
+    taille_entete = struct.unpack_from('<I', tampon, 8)[0]
+    if 12 + taille_entete > len(tampon):
+        tampon += fichier.lire(len(tampon), 12 + taille_entete - len(tampon))
+
+    racine = 12 + struct.unpack_from('<I', tampon, 12)[0]
+    entete = {"entites": 0, "taille_noeud": 16, "emprise": None, "srid": None}
+    position = champ_flatbuffer(tampon, racine, 8)
+    if position is not None:
+        entete["entites"] = struct.unpack_from('<Q', tampon, position)[0]
+    position = champ_flatbuffer(tampon, racine, 9)
+    if position is not None:
+        entete["taille_noeud"] = struct.unpack_from('<H', tampon, position)[0]
+    position = champ_flatbuffer(tampon, racine, 1)
+    if position is not None:
+        vecteur = position + struct.unpack_from('<I', tampon, position)[0]
+        if struct.unpack_from('<I', tampon, vecteur)[0] >= 4:
+            entete["emprise"] = struct.unpack_from('<4d', tampon, vecteur + 4)
+    position = champ_flatbuffer(tampon, racine, 10)
+    if position is not None:
+        crs = position + struct.unpack_from('<I', tampon, position)[0]
+        code = champ_flatbuffer(tampon, crs, 1)
+        entete["srid"] = struct.unpack_from('<i', tampon, code)[0] if code is not None else None
+
+    entete["debut_index"] = 12 + taille_entete
+    entete["niveaux"] = niveaux_rtree(entete["entites"], entete["taille_noeud"])
+    nb_noeuds = entete["niveaux"][0][1] if entete["niveaux"] else 0
+    entete["debut_entites"] = entete["debut_index"] + nb_noeuds * TAILLE_NOEUD_RTREE
+    return entete
+
+
+def niveaux_rtree(nb_entites, taille_noeud):
+    """
+    Calcule les bornes (premier noeud, fin) de chaque niveau du R-tree compacté,
+    des feuilles à la racine. La racine est le premier noeud du tableau.
+    """
+    if nb_entites == 0 or taille_noeud < 2:
+        return []
+    effectifs = [nb_entites]
+    n = nb_entites
+    while n != 1:
+        n = -(-n // taille_noeud)
+        effectifs.append(n)
+    fin = sum(effectifs)
+    niveaux = []
+    for effectif in effectifs:
+        niveaux.append((fin - effectif, fin))
+        fin -= effectif
+    return niveaux
+
+
+def requete_flatgeobuf(url, emprise, session):
+    """
+    Lit les entités d'une emprise dans un fichier FlatGeobuf distant.
+
+    L'index est parcouru niveau par niveau en ne lisant que les noeuds dont l'emprise
+    intersecte la requête, puis les entités retenues sont lues par plages fusionnées.
+
+    Returns:
+        tuple: (nombre d'entités, octets lus, nombre de requêtes)
+    """
+    fichier = FichierHttp(url, session)
+    entete = lire_entete_flatgeobuf(fichier)
+    niveaux = entete["niveaux"]
+    if not niveaux:
+        raise ValueError(f"{url} n'a pas d'index spatial (SPATIAL_INDEX=NO)")
+    taille_noeud = entete["taille_noeud"]
+    nb_noeuds = niveaux[0][1]
+    premiere_feuille = niveaux[0][0]
+
+    retenues = []
+    a_lire = [0]
+    for niveau in range(len(niveaux) - 1, -1, -1):
+        fin_niveau = niveaux[niveau][1]
+        plages = [(i, min(i + taille_noeud, fin_niveau)) for i in a_lire]
+        a_lire = []
+        for debut, fin in fusionner_plages(plages, ECART_FUSION // TAILLE_NOEUD_RTREE):
+            donnees = fichier.lire(entete["debut_index"] + debut * TAILLE_NOEUD_RTREE, (fin - debut) * TAILLE_NOEUD_RTREE)
+            for k in range(fin - debut):
+                *noeud, decalage = struct.unpack_from('<4dQ', donnees, k * TAILLE_NOEUD_RTREE)
+                if not intersecte(noeud, emprise):
+                    continue
+                if debut + k < premiere_feuille:
+                    a_lire.append(decalage)
+                else:
+                    # la fin d'une entité est le début de la suivante, si elle a été lue
+                    suivante = None
+                    if k + 1 < fin - debut:
+                        suivante = struct.unpack_from('<Q', donnees, (k + 1) * TAILLE_NOEUD_RTREE + 32)[0]
+                    retenues.append((decalage, suivante))
+
+    plages = []
+    for decalage, suivante in retenues:
+        debut = entete["debut_entites"] + decalage
+        if suivante is None:
+            # dernière entité de la plage lue : sa taille est en tête de l'entité
+            taille = struct.unpack_from('<I', fichier.lire(debut, 4))[0] + 4
+            plages.append((debut, debut + taille))
+        else:
+            plages.append((debut, entete["debut_entites"] + suivante))
+    for debut, fin in fusionner_plages(plages):
+        fichier.lire(debut, fin - debut)
+    return len(retenues), fichier.octets, fichier.requetes
+
+
+def groupes_candidats(metadonnees, emprise, departement, type_objet):
+    """
+    Retourne les groupes de lignes dont les statistiques sont compatibles avec la requête.
+
+    Les statistiques de departement, type_objet et des champs de geometry_bbox permettent
+    d'écarter des groupes sans les lire ; un groupe sans statistiques est conservé.
+    """
+    chemins = {metadonnees.schema.column(i).path: i for i in range(metadonnees.num_columns)}
+    groupes = []
+    for g in range(metadonnees.num_row_groups):
+        groupe = metadonnees.row_group(g)
+
+        def bornes(chemin):
+            statistiques_colonne = groupe.column(chemins[chemin]).statistics
+            if statistiques_colonne is None or not statistiques_colonne.has_min_max:
+                return None
+            return statistiques_colonne.min, statistiques_colonne.max
+
+        retenu = True
+        for chemin, valeur in (("departement", departement), ("type_objet", type_objet)):
+            b = bornes(chemin)
+            if b is not None and not b[0] <= valeur <= b[1]:
+                retenu = False
+        xmin, ymin = bornes("geometry_bbox.xmin"), bornes("geometry_bbox.ymin")
+        xmax, ymax = bornes("geometry_bbox.xmax"), bornes("geometry_bbox.ymax")
+        if None not in (xmin, ymin, xmax, ymax) and not intersecte((xmin[0], ymin[0], xmax[1], ymax[1]), emprise):
+            retenu = False
+        if retenu:
+            groupes.append(g)
+    return groupes
+
+
+def requete_parquet(url, emprise, departement, type_objet, session):
+    """
+    Lit les entités d'une emprise dans un fichier GeoParquet distant.
+
+    Le pied de page est lu, les groupes de lignes sont filtrés sur leurs statistiques,
+    puis les groupes retenus sont lus en entier avant le filtrage ligne à ligne.
+
+    Returns:
+        tuple: (nombre d'entités, octets lus, nombre de requêtes)
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    fichier = FichierHttp(url, session)
+    parquet = pq.ParquetFile(pa.PythonFile(fichier, mode='r'), pre_buffer=True)
+    groupes = groupes_candidats(parquet.metadata, emprise, departement, type_objet)
+    if not groupes:
+        return 0, fichier.octets, fichier.requetes
+    table = parquet.read_row_groups(groupes)
+    bbox = table.column("geometry_bbox")
+    masque = pc.and_(
+        pc.and_(pc.equal(table.column("departement"), departement), pc.equal(table.column("type_objet"), type_objet)),
+        pc.and_(
+            pc.and_(pc.less_equal(pc.struct_field(bbox, "xmin"), emprise[2]),
+                    pc.greater_equal(pc.struct_field(bbox, "xmax"), emprise[0])),
+            pc.and_(pc.less_equal(pc.struct_field(bbox, "ymin"), emprise[3]),
+                    pc.greater_equal(pc.struct_field(bbox, "ymax"), emprise[1]))))
+    return pc.sum(pc.fill_null(masque, False)).as_py() or 0, fichier.octets, fichier.requetes
+
+
+def fichiers_parquet_departement(source, departement):
+    """Retourne les fichiers Parquet d'un millésime construit qui contiennent un département"""
+    import pyarrow.parquet as pq
+
+    retenus = []
+    for fichier in sorted(glob.glob(motif_parquet(source))):
+        metadonnees = pq.read_metadata(fichier)
+        indice = metadonnees.schema.names.index("departement")
+        for g in range(metadonnees.num_row_groups):
+            stats = metadonnees.row_group(g).column(indice).statistics
+            if stats is None or not stats.has_min_max or stats.min <= departement <= stats.max:
+                retenus.append(fichier)
+                break
+    return retenus
+
+
+def tirer_emprises(fichiers, departement, type_objet, nombre, taille, graine):
+    """Tire des emprises carrées de côté taille centrées sur des entités du département"""
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+
+    dataset = ds.dataset(fichiers, format="parquet")
+    filtre = (ds.field("departement") == departement) & (ds.field("type_objet") == type_objet)
+    bbox = dataset.to_table(columns=["geometry_bbox"], filter=filtre).column("geometry_bbox").combine_chunks()
+    if len(bbox) == 0:
+        raise ValueError(f"Aucune entité {type_objet} pour le département {departement}")
+    x = pc.divide(pc.add(pc.struct_field(bbox, "xmin"), pc.struct_field(bbox, "xmax")), 2).to_pylist()
+    y = pc.divide(pc.add(pc.struct_field(bbox, "ymin"), pc.struct_field(bbox, "ymax")), 2).to_pylist()
+    alea = random.Random(graine)
+    emprises = []
+    for _ in range(nombre):
+        i = alea.randrange(len(x))
+        emprises.append((x[i] - taille / 2, y[i] - taille / 2, x[i] + taille / 2, y[i] + taille / 2))
+    return emprises
+
+
+def executer(parquet, fgb, departement, type_objet, nombre, taille, graine=0, delai=0.0, debit=0.0):
+    """
+    Compare FlatGeobuf et GeoParquet pour des requêtes par emprise servies en HTTP Range.
+
+    Returns:
+        dict: résultats par format (entités, octets, requêtes, latences) et détail par requête
+    """
+    fichiers = fichiers_parquet_departement(parquet, departement)
+    fichier_fgb = os.path.join(fgb, departement, f"cadastre-{departement}-{type_objet}.fgb")
+    if not fichiers:
+        raise FileNotFoundError(f"Aucun fichier Parquet ne contient le département {departement}")
+    if not os.path.exists(fichier_fgb):
+        raise FileNotFoundError(f"Fichier FlatGeobuf introuvable: {fichier_fgb}")
+    emprises = tirer_emprises(fichiers, departement, type_objet, nombre, taille, graine)
+
+    racine = os.path.commonpath([os.path.abspath(f) for f in fichiers + [fichier_fgb]])
+    racine = racine if os.path.isdir(racine) else os.path.dirname(racine)
+    serveur, url = demarrer_serveur(racine, delai=delai, debit=debit)
+
+    def adresse(chemin):
+        return url + os.path.relpath(os.path.abspath(chemin), racine).replace(os.sep, '/')
+
+    session = requests.Session()
+    detail = []
+    try:
+        for emprise in emprises:
+            ligne = {"emprise": [round(v, 2) for v in emprise]}
+            debut = time.perf_counter()
+            entites, octets, nb_requetes = requete_flatgeobuf(adresse(fichier_fgb), emprise, session)
+            ligne["flatgeobuf"] = {"entites": entites, "octets": octets, "requetes": nb_requetes,
+                                   "latence_s": time.perf_counter() - debut}
+            debut = time.perf_counter()
+            entites = octets = nb_requetes = 0
+            for fichier in fichiers:
+                resultat = requete_parquet(adresse(fichier), emprise, departement, type_objet, session)
+                entites, octets, nb_requetes = entites + resultat[0], octets + resultat[1], nb_requetes + resultat[2]
+            ligne["parquet"] = {"entites": entites, "octets": octets, "requetes": nb_requetes,
+                                "latence_s": time.perf_counter() - debut}
+            detail.append(ligne)
+    finally:
+        serveur.shutdown()
+
+    resultats = {"departement": departement, "type_objet": type_objet, "requetes": nombre, "taille_emprise": taille,
+                 "delai_s": delai, "debit_mo_s": debit / 1e6, "fichiers": {"flatgeobuf": os.path.getsize(fichier_fgb),
+                                                "parquet": sum(os.path.getsize(f) for f in fichiers)}}
+    for format_ in ("flatgeobuf", "parquet"):
+        resultats[format_] = {
+            "entites": sum(d[format_]["entites"] for d in detail),
+            "octets": statistiques([d[format_]["octets"] for d in detail]),
+            "requetes_http": statistiques([d[format_]["requetes"] for d in detail]),
+            "latence_s": statistiques([d[format_]["latence_s"] for d in detail]),
+        }
+    resultats["detail"] = detail
+    return resultats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare FlatGeobuf et GeoParquet pour des requêtes par emprise en HTTP Range")
+    parser.add_argument('--parquet', required=True,
+                        help='Fichier Parquet, répertoire de fichiers Parquet ou répertoire de construction incrémentale')
+    parser.add_argument('--fgb', required=True, help='Répertoire produit par export_flatgeobuf.py')
+    parser.add_argument('--departement', required=True, help='Département interrogé')
+    parser.add_argument('--type', default='parcelles', help="Type d'objet interrogé (par défaut: parcelles)")
+    parser.add_argument('--requests', type=int, default=20, help="Nombre d'emprises tirées (par défaut: 20)")
+    parser.add_argument('--size', type=float, default=200.0, help="Côté des emprises en mètres (par défaut: 200)")
+    parser.add_argument('--seed', type=int, default=0, help='Graine du tirage des emprises (par défaut: 0)')
+    parser.add_argument('--delay', type=float, default=0.0,
+                        help='Délai en millisecondes ajouté à chaque requête HTTP pour simuler un serveur distant')
+    parser.add_argument('--bandwidth', type=float, default=0.0,
+                        help='Débit maximal du serveur en Mo/s pour simuler un serveur distant (par défaut: illimité)')
+    parser.add_argument('--output', help='Fichier JSON des résultats détaillés')
+    args = parser.parse_args()
+
+    resultats = executer(args.parquet, args.fgb, args.departement, args.type, args.requests, args.size,
+                         args.seed, args.delay / 1000, args.bandwidth * 1e6)
+
+    print(f"{args.requests} emprises de {args.size:g} m sur {args.type} du département {args.departement}:")
+    print(f"{'format':<12}{'fichier Mo':>12}{'entités':>10}{'Ko/req. p50':>14}{'Ko/req. p95':>14}"
+          f"{'HTTP/req.':>11}{'latence p50':>13}{'latence p95':>13}")
+    for format_ in ("flatgeobuf", "parquet"):
+        r = resultats[format_]
+        print(f"{format_:<12}{resultats['fichiers'][format_] / 1e6:>12.2f}{r['entites']:>10}"
+              f"{r['octets']['p50'] / 1024:>14.1f}{r['octets']['p95'] / 1024:>14.1f}"
+              f"{r['requetes_http']['moyenne']:>11.1f}{r['latence_s']['p50']:>12.3f}s{r['latence_s']['p95']:>12.3f}s")
+    if resultats["flatgeobuf"]["entites"] != resultats["parquet"]["entites"]:
+        print("Attention: les deux formats ne retournent pas le même nombre d'entités.")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(resultats, f, indent=2, ensure_ascii=False)
+        print(f"Résultats écrits dans {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
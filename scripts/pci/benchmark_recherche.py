@@ -0,0 +1,138 @@
+import os
+import sys
+import glob
+import json
+import time
+import random
+import argparse
+
+from serveur_test import demarrer_serveur
+from instrumentation import statistiques
+from detection_changements import motif_parquet
+from recherche_parcelles import rechercher
+
+SCENARIOS = ["unitaire", "lot_commune", "lot_commune_unitaire", "lot_aleatoire"]
+
+
+def tirer_identifiants(fichiers, nombre_unitaires, taille_lot, communes_lot, graine):
+    """
+    Tire les identifiants de parcelles des scénarios à partir des fichiers Parquet.
+
+    Returns:
+        dict: listes d'identifiants par scénario (une liste par requête)
+    """
+    import pyarrow.dataset as ds
+
+    dataset = ds.dataset(fichiers, format="parquet")
+    identifiants = sorted(set(dataset.to_table(columns=["id"], filter=ds.field("type_objet") == "parcelles")
+                              .column("id").drop_null().to_pylist()))
+    if not identifiants:
+        raise ValueError("Aucune parcelle dans les fichiers fournis")
+    alea = random.Random(graine)
+    par_commune = {}
+    for identifiant in identifiants:
+        par_commune.setdefault(identifiant[:5], []).append(identifiant)
+    communes = alea.sample(sorted(par_commune), min(communes_lot, len(par_commune)))
+    dans_communes = [i for c in communes for i in par_commune[c]]
+    lot_commune = alea.sample(dans_communes, min(taille_lot, len(dans_communes)))
+    return {
+        "unitaire": [[alea.choice(identifiants)] for _ in range(nombre_unitaires)],
+        "lot_commune": [lot_commune],
+        # le même lot interrogé identifiant par identifiant, comme le ferait une application sans regroupement
+        "lot_commune_unitaire": [[i] for i in lot_commune],
+        "lot_aleatoire": [alea.sample(identifiants, min(taille_lot, len(identifiants)))],
+    }
+
+
+def mesurer(adresses, requetes):
+    """Exécute les requêtes d'un scénario et retourne les mesures par requête"""
+    resultats = []
+    for identifiants in requetes:
+        debut = time.perf_counter()
+        table, octets, lectures = rechercher(adresses, identifiants)
+        resultats.append({"identifiants": len(identifiants), "trouves": table.num_rows if table is not None else 0,
+                          "octets": octets, "requetes": lectures, "latence_s": time.perf_counter() - debut})
+    return resultats
+
+
+def executer(dispositions, nombre_unitaires=20, taille_lot=200, communes_lot=2, graine=0, delai=0.0, debit=0.0):
+    """
+    Compare des dispositions Parquet (ex: export DuckDB et export optimisé) pour la recherche par identifiant.
+
+    Les fichiers sont servis en HTTP Range par serveur_test.py : les octets et requêtes
+    mesurés sont ceux d'un client distant.
+
+    Returns:
+        dict: mesures par disposition et par scénario
+    """
+    fichiers = {nom: sorted(glob.glob(motif_parquet(chemin))) for nom, chemin in dispositions.items()}
+    for nom, liste in fichiers.items():
+        if not liste:
+            raise FileNotFoundError(f"Aucun fichier Parquet pour {nom}: {dispositions[nom]}")
+    premiers = next(iter(fichiers.values()))
+    scenarios = tirer_identifiants(premiers, nombre_unitaires, taille_lot, communes_lot, graine)
+
+    tous = [os.path.abspath(f) for liste in fichiers.values() for f in liste]
+    racine = os.path.commonpath(tous)
+    racine = racine if os.path.isdir(racine) else os.path.dirname(racine)
+    serveur, url = demarrer_serveur(racine, delai=delai, debit=debit)
+    resultats = {"delai_s": delai, "debit_mo_s": debit / 1e6, "dispositions": {}}
+    try:
+        for nom, liste in fichiers.items():
+            adresses = [url + os.path.relpath(os.path.abspath(f), racine).replace(os.sep, '/') for f in liste]
+            resultats["dispositions"][nom] = {"fichiers": liste, "octets_fichiers": sum(os.path.getsize(f) for f in liste)}
+            for scenario in SCENARIOS:
+                detail = mesurer(adresses, scenarios[scenario])
+                resultats["dispositions"][nom][scenario] = {
+                    "identifiants": sum(d["identifiants"] for d in detail),
+                    "trouves": sum(d["trouves"] for d in detail),
+                    "octets": sum(d["octets"] for d in detail),
+                    "requetes_http": sum(d["requetes"] for d in detail),
+                    "duree_s": round(sum(d["latence_s"] for d in detail), 4),
+                    "latence_s": statistiques([d["latence_s"] for d in detail]),
+                }
+    finally:
+        serveur.shutdown()
+    return resultats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mesure la recherche de parcelles par identifiant selon la disposition des exports Parquet")
+    parser.add_argument('--input', required=True, nargs='+', metavar='NOM=CHEMIN',
+                        help='Dispositions comparées, ex: duckdb=export_duckdb/ optimise=export_optimise/')
+    parser.add_argument('--single', type=int, default=20, help='Nombre de recherches unitaires (par défaut: 20)')
+    parser.add_argument('--batch-size', type=int, default=200, help="Nombre d'identifiants des recherches par lot (par défaut: 200)")
+    parser.add_argument('--batch-communes', type=int, default=2,
+                        help='Nombre de communes dont sont tirés les identifiants du lot groupé (par défaut: 2)')
+    parser.add_argument('--seed', type=int, default=0, help='Graine du tirage des identifiants (par défaut: 0)')
+    parser.add_argument('--delay', type=float, default=0.0,
+                        help='Délai en millisecondes ajouté à chaque requête HTTP pour simuler un serveur distant')
+    parser.add_argument('--bandwidth', type=float, default=0.0,
+                        help='Débit maximal du serveur en Mo/s pour simuler un serveur distant (par défaut: illimité)')
+    parser.add_argument('--output', help='Fichier JSON des résultats')
+    args = parser.parse_args()
+
+    dispositions = {}
+    for definition in args.input:
+        nom, _, chemin = definition.rpartition('=')
+        dispositions[nom or os.path.basename(os.path.normpath(chemin))] = chemin
+
+    resultats = executer(dispositions, args.single, args.batch_size, args.batch_communes, args.seed, args.delay / 1000,
+                         args.bandwidth * 1e6)
+
+    print(f"{'disposition':<14}{'scénario':<22}{'ids':>6}{'trouvés':>9}{'Ko lus':>11}{'HTTP':>7}{'durée':>10}")
+    for nom, mesures_disposition in resultats["dispositions"].items():
+        for scenario in SCENARIOS:
+            r = mesures_disposition[scenario]
+            print(f"{nom:<14}{scenario:<22}{r['identifiants']:>6}{r['trouves']:>9}{r['octets'] / 1024:>11.1f}"
+                  f"{r['requetes_http']:>7}{r['duree_s']:>9.3f}s")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(resultats, f, indent=2, ensure_ascii=False)
+        print(f"Résultats écrits dans {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,416 @@
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import concurrent.futures
+
+from instrumentation import Instrumentation, ajouter_arguments, depuis_arguments, fichier_profil, profiler, afficher_resume
+from optimisation_parquet import options_ecriture, tri_declare, fichiers_entree
+
+ENCODAGES = ("geoarrow", "wkb")
+
+# Encodages GeoArrow natifs par famille de géométries (types GeoParquet présents -> encodage)
+FAMILLES = (
+    ({"Point"}, "point"),
+    ({"Point", "MultiPoint"}, "multipoint"),
+    ({"LineString"}, "linestring"),
+    ({"LineString", "MultiLineString"}, "multilinestring"),
+    ({"Polygon"}, "polygon"),
+    ({"Polygon", "MultiPolygon"}, "multipolygon"),
+)
+
+# Type déclaré après promotion des géométries simples
+PROMOTIONS = {"multipoint": "MultiPoint", "multilinestring": "MultiLineString", "multipolygon": "MultiPolygon"}
+
+# Noms des niveaux de listes GeoArrow, du plus interne au plus externe
+NIVEAUX = {
+    "point": (),
+    "linestring": ("vertices",),
+    "polygon": ("vertices", "rings"),
+    "multipoint": ("points",),
+    "multilinestring": ("vertices", "linestrings"),
+    "multipolygon": ("vertices", "rings", "polygons"),
+}
+
+# Mesures de l'étape, remplacées dans main() selon les options --verbose/--journal
+mesures = Instrumentation("compactage_geometrie")
+
+
+def pas_grille(grille):
+    """
+    Retourne le pas de quantification effectif pour une grille demandée (en unités du SRID).
+
+    Le pas est ramené à la puissance de deux inférieure ou égale (1 cm -> 1/128 m) :
+    un multiple d'une puissance de deux est exact en float64 et les bits de poids faible
+    de sa mantisse sont nuls, ce que ZSTD compresse une fois les octets séparés
+    (BYTE_STREAM_SPLIT). Un pas décimal comme 0.01 ne produit pas ces zéros.
+    """
+    if not grille:
+        return None
+    if grille <= 0:
+        raise ValueError(f"Grille de quantification invalide: {grille}")
+    return 2.0 ** math.floor(math.log2(grille))
+
+
+def quantifier(coordonnees, pas):
+    """Arrondit des coordonnées au multiple du pas le plus proche"""
+    import numpy as np
+
+    return coordonnees if pas is None else np.round(coordonnees / pas) * pas
+
+
+def encodage_natif(types_geometrie):
+    """Retourne l'encodage GeoArrow natif d'un ensemble de types de géométries GeoParquet"""
+    types = {t.removesuffix(" Z") for t in types_geometrie}
+    for famille, encodage in FAMILLES:
+        if types <= famille:
+            return encodage
+    raise ValueError(f"Types de géométries mélangés ({', '.join(sorted(types))}) : "
+                     f"l'encodage GeoArrow natif n'est pas possible, utilisez --encoding wkb")
+
+
+def types_fichier(parquet, colonne):
+    """
+    Retourne les types de géométries d'un fichier Parquet.
+
+    Les types déclarés dans les métadonnées GeoParquet sont utilisés s'ils existent,
+    sinon la colonne de géométrie est parcourue.
+    """
+    import numpy as np
+    import shapely
+
+    geo = json.loads(parquet.schema_arrow.metadata[b"geo"])
+    declares = geo["columns"][colonne].get("geometry_types")
+    if declares:
+        return set(declares)
+    types = set()
+    for lot in parquet.iter_batches(columns=[colonne]):
+        geometries = shapely.from_wkb(lot.column(0).to_numpy(zero_copy_only=False))
+        types.update(shapely.GeometryType(t).name for t in np.unique(shapely.get_type_id(geometries)) if t >= 0)
+    noms = {"POINT": "Point", "LINESTRING": "LineString", "POLYGON": "Polygon", "MULTIPOINT": "MultiPoint",
+            "MULTILINESTRING": "MultiLineString", "MULTIPOLYGON": "MultiPolygon"}
+    return {noms.get(t, t) for t in types}
+
+
+def type_geoarrow(encodage):
+    """Retourne le type Arrow d'un encodage GeoArrow natif (coordonnées séparées x/y)"""
+    import pyarrow as pa
+
+    type_ = pa.struct([pa.field("x", pa.float64(), nullable=False), pa.field("y", pa.float64(), nullable=False)])
+    for nom in NIVEAUX[encodage]:
+        type_ = pa.list_(pa.field(nom, type_, nullable=False))
+    return type_
+
+
+def encoder_geoarrow(geometries, encodage, pas):
+    """
+    Encode des géométries shapely en tableau GeoArrow natif, coordonnées quantifiées.
+
+    Les polygones simples sont promus en multipolygones si l'encodage l'exige
+    (de même pour les points et les lignes).
+
+    Returns:
+        pyarrow.Array: tableau GeoArrow, nul pour les géométries absentes
+    """
+    import numpy as np
+    import pyarrow as pa
+    import shapely
+
+    absentes = shapely.is_missing(geometries)
+    geometries = np.where(absentes, shapely.from_wkt(encodage.upper() + " EMPTY"), geometries)
+    if encodage.startswith("multi"):
+        simples = shapely.get_type_id(geometries) == {"multipoint": 0, "multilinestring": 1, "multipolygon": 3}[encodage]
+        if simples.any():
+            promotion = {"multipoint": shapely.multipoints, "multilinestring": shapely.multilinestrings,
+                         "multipolygon": shapely.multipolygons}[encodage]
+            geometries = geometries.copy()
+            geometries[simples] = promotion(geometries[simples][:, None])
+    _, coordonnees, decalages = shapely.to_ragged_array(geometries, include_z=False)
+    coordonnees = quantifier(coordonnees, pas)
+
+    masque = pa.array(absentes) if absentes.any() else None
+    type_ = type_geoarrow(encodage)
+    types_niveaux = [type_]
+    while pa.types.is_list(types_niveaux[-1]):
+        types_niveaux.append(types_niveaux[-1].value_type)
+    types_niveaux.reverse()
+    tableau = pa.StructArray.from_arrays([pa.array(coordonnees[:, 0]), pa.array(coordonnees[:, 1])],
+                                         fields=list(types_niveaux[0]), mask=masque if not decalages else None)
+    for niveau, (offsets, type_niveau) in enumerate(zip(decalages, types_niveaux[1:])):
+        dernier = niveau == len(decalages) - 1
+        tableau = pa.ListArray.from_arrays(pa.array(offsets, pa.int32()), tableau, type=type_niveau,
+                                           mask=masque if dernier else None)
+    return tableau
+
+
+def decoder_geoarrow(tableau, encodage):
+    """Décode un tableau GeoArrow natif en géométries shapely (None pour les valeurs nulles)"""
+    import numpy as np
+    import shapely
+
+    absentes = tableau.is_null().to_numpy(zero_copy_only=False)
+    decalages = []
+    valeurs = tableau
+    for _ in NIVEAUX[encodage]:
+        decalages.append(valeurs.offsets.to_numpy())
+        valeurs = valeurs.values
+    coordonnees = np.column_stack([valeurs.field("x").to_numpy(), valeurs.field("y").to_numpy()])
+    type_ = getattr(shapely.GeometryType, encodage.upper())
+    geometries = shapely.from_ragged_array(type_, coordonnees, tuple(reversed(decalages)) or None)
+    geometries[absentes] = None
+    return geometries
+
+
+def encoder_wkb(geometries, pas):
+    """Encode des géométries shapely en WKB 2D, coordonnées quantifiées"""
+    import pyarrow as pa
+    import shapely
+
+    if pas is not None:
+        geometries = shapely.transform(geometries, lambda c: quantifier(c, pas))
+    return pa.array(shapely.to_wkb(geometries, output_dimension=2), pa.binary())
+
+
+def verifier_aller_retour(originales, relues, pas):
+    """
+    Compare les coordonnées des géométries relues depuis l'encodage avec les originales.
+
+    L'écart maximal admis est d'un demi-pas avec quantification, nul sans.
+
+    Returns:
+        float: écart maximal constaté
+    """
+    import numpy as np
+    import shapely
+
+    if not np.array_equal(shapely.is_missing(originales), shapely.is_missing(relues)):
+        raise ValueError("Aller-retour: géométries nulles différentes")
+    avant = shapely.get_coordinates(originales)
+    apres = shapely.get_coordinates(relues)
+    if avant.shape != apres.shape or not np.array_equal(shapely.get_num_coordinates(originales),
+                                                        shapely.get_num_coordinates(relues)):
+        raise ValueError("Aller-retour: nombre de sommets différent")
+    ecart = float(np.abs(avant - apres).max()) if len(avant) else 0.0
+    tolerance = pas / 2 if pas is not None else 0.0
+    if ecart > tolerance:
+        raise ValueError(f"Aller-retour: écart de {ecart} supérieur à la tolérance de {tolerance}")
+    return ecart
+
+
+def borne_exterieure(valeurs, champ):
+    """
+    Convertit une borne de couverture au type de son champ en arrondissant vers l'extérieur.
+
+    GDAL écrit geometry_bbox en simple précision : un arrondi au plus proche pourrait
+    exclure de la couverture une géométrie qu'elle doit contenir.
+    """
+    import numpy as np
+    import pyarrow as pa
+
+    if champ.type != pa.float32():
+        return valeurs
+    arrondies = valeurs.astype(np.float32)
+    if champ.name in ("xmin", "ymin"):
+        return np.where(arrondies > valeurs, np.nextafter(arrondies, np.float32(-np.inf)), arrondies)
+    return np.where(arrondies < valeurs, np.nextafter(arrondies, np.float32(np.inf)), arrondies)
+
+
+def metadonnees_encodage(geo, colonne, encodage, types):
+    """Retourne les métadonnées GeoParquet mises à jour pour le nouvel encodage (le CRS est conservé)"""
+    geo = json.loads(json.dumps(geo))
+    description = geo["columns"][colonne]
+    if encodage == "wkb":
+        description["encoding"] = "WKB"
+    else:
+        description["encoding"] = encodage
+        description["geometry_types"] = [PROMOTIONS[encodage]] if encodage in PROMOTIONS \
+            else sorted(t.removesuffix(" Z") for t in types)
+    geo["version"] = "1.1.0"
+    return geo
+
+
+def compacter_fichier(source, sortie, encodage="geoarrow", grille=None, colonne="geometry"):
+    """
+    Réécrit un fichier GeoParquet avec une colonne de géométrie compacte.
+
+    En encodage geoarrow, les géométries sont stockées en GeoArrow natif (listes de
+    structures x/y séparées, encodage BYTE_STREAM_SPLIT) ; en encodage wkb, elles restent
+    en WKB pour les lecteurs GeoParquet 1.0. Avec une grille, les coordonnées sont
+    quantifiées (voir pas_grille) et la couverture geometry_bbox est recalculée.
+    Chaque groupe de lignes est relu après encodage pour vérifier l'aller-retour.
+
+    Returns:
+        dict: lignes, groupes de lignes, pas, écart maximal, géométries devenues invalides, octets
+    """
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    import shapely
+
+    if encodage not in ENCODAGES:
+        raise ValueError(f"Encodage inconnu: {encodage}")
+    pas = pas_grille(grille)
+    parquet = pq.ParquetFile(source)
+    schema = parquet.schema_arrow
+    if not schema.metadata or b"geo" not in schema.metadata:
+        raise ValueError(f"{source} n'a pas de métadonnées GeoParquet")
+    geo = json.loads(schema.metadata[b"geo"])
+    types = types_fichier(parquet, colonne)
+    encodage_colonne = encodage_natif(types) if encodage == "geoarrow" else "wkb"
+
+    position = schema.get_field_index(colonne)
+    if encodage_colonne == "wkb":
+        champ = pa.field(colonne, pa.binary())
+    else:
+        champ = pa.field(colonne, type_geoarrow(encodage_colonne),
+                         metadata={"ARROW:extension:name": f"geoarrow.{encodage_colonne}",
+                                   "ARROW:extension:metadata": "{}"})
+    metadonnees = dict(schema.metadata)
+    metadonnees[b"geo"] = json.dumps(metadonnees_encodage(geo, colonne, encodage_colonne, types)).encode("utf-8")
+    schema_sortie = schema.set(position, champ).with_metadata(metadonnees)
+
+    # l'ordre des lignes est conservé : l'ordre de tri déclaré par la source reste vrai
+    options = options_ecriture(schema_sortie, tri=tri_declare(parquet))
+    if encodage_colonne != "wkb" and pas is not None:
+        # sans quantification, les octets de poids faible sont aléatoires et BYTE_STREAM_SPLIT dégrade la compression
+        chemin = colonne + ".list.element" * len(NIVEAUX[encodage_colonne])
+        options["use_byte_stream_split"] = [f"{chemin}.x", f"{chemin}.y"]
+    couverture = "geometry_bbox" in schema.names
+
+    resultat = {"lignes": 0, "groupes": parquet.num_row_groups, "pas": pas, "ecart_max": 0.0, "invalidees": 0}
+    temporaire = sortie + ".tmp"
+    try:
+        with pq.ParquetWriter(temporaire, schema_sortie, **options) as writer:
+            for numero in range(parquet.num_row_groups):
+                table = parquet.read_row_group(numero)
+                originales = shapely.from_wkb(table.column(colonne).to_numpy(zero_copy_only=False))
+                if encodage_colonne == "wkb":
+                    tableau = encoder_wkb(originales, pas)
+                    relues = shapely.from_wkb(tableau.to_numpy(zero_copy_only=False))
+                else:
+                    tableau = encoder_geoarrow(originales, encodage_colonne, pas)
+                    relues = decoder_geoarrow(tableau, encodage_colonne)
+                ecart = verifier_aller_retour(originales, relues, pas)
+                resultat["ecart_max"] = max(resultat["ecart_max"], ecart)
+                if pas is not None:
+                    valides = shapely.is_valid(originales)
+                    resultat["invalidees"] += int((valides & ~shapely.is_valid(relues)).sum())
+                table = table.set_column(position, champ, tableau)
+                if couverture and pas is not None:
+                    # la couverture doit contenir la géométrie quantifiée pour que le filtrage reste exact
+                    bornes = shapely.bounds(relues)
+                    absentes = np.isnan(bornes[:, 0])
+                    champs = list(schema.field("geometry_bbox").type)
+                    emprise = pa.StructArray.from_arrays(
+                        [pa.array(borne_exterieure(bornes[:, i], c), c.type, mask=absentes) for i, c in enumerate(champs)],
+                        fields=champs, mask=pa.array(absentes) if absentes.any() else None)
+                    table = table.set_column(schema.get_field_index("geometry_bbox"), schema.field("geometry_bbox"), emprise)
+                writer.write_table(table.cast(schema_sortie), row_group_size=table.num_rows)
+                resultat["lignes"] += table.num_rows
+    except BaseException:
+        if os.path.exists(temporaire):
+            os.remove(temporaire)
+        raise
+    parquet.close()
+    os.replace(temporaire, sortie)
+    resultat["octets"] = os.path.getsize(sortie)
+    return resultat
+
+
+def taille_colonne(fichier, colonne="geometry"):
+    """Retourne la taille compressée en octets d'une colonne (toutes ses colonnes feuilles)"""
+    import pyarrow.parquet as pq
+
+    metadata = pq.read_metadata(fichier)
+    total = 0
+    for groupe in range(metadata.num_row_groups):
+        for i in range(metadata.num_columns):
+            colonne_groupe = metadata.row_group(groupe).column(i)
+            if colonne_groupe.path_in_schema.split(".")[0] == colonne:
+                total += colonne_groupe.total_compressed_size
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Réécrit les exports GeoParquet avec une colonne de géométrie compacte (GeoArrow natif ou WKB quantifié)")
+    parser.add_argument('--input', required=True,
+                        help='Fichier Parquet, répertoire de fichiers Parquet ou répertoire de construction incrémentale')
+    parser.add_argument('--output', required=True,
+                        help='Fichier de sortie (un seul fichier en entrée) ou répertoire des fichiers compactés')
+    parser.add_argument('--encoding', choices=ENCODAGES, default="geoarrow",
+                        help='geoarrow: coordonnées x/y séparées (GeoParquet 1.1), wkb: compatible avec les lecteurs GeoParquet 1.0 (par défaut: geoarrow)')
+    parser.add_argument('--grid', type=float,
+                        help='Pas de quantification des coordonnées en unités du SRID, ex: 0.01 pour 1 cm '
+                             '(ramené à la puissance de deux inférieure), par défaut pas de quantification')
+    parser.add_argument('--workers', type=int, default=2, help='Nombre de fichiers réécrits en parallèle (par défaut: 2)')
+    ajouter_arguments(parser)
+    args = parser.parse_args()
+
+    global mesures
+    mesures = depuis_arguments("compactage_geometrie", args)
+
+    fichiers = fichiers_entree(args.input)
+    if not fichiers:
+        print(f"Aucun fichier Parquet trouvé dans {args.input}.")
+        return 1
+    if args.output.endswith(".parquet"):
+        if len(fichiers) > 1:
+            print("Erreur: un fichier de sortie n'est possible qu'avec un seul fichier en entrée.")
+            return 1
+        sorties = {fichiers[0]: args.output}
+    else:
+        os.makedirs(args.output, exist_ok=True)
+        sorties = {f: os.path.join(args.output, os.path.basename(f)) for f in fichiers}
+    if any(os.path.abspath(f) == os.path.abspath(s) for f, s in sorties.items()):
+        print("Erreur: la sortie doit être distincte des fichiers d'entrée.")
+        return 1
+
+    def compacter(fichier):
+        debut = time.perf_counter()
+        resultat = compacter_fichier(fichier, sorties[fichier], args.encoding, args.grid)
+        return resultat, time.perf_counter() - debut
+
+    try:
+        pas = pas_grille(args.grid)
+    except ValueError as e:
+        print(f"Erreur: {e}")
+        return 1
+    if pas is not None and pas != args.grid:
+        print(f"Attention: la grille de {args.grid} est ramenée au pas de {pas} (1/{1 / pas:g}), "
+              f"puissance de deux inférieure.")
+        mesures.evenement("grille", grille_demandee=args.grid, pas=pas)
+    print(f"Compactage de {len(fichiers)} fichiers Parquet (encodage {args.encoding}, pas {pas or 'aucun'})...")
+    echecs = total_avant = total_apres = 0
+    with profiler(args.profil, fichier_profil("compactage_geometrie", args)), \
+            concurrent.futures.ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(compacter, fichier): fichier for fichier in fichiers}
+        for future in concurrent.futures.as_completed(futures):
+            fichier = futures[future]
+            try:
+                resultat, duree = future.result()
+            except Exception as e:
+                echecs += 1
+                mesures.compter("echecs")
+                mesures.evenement("echec", f"Erreur lors du compactage de {fichier}: {e}", fichier=fichier, erreur=str(e))
+                continue
+            avant, apres = taille_colonne(fichier), taille_colonne(sorties[fichier])
+            mesures.observer('latence_s', duree, fichier)
+            mesures.compter("fichiers")
+            mesures.compter("octets", resultat["octets"])
+            mesures.compter("geometries_invalidees", resultat["invalidees"])
+            mesures.evenement("compacte", f"{fichier}: géométries {avant / 1e6:.1f} Mo -> {apres / 1e6:.1f} Mo, "
+                                          f"écart max {resultat['ecart_max']:.4g}, {resultat['invalidees']} géométries devenues invalides",
+                              fichier=fichier, octets_geometrie_avant=avant, octets_geometrie_apres=apres, **resultat)
+            total_avant += avant
+            total_apres += apres
+
+    if total_avant:
+        print(f"Colonnes de géométrie: {total_avant / 1e6:.1f} Mo -> {total_apres / 1e6:.1f} Mo ({total_apres / total_avant:.0%})")
+    afficher_resume(mesures.terminer(args.rapport))
+    return 1 if echecs else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,334 @@
+import os
+import re
+import sys
+import json
+import shutil
+import hashlib
+import zipfile
+import argparse
+import tempfile
+import concurrent.futures
+
+from instrumentation import Instrumentation, ajouter_arguments, depuis_arguments, fichier_profil, profiler, afficher_resume
+from convert_shp_to_parquet import process_shapefile
+from executer_sql import executer_script
+from referentiel import departement_commune
+from optimisation_parquet import optimiser_fichier
+from reprojection import CRS_COMMUNS
+from detection_changements import connexion, litteral
+
+DOSSIER_SCRIPTS = os.path.dirname(os.path.abspath(__file__))
+
+# Manifeste décrivant les archives sources utilisées pour construire un millésime
+MANIFESTE_FILE = "manifeste.json"
+
+# Ordre de tri identique à celui de duckdb_export_pci.sql
+ORDRE_EXPORT = '"departement", "commune", "type_objet"[:8], "section", "id"'
+
+# Mesures de l'étape, remplacées dans main() selon les options --verbose/--journal
+mesures = Instrumentation("construction_incrementale")
+
+
+def signature_archive(chemin, methode):
+    """
+    Calcule l'empreinte d'une archive source.
+
+    Args:
+        chemin (str): Chemin de l'archive zip
+        methode (str): 'crc' (répertoire central du zip : noms, tailles et CRC des membres, sans décompression),
+            'sha256' (contenu complet de l'archive) ou 'taille_mtime' (taille et date de modification)
+
+    Returns:
+        str: Empreinte de l'archive
+    """
+    if methode == 'crc':
+        with zipfile.ZipFile(chemin) as zf:
+            membres = sorted((info.filename, info.CRC, info.file_size) for info in zf.infolist())
+        return hashlib.sha1(repr(membres).encode('utf-8')).hexdigest()
+    if methode == 'sha256':
+        empreinte = hashlib.sha256()
+        with open(chemin, 'rb') as f:
+            for bloc in iter(lambda: f.read(1 << 20), b''):
+                empreinte.update(bloc)
+        return empreinte.hexdigest()
+    stats = os.stat(chemin)
+    return f"{stats.st_size}-{int(stats.st_mtime)}"
+
+
+def scanner_sources(source, methode, workers):
+    """
+    Recense les archives de chaque commune d'un millésime téléchargé.
+
+    Les communes sont repérées par leur dossier .../communes/<insee>/, quelle que soit
+    la profondeur de l'arborescence (nom d'hôte, millésime...).
+
+    Returns:
+        dict: {insee: {"departement": code, "archives": {nom: empreinte}, "chemins": {nom: chemin}}}
+    """
+    communes = {}
+    for root, dirs, files in os.walk(source):
+        parent, insee = os.path.split(root)
+        if os.path.basename(parent) != 'communes':
+            continue
+        archives = {file: os.path.join(root, file) for file in files if file.lower().endswith('.zip')}
+        if archives:
+            communes[insee] = {"departement": departement_commune(insee), "archives": {}, "chemins": archives}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(signature_archive, chemin, methode): (insee, nom)
+                   for insee, commune in communes.items() for nom, chemin in commune["chemins"].items()}
+        for future in concurrent.futures.as_completed(futures):
+            insee, nom = futures[future]
+            communes[insee]["archives"][nom] = future.result()
+    return communes
+
+
+def charger_manifeste(dossier):
+    """Charge le manifeste d'une construction précédente, None s'il n'existe pas"""
+    chemin = os.path.join(dossier, MANIFESTE_FILE)
+    if not os.path.exists(chemin):
+        return None
+    with open(chemin, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def dossier_fragments(build, departement, insee):
+    """Dossier des fichiers Parquet d'une commune dans une construction"""
+    return os.path.join(build, "departements", departement, "donnees", insee)
+
+
+def convertir_commune(insee, chemins, destination):
+    """
+    Décompresse et convertit en Parquet les archives d'une commune.
+
+    Returns:
+        tuple: (insee, succès, message)
+    """
+    with tempfile.TemporaryDirectory(prefix=f"cadastre-{insee}-") as temporaire:
+        for chemin in chemins.values():
+            with zipfile.ZipFile(chemin) as zf:
+                zf.extractall(temporaire)
+        os.makedirs(destination, exist_ok=True)
+        for file in sorted(os.listdir(temporaire)):
+            if not file.lower().endswith('.shp'):
+                continue
+            base = os.path.splitext(file)[0]
+            # même encodage forcé que create_cpg_file.py
+            with open(os.path.join(temporaire, base + '.cpg'), 'w') as f:
+                f.write('88591')
+            success, _, message, _ = process_shapefile(os.path.join(temporaire, file), overwrite=True)
+            if not success:
+                return insee, False, message
+            shutil.move(os.path.join(temporaire, base + '.parquet'), os.path.join(destination, base + '.parquet'))
+    return insee, True, None
+
+
+def lier_fichier(origine, cible):
+    """Reprend un fichier d'une construction précédente par lien physique, ou par copie si le lien est impossible"""
+    if os.path.exists(cible):
+        os.remove(cible)
+    try:
+        os.link(origine, cible)
+    except OSError:
+        shutil.copy2(origine, cible)
+
+
+def reutiliser_commune(precedent, build, departement, insee):
+    """Reprend les fichiers Parquet d'une commune inchangée (lien physique ou copie)"""
+    origine = dossier_fragments(precedent, departement, insee)
+    destination = dossier_fragments(build, departement, insee)
+    os.makedirs(destination, exist_ok=True)
+    for file in os.listdir(origine):
+        lier_fichier(os.path.join(origine, file), os.path.join(destination, file))
+
+
+def construire_departement(build, departement, millesime, crs_commun=None):
+    """
+    Importe les fragments d'un département dans une base DuckDB temporaire avec duckdb_convert_pci.sql
+    puis exporte le département trié dans export/cloudcadastre_<dep>.parquet.
+
+    Les exports sont découpés par département et non par lots comme duckdb_export_pci.sql :
+    un département inchangé est repris tel quel, alors qu'un lot serait réécrit dès qu'un de
+    ses départements change. Les outils de lecture acceptent les deux découpages (motif_parquet).
+    La reprojection vers le CRS commun éventuel se fait en bloc lors de l'optimisation de l'export.
+    """
+    espace = os.path.join(build, "departements", departement)
+    base = os.path.join(espace, "cloudcadastre.duckdb")
+    sortie = os.path.join(build, "export", f"cloudcadastre_{departement}.parquet")
+    if os.path.exists(base):
+        os.remove(base)
+    executer_script(os.path.join(DOSSIER_SCRIPTS, "duckdb_convert_pci.sql"), base,
+                    {"my_workspace": espace, "millesime": millesime}, mesures)
+    with connexion(base) as con:
+        con.execute(f"COPY (SELECT * FROM source_unique ORDER BY {ORDRE_EXPORT}) "
+                    f"TO {litteral(sortie)} (FORMAT parquet, COMPRESSION zstd)")
+    optimiser_fichier(sortie, crs_commun=crs_commun)
+    # la base ne sert qu'à produire l'export, elle doublerait l'espace disque occupé
+    os.remove(base)
+
+
+def reutiliser_departement(precedent, build, departement):
+    """
+    Reprend l'export d'un département inchangé (lien physique ou copie), sans le réécrire.
+
+    Sa colonne millesime garde le millésime de la construction qui l'a produit : le manifeste
+    l'enregistre par département et la fusion porte le millésime construit.
+    """
+    lier_fichier(os.path.join(precedent, "export", f"cloudcadastre_{departement}.parquet"),
+                 os.path.join(build, "export", f"cloudcadastre_{departement}.parquet"))
+
+
+def fusionner(build, millesime, crs_commun=None):
+    """Regroupe les exports départementaux dans cloudcadastrefusion.parquet, avec le millésime construit"""
+    motif = os.path.join(build, "export", "cloudcadastre_*.parquet")
+    sortie = os.path.join(build, "cloudcadastrefusion.parquet")
+    with connexion() as con:
+        # les départements repris portent le millésime de leur dernière reconstruction
+        con.execute(f"COPY (SELECT * REPLACE (DATE {litteral(millesime)} AS \"millesime\") FROM read_parquet({litteral(motif)})) "
+                    f"TO {litteral(sortie)} (FORMAT parquet, COMPRESSION zstd)")
+    optimiser_fichier(sortie, crs_commun=crs_commun)
+
+
+def planifier(communes, manifeste, precedent):
+    """
+    Compare les archives du millésime avec le manifeste de la construction précédente.
+
+    Returns:
+        tuple: (communes à convertir, communes réutilisables, départements à reconstruire)
+    """
+    anciennes = manifeste["communes"] if manifeste else {}
+    a_convertir = []
+    reutilisables = []
+    for insee, commune in sorted(communes.items()):
+        ancienne = anciennes.get(insee)
+        if (ancienne is not None and ancienne["archives"] == commune["archives"]
+                and os.path.isdir(dossier_fragments(precedent, commune["departement"], insee))):
+            reutilisables.append(insee)
+        else:
+            a_convertir.append(insee)
+
+    departements = {communes[insee]["departement"] for insee in a_convertir}
+    # une commune disparue oblige aussi à reconstruire son département
+    departements |= {c["departement"] for insee, c in anciennes.items() if insee not in communes}
+    return a_convertir, reutilisables, departements
+
+
+def construire(source, build, millesime, precedent=None, methode='crc', workers=4, fusion=False, crs_commun=None):
+    """Construit un millésime en ne reconvertissant que les communes dont les archives ont changé"""
+    # les fragments et exports d'une exécution précédente dans le même répertoire ne sont pas réutilisés
+    for dossier in ("departements", "export"):
+        shutil.rmtree(os.path.join(build, dossier), ignore_errors=True)
+    os.makedirs(os.path.join(build, "export"), exist_ok=True)
+
+    print(f"Analyse des archives de {source} (empreinte: {methode})...")
+    communes = scanner_sources(source, methode, workers)
+    manifeste = charger_manifeste(precedent) if precedent else None
+    if precedent and manifeste is None:
+        print(f"Attention: aucun manifeste dans {precedent}, construction complète.")
+    elif manifeste and manifeste.get("signature") != methode:
+        print(f"Attention: la construction précédente utilise l'empreinte {manifeste.get('signature')}, construction complète.")
+        manifeste = None
+
+    a_convertir, reutilisables, departements_modifies = planifier(communes, manifeste, precedent)
+    tous_departements = sorted({c["departement"] for c in communes.values()})
+    print(f"{len(communes)} communes: {len(a_convertir)} à convertir, {len(reutilisables)} réutilisées")
+    print(f"{len(tous_departements)} départements: {len(departements_modifies)} à reconstruire")
+
+    for insee in reutilisables:
+        reutiliser_commune(precedent, build, communes[insee]["departement"], insee)
+        mesures.compter("communes_reutilisees")
+        mesures.evenement("reutilisee", f"Commune {insee} réutilisée", commune=insee)
+
+    echecs = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(convertir_commune, insee, communes[insee]["chemins"],
+                                   dossier_fragments(build, communes[insee]["departement"], insee)): insee
+                   for insee in a_convertir}
+        for future in concurrent.futures.as_completed(futures):
+            insee, success, message = future.result()
+            if success:
+                mesures.compter("fichiers")
+                mesures.compter("communes_converties")
+                mesures.evenement("convertie", f"Commune {insee} convertie", commune=insee)
+            else:
+                echecs.append(insee)
+                mesures.compter("echecs")
+                mesures.evenement("echec", f"Erreur lors de la conversion de {insee}: {message}",
+                                  commune=insee, erreur=message)
+
+    if echecs:
+        print(f"Erreur: {len(echecs)} communes n'ont pas pu être converties, le manifeste n'est pas mis à jour.")
+        return False
+
+    # millésime des données de chaque département : celui de la construction qui a produit son export
+    millesimes_departements = {}
+    for departement in tous_departements:
+        with mesures.chrono(f"departement {departement}"):
+            if departement in departements_modifies or manifeste is None or crs_commun != manifeste.get("crs_commun"):
+                construire_departement(build, departement, millesime, crs_commun)
+                millesimes_departements[departement] = millesime
+                mesures.compter("departements_reconstruits")
+                mesures.evenement("reconstruit", f"Département {departement} reconstruit", departement=departement)
+            else:
+                reutiliser_departement(precedent, build, departement)
+                millesimes_departements[departement] = manifeste.get("departements", {}).get(departement,
+                                                                                             manifeste["millesime"])
+                mesures.compter("departements_reutilises")
+                mesures.evenement("reutilise", f"Département {departement} repris du millésime "
+                                               f"{millesimes_departements[departement]}", departement=departement)
+
+    if fusion:
+        print("Fusion des exports départementaux...")
+        fusionner(build, millesime, crs_commun)
+
+    nouveau_manifeste = {
+        "millesime": millesime,
+        "signature": methode,
+        "crs_commun": crs_commun,
+        "departements": millesimes_departements,
+        "communes": {insee: {"departement": c["departement"], "archives": c["archives"]}
+                     for insee, c in sorted(communes.items())},
+    }
+    with open(os.path.join(build, MANIFESTE_FILE), 'w', encoding='utf-8') as f:
+        json.dump(nouveau_manifeste, f, indent=1)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Construit un millésime en réutilisant les communes inchangées du millésime précédent")
+    parser.add_argument('--input', required=True, help='Répertoire des archives téléchargées du millésime (sortie de telechargement.py)')
+    parser.add_argument('--output', required=True, help='Répertoire de construction du millésime')
+    parser.add_argument('--millesime', required=True, help='Millésime construit, ex: 2025-04-01')
+    parser.add_argument('--previous', help='Répertoire de construction du millésime précédent (construction complète si absent)')
+    parser.add_argument('--signature', choices=['crc', 'sha256', 'taille_mtime'], default='crc',
+                        help="Méthode de comparaison des archives (par défaut: crc, lu dans le répertoire central du zip)")
+    parser.add_argument('--workers', type=int, default=4, help='Nombre de processus parallèles (par défaut: 4)')
+    parser.add_argument('--fusion', action='store_true', help='Produit aussi cloudcadastrefusion.parquet')
+    parser.add_argument('--common-crs', type=int, choices=CRS_COMMUNS,
+                        help='Ajoute aux exports la géométrie reprojetée dans ce CRS (colonne geometry_<crs>)')
+    ajouter_arguments(parser)
+    args = parser.parse_args()
+
+    global mesures
+    mesures = depuis_arguments("construction_incrementale", args)
+
+    if not os.path.isdir(args.input):
+        print(f"Erreur: {args.input} n'est pas un répertoire valide.")
+        return 1
+    if not re.fullmatch(r'\d{4}-\d{2}-\d{2}', args.millesime):
+        print(f"Erreur: le millésime {args.millesime} doit être au format AAAA-MM-JJ.")
+        return 1
+    if args.previous and os.path.abspath(args.previous) == os.path.abspath(args.output):
+        print("Erreur: le répertoire de construction doit être différent de celui du millésime précédent.")
+        return 1
+
+    with profiler(args.profil, fichier_profil("construction_incrementale", args)):
+        succes = construire(args.input, args.output, args.millesime, args.previous, args.signature,
+                            args.workers, args.fusion, args.common_crs)
+
+    afficher_resume(mesures.terminer(args.rapport))
+    return 0 if succes else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,227 @@
+import os
+import sys
+import glob
+import json
+import argparse
+import collections
+import concurrent.futures
+
+from instrumentation import Instrumentation, ajouter_arguments, depuis_arguments, fichier_profil, profiler, afficher_resume
+from detection_changements import motif_parquet
+from referentiel import srid_departement
+
+# Emprise plausible des coordonnées (xmin, ymin, xmax, ymax) pour chaque SRID attendu
+EMPRISES_SRID = {
+    2154: (-400000.0, 5900000.0, 1400000.0, 7300000.0),
+    5490: (300000.0, 1300000.0, 900000.0, 2100000.0),
+    2972: (0.0, 100000.0, 600000.0, 700000.0),
+    2975: (250000.0, 7550000.0, 450000.0, 7750000.0),
+    4471: (400000.0, 8450000.0, 700000.0, 8700000.0),
+}
+
+# Catégories dont chaque objet doit porter un identifiant
+TYPES_AVEC_ID = ("communes", "sections", "feuilles", "parcelles", "prefixes_sections")
+
+COLONNES = ["departement", "type_objet", "commune", "id", "parcelle", "geom_srid", "geometry"]
+
+INDICATEURS = ["lignes", "illisibles", "vides", "invalides", "reparables", "srid_incorrect", "hors_emprise",
+               "commune_nulle", "id_nul", "parcelle_nulle", "subdivisions_orphelines"]
+
+# Mesures de l'étape, remplacées dans main() selon les options --verbose/--journal
+mesures = Instrumentation("controle_qualite")
+
+
+def controler_lot(lot):
+    """
+    Calcule les indicateurs de qualité d'un lot Arrow sans boucle Python par entité.
+
+    Returns:
+        tuple: (table Arrow des compteurs par département et type d'objet,
+                identifiants des parcelles du lot, parcelles référencées par les subdivisions du lot)
+    """
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import shapely
+
+    departements = lot.column("departement")
+    types = lot.column("type_objet")
+    wkb = lot.column("geometry").to_numpy(zero_copy_only=False)
+    geometries = shapely.from_wkb(wkb, on_invalid='ignore')
+
+    absentes = shapely.is_missing(geometries)
+    illisibles = absentes & pc.is_valid(lot.column("geometry")).to_numpy(zero_copy_only=False)
+    vides = absentes | shapely.is_empty(geometries)
+    invalides = ~vides & ~shapely.is_valid(geometries)
+    reparables = np.zeros(len(lot), dtype=bool)
+    if invalides.any():
+        reparees = shapely.make_valid(geometries[invalides])
+        reparables[invalides] = shapely.is_valid(reparees) & ~shapely.is_empty(reparees)
+
+    # SRID attendu par département, calculé une fois par valeur distincte
+    distincts = pc.unique(departements)
+    attendus = pa.array([srid_departement(d) for d in distincts.to_pylist()], pa.int32())
+    srid_attendu = pc.take(attendus, pc.index_in(departements, distincts)).to_numpy(zero_copy_only=False)
+    srid = pc.fill_null(lot.column("geom_srid"), -1).to_numpy(zero_copy_only=False)
+    srid_incorrect = srid != srid_attendu
+
+    # emprise plausible des coordonnées selon le SRID attendu (pas de contrôle pour le SRID 0)
+    bornes = shapely.bounds(geometries)
+    codes = np.array(sorted(EMPRISES_SRID))
+    emprises = np.array([EMPRISES_SRID[c] for c in codes])
+    indices = np.minimum(np.searchsorted(codes, srid_attendu), len(codes) - 1)
+    connus = codes[indices] == srid_attendu
+    emprises = emprises[indices]
+    hors_emprise = connus & ~vides & ((bornes[:, 0] < emprises[:, 0]) | (bornes[:, 1] < emprises[:, 1])
+                                      | (bornes[:, 2] > emprises[:, 2]) | (bornes[:, 3] > emprises[:, 3]))
+
+    est_subdivision = pc.equal(types, "subdivisions_fiscales")
+    parcelle_nulle = pc.and_(est_subdivision, pc.is_null(lot.column("parcelle")))
+    id_nul = pc.and_(pc.is_in(types, pa.array(TYPES_AVEC_ID)), pc.is_null(lot.column("id")))
+
+    compteurs = pa.table({
+        "departement": departements,
+        "type_objet": types,
+        "illisibles": illisibles.astype(np.int64),
+        "vides": vides.astype(np.int64),
+        "invalides": invalides.astype(np.int64),
+        "reparables": reparables.astype(np.int64),
+        "srid_incorrect": srid_incorrect.astype(np.int64),
+        "hors_emprise": hors_emprise.astype(np.int64),
+        "commune_nulle": pc.cast(pc.is_null(lot.column("commune")), pa.int64()),
+        "id_nul": pc.cast(pc.fill_null(id_nul, False), pa.int64()),
+        "parcelle_nulle": pc.cast(pc.fill_null(parcelle_nulle, False), pa.int64()),
+    })
+    agregats = compteurs.group_by(["departement", "type_objet"]).aggregate(
+        [("departement", "count")] + [(nom, "sum") for nom in INDICATEURS[1:-1]])
+
+    est_parcelle = pc.fill_null(pc.equal(types, "parcelles"), False)
+    avec_reference = pc.fill_null(pc.and_(est_subdivision, pc.is_valid(lot.column("parcelle"))), False)
+    parcelles = lot.filter(est_parcelle).select(["departement", "id"])
+    references = lot.filter(avec_reference).select(["departement", "parcelle"])
+    return agregats, parcelles, references
+
+
+def lots(fichiers, taille_lot):
+    """Parcourt les fichiers Parquet lot par lot en ne lisant que les colonnes utiles"""
+    import pyarrow.dataset as ds
+
+    dataset = ds.dataset(fichiers, format="parquet")
+    colonnes = [c for c in COLONNES if c in dataset.schema.names]
+    manquantes = set(COLONNES) - set(colonnes)
+    if manquantes:
+        raise ValueError(f"Colonnes absentes du jeu de données: {', '.join(sorted(manquantes))}")
+    yield from dataset.to_batches(columns=colonnes, batch_size=taille_lot)
+
+
+def controler(fichiers, workers=4, taille_lot=65536):
+    """
+    Contrôle un millésime construit et retourne le rapport par département et type d'objet.
+
+    Les lots sont traités en parallèle (shapely libère le GIL pendant les calculs vectorisés),
+    avec au plus deux lots en attente par worker pour borner la mémoire. Les subdivisions
+    orphelines (référence à une parcelle absente) sont évaluées département par département,
+    le jeu de données étant trié par département.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    rapport = collections.defaultdict(lambda: collections.defaultdict(collections.Counter))
+    parcelles = collections.defaultdict(list)
+    references = collections.defaultdict(list)
+    termines = set()
+
+    def finaliser(departement):
+        termines.add(departement)
+        ids = pa.chunked_array(parcelles.pop(departement, []), pa.string()).combine_chunks()
+        for parcelles_referencees in references.pop(departement, []):
+            orphelines = pc.sum(pc.invert(pc.is_in(parcelles_referencees, value_set=ids))).as_py() or 0
+            rapport[departement]["subdivisions_fiscales"]["subdivisions_orphelines"] += orphelines
+
+    def repartir(table, colonne, destination):
+        for departement in pc.unique(table.column("departement")).to_pylist():
+            masque = pc.equal(table.column("departement"), departement)
+            destination[departement].append(table.column(colonne).filter(masque))
+
+    def integrer(resultat):
+        agregats, parcelles_lot, references_lot = resultat
+        for ligne in agregats.to_pylist():
+            compteur = rapport[ligne["departement"]][ligne["type_objet"]]
+            compteur["lignes"] += ligne["departement_count"]
+            for nom in INDICATEURS[1:-1]:
+                compteur[nom] += ligne[f"{nom}_sum"]
+            mesures.compter("lignes", ligne["departement_count"])
+        departements_lot = set(agregats.column("departement").to_pylist())
+        if departements_lot & termines:
+            mesures.compter("departements_non_tries")
+        repartir(parcelles_lot, "id", parcelles)
+        repartir(references_lot, "parcelle", references)
+        # un département absent du lot courant ne réapparaîtra plus dans un jeu trié par département
+        for departement in set(parcelles) | set(references):
+            if departement not in departements_lot:
+                finaliser(departement)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        en_attente = collections.deque()
+        for lot in lots(fichiers, taille_lot):
+            en_attente.append(executor.submit(controler_lot, lot))
+            mesures.compter("octets", lot.nbytes)
+            if len(en_attente) >= 2 * workers:
+                integrer(en_attente.popleft().result())
+        while en_attente:
+            integrer(en_attente.popleft().result())
+    for departement in set(parcelles) | set(references):
+        finaliser(departement)
+    if mesures.compteurs.get("departements_non_tries"):
+        print("Attention: le jeu de données n'est pas trié par département, le décompte des subdivisions orphelines est approximatif.")
+
+    return {dep: {typ: {nom: compteur.get(nom, 0) for nom in INDICATEURS} for typ, compteur in sorted(types.items())}
+            for dep, types in sorted(rapport.items())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Contrôle la qualité des géométries et des attributs d'un millésime construit")
+    parser.add_argument('--input', required=True,
+                        help='Fichier Parquet, répertoire de fichiers Parquet ou répertoire de construction incrémentale')
+    parser.add_argument('--output', required=True, help='Fichier JSON du rapport de contrôle')
+    parser.add_argument('--workers', type=int, default=4, help='Nombre de lots contrôlés en parallèle (par défaut: 4)')
+    parser.add_argument('--batch-size', type=int, default=65536, help='Nombre de lignes par lot (par défaut: 65536)')
+    ajouter_arguments(parser)
+    args = parser.parse_args()
+
+    global mesures
+    mesures = depuis_arguments("controle_qualite", args)
+
+    fichiers = sorted(glob.glob(motif_parquet(args.input)))
+    if not fichiers:
+        print(f"Aucun fichier Parquet trouvé dans {args.input}.")
+        return 1
+    mesures.compter("fichiers", len(fichiers))
+    print(f"Contrôle de {len(fichiers)} fichiers Parquet...")
+
+    with profiler(args.profil, fichier_profil("controle_qualite", args)):
+        par_departement = controler(fichiers, args.workers, args.batch_size)
+
+    totaux = collections.Counter()
+    for types in par_departement.values():
+        for compteur in types.values():
+            totaux.update(compteur)
+    resume = mesures.terminer()
+    rapport = {
+        "fichiers": fichiers,
+        "duree_s": resume["duree_s"],
+        "totaux": {nom: totaux.get(nom, 0) for nom in INDICATEURS},
+        "departements": par_departement,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(rapport, f, indent=2, ensure_ascii=False)
+
+    print(f"\nRapport écrit dans {args.output}")
+    for nom in INDICATEURS:
+        print(f"- {nom}: {totaux.get(nom, 0)}")
+    afficher_resume(resume)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
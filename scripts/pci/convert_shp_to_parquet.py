@@ -1,22 +1,27 @@
 import os
 import glob
+import time
 import argparse
 import concurrent.futures
 import subprocess
 from pathlib import Path
 
+from instrumentation import ajouter_arguments, depuis_arguments, fichier_profil, profiler, afficher_resume
 
-def process_shapefile(shp_file, overwrite=False):
+
+def process_shapefile(shp_file, overwrite=False, verbose=False):
     """
     Traite un fichier shapefile en le convertissant au format PARQUET.
     
     Args:
         shp_file (str): Chemin complet vers le fichier .shp
         overwrite (bool): Si True, écrase les fichiers existants
+        verbose (bool): Si True, affiche la commande exécutée et son résultat
     
     Returns:
-        tuple: (succès (bool), nom du fichier (str), message (str))
+        tuple: (succès (bool), nom du fichier (str), message (str), durée en secondes (float))
     """
+    debut = time.perf_counter()
     # Extraction du chemin et du nom de fichier sans extension
     path = os.path.dirname(shp_file)
     filename = os.path.splitext(os.path.basename(shp_file))[0]
@@ -25,8 +30,9 @@ def process_shapefile(shp_file, overwrite=False):
     # Vérifier si le fichier de sortie existe déjà
     if os.path.exists(output_file) and not overwrite:
         message = f"Le fichier {output_file} existe déjà. Utilisez --overwrite pour l'écraser."
-        print(message)
-        return False, filename, message
+        if verbose:
+            print(message)
+        return False, filename, message, time.perf_counter() - debut
     
     # Construction de la commande avec un ordre correct des arguments
     # Le fichier d'entrée doit être placé AVANT les options de sortie pour éviter les problèmes d'interprétation
@@ -37,23 +43,26 @@ def process_shapefile(shp_file, overwrite=False):
         cmd += '-overwrite '
     
     # Ajouter l'ordre des arguments en plaçant le fichier de sortie en premier, puis les options, puis le fichier d'entrée
-    cmd += f'-f PARQUET "{path}\\{filename}.parquet" "{path}\\{filename}.shp" -nln {filename} -dsco COMPRESSION=ZSTD'
+    cmd += f'-f PARQUET "{output_file}" "{shp_file}" -nln {filename} -dsco COMPRESSION=ZSTD'
     
-    print(f"Traitement de {shp_file}")
-    print(f"Exécution de la commande: {cmd}")
+    if verbose:
+        print(f"Traitement de {shp_file}")
+        print(f"Exécution de la commande: {cmd}")
     
     # Exécution de la commande
     result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
     
     if result.returncode == 0:
         message = f"Conversion réussie pour {filename}"
-        print(message)
-        return True, filename, message
+        if verbose:
+            print(message)
+        return True, filename, message, time.perf_counter() - debut
     else:
         message = f"Erreur lors de la conversion de {filename}: {result.stderr}"
-        print(f"Erreur lors de la conversion de {filename}")
-        print(f"Erreur: {result.stderr}")
-        return False, filename, message
+        if verbose:
+            print(f"Erreur lors de la conversion de {filename}")
+            print(f"Erreur: {result.stderr}")
+        return False, filename, message, time.perf_counter() - debut
 
 
 def find_shapefiles(root_dir):
@@ -85,11 +94,15 @@ def main():
     parser.add_argument('--root', required=True, help='Dossier racine à parcourir')
     parser.add_argument('--workers', type=int, default=4, help='Nombre de processus parallèles')
     parser.add_argument('--overwrite', action='store_true', help='Écrase les fichiers .parquet existants')
+    ajouter_arguments(parser)
     args = parser.parse_args()
     
+    mesures = depuis_arguments("conversion", args)
+    
     # S'assurer que le chemin existe
     if not os.path.isdir(args.root):
         print(f"Erreur: Le dossier '{args.root}' n'existe pas ou n'est pas accessible.")
+        afficher_resume(mesures.terminer(args.rapport))
         return
     
     # Recherche des fichiers .shp dans l'arborescence
@@ -98,13 +111,16 @@ def main():
     
     if not shp_files:
         print(f"Aucun fichier .shp trouvé dans {args.root} et ses sous-dossiers.")
+        afficher_resume(mesures.terminer(args.rapport))
         return
     
     print(f"Nombre de fichiers .shp trouvés: {len(shp_files)}")
     
     # Traitement parallèle des fichiers
-    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as executor:
-        futures = {executor.submit(process_shapefile, shp_file, args.overwrite): shp_file for shp_file in shp_files}
+    with profiler(args.profil, fichier_profil("conversion", args)), \
+            concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(process_shapefile, shp_file, args.overwrite, args.verbose): shp_file
+                   for shp_file in shp_files}
         
         success_count = 0
         fail_count = 0
@@ -112,20 +128,32 @@ def main():
         results = []
         
         for future in concurrent.futures.as_completed(futures):
-            success, filename, message = future.result()
+            shp_file = futures[future]
+            success, filename, message, duree = future.result()
             results.append((success, filename, message))
+            mesures.observer('latence_s', duree, shp_file)
             
             if success:
                 success_count += 1
+                octets = sum(os.path.getsize(os.path.splitext(shp_file)[0] + ext)
+                             for ext in ('.shp', '.dbf') if os.path.exists(os.path.splitext(shp_file)[0] + ext))
+                mesures.compter("fichiers")
+                mesures.compter("octets", octets)
+                mesures.evenement("converti", shp_file=shp_file, octets=octets, duree_s=round(duree, 4))
             elif "existe déjà" in message:
                 skipped_count += 1
+                mesures.compter("ignores")
+                mesures.evenement("existant", shp_file=shp_file)
             else:
                 fail_count += 1
+                mesures.compter("echecs")
+                mesures.evenement("echec", shp_file=shp_file, erreur=message)
     
     print(f"\nConversion terminée:")
     print(f"- Succès: {success_count}")
     print(f"- Échecs: {fail_count}")
     print(f"- Ignorés (fichiers existants): {skipped_count}")
+    afficher_resume(mesures.terminer(args.rapport))
     
     # Afficher les fichiers qui ont échoué si nécessaire
     if fail_count > 0:
@@ -1,6 +1,11 @@
 import os
 import argparse
 
+from instrumentation import Instrumentation, ajouter_arguments, depuis_arguments, fichier_profil, profiler, afficher_resume
+
+# Mesures de l'étape, remplacées selon les options --verbose/--journal
+mesures = Instrumentation("cpg")
+
 def create_cpg_files(root_directory):
     """
     Parcourt récursivement une arborescence de dossiers à partir de root_directory
@@ -27,7 +32,8 @@ def create_cpg_files(root_directory):
             
             # Vérifier si le fichier .cpg existe déjà
             if os.path.exists(cpg_path):
-                print(f"Le fichier {cpg_path} existe déjà, il ne sera pas modifié.")
+                mesures.compter("ignores")
+                mesures.evenement("existant", f"Le fichier {cpg_path} existe déjà, il ne sera pas modifié.", chemin=cpg_path)
                 continue
             
             # Créer le fichier .cpg
@@ -35,8 +41,11 @@ def create_cpg_files(root_directory):
                 with open(cpg_path, 'w') as f:
                     f.write('88591')
                 created_files += 1
-                print(f"Fichier créé: {cpg_path}")
+                mesures.compter("fichiers")
+                mesures.evenement("cree", f"Fichier créé: {cpg_path}", chemin=cpg_path)
             except Exception as e:
+                mesures.compter("echecs")
+                mesures.evenement("echec", chemin=cpg_path, erreur=str(e))
                 print(f"Erreur lors de la création de {cpg_path}: {e}")
     
     # Afficher les statistiques
@@ -48,12 +57,16 @@ if __name__ == "__main__":
     # Configuration du parser d'arguments
     parser = argparse.ArgumentParser(description='Crée des fichiers .cpg pour chaque fichier .shp trouvé')
     parser.add_argument('--input', required=True, help='Chemin du dossier racine à analyser')
+    ajouter_arguments(parser)
     
     # Récupération des arguments
     args = parser.parse_args()
+    mesures = depuis_arguments("cpg", args)
     
     # Vérifier que le chemin existe
     if os.path.isdir(args.input):
-        create_cpg_files(args.input)
+        with profiler(args.profil, fichier_profil("cpg", args)):
+            create_cpg_files(args.input)
+        afficher_resume(mesures.terminer(args.rapport))
     else:
         print(f"Le chemin '{args.input}' n'est pas un dossier valide.")
\ No newline at end of file
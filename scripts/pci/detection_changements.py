@@ -0,0 +1,303 @@
+import os
+import sys
+import glob
+import json
+import argparse
+from datetime import date
+
+from instrumentation import Instrumentation, ajouter_arguments, depuis_arguments, fichier_profil, profiler, afficher_resume
+from referentiel import srid_departement
+
+# Colonnes attributaires de la vue source_unique comparées entre deux millésimes
+COLONNES_ATTRIBUTS = [
+    "commune", "section", "parcelle", "numero", "prefixe", "code", "lettre", "nom", "created", "updated",
+    "qualite", "modeConfec", "echelle", "ancienne", "type", "contenance",
+]
+
+# Les bâtiments n'ont pas d'identifiant dans les données Etalab : ils sont identifiés par leur géométrie
+# (clé de base, numérotée par selection_objets pour distinguer les doublons)
+CLE_OBJET = """COALESCE("id", "commune" || '-' || hash("geometry")::VARCHAR)"""
+
+# Mesures de l'étape, remplacées dans main() selon les options --verbose/--journal
+mesures = Instrumentation("detection_changements")
+
+
+def motif_parquet(chemin):
+    """
+    Retourne le motif de fichiers Parquet d'un millésime construit.
+
+    Accepte un fichier (cloudcadastrefusion.parquet), un répertoire de construction
+    incrémentale (export/cloudcadastre_<dep>.parquet) ou un répertoire de fichiers Parquet.
+    Dans un répertoire d'exports (donnees), seuls les lots cloudcadastre_*.parquet sont
+    retenus : la fusion et les extraits qui s'y trouvent reprennent les mêmes lignes.
+    """
+    if os.path.isdir(os.path.join(chemin, "export")):
+        return os.path.join(chemin, "export", "cloudcadastre_*.parquet")
+    if os.path.isdir(chemin):
+        lots = os.path.join(chemin, "cloudcadastre_*.parquet")
+        return lots if glob.glob(lots) else os.path.join(chemin, "*.parquet")
+    return chemin
+
+
+def connexion(base=":memory:"):
+    """
+    Ouvre une connexion DuckDB (base en mémoire par défaut), avec l'extension spatial si elle est disponible.
+
+    Les colonnes de géométrie des fichiers GeoParquet sont lues en WKB (BLOB) : DuckDB >= 1.5
+    type chaque colonne GEOMETRY avec le CRS déclaré par son fichier et refuse de lire ensemble
+    des fichiers de projections différentes (lots de métropole et des DROM).
+    """
+    import duckdb
+
+    con = duckdb.connect(base)
+    try:
+        con.execute("LOAD spatial")
+    except duckdb.Error:
+        pass
+    con.execute("SET enable_geoparquet_conversion = false")
+    return con
+
+
+def option_geo(con, source, srids):
+    """
+    Retourne l'option KV_METADATA d'un COPY qui écrit les colonnes d'un fichier lu par connexion().
+
+    Les géométries lues en WKB sont écrites sans métadonnées GeoParquet : elles sont
+    reconstituées avec le CRS des SRID présents (nul s'ils sont plusieurs).
+    """
+    from reprojection import metadonnees_wkb, metadonnees_geo, crs_present
+
+    noms = [nom for nom, *_ in con.execute(f"DESCRIBE SELECT * FROM read_parquet({litteral(source)})").fetchall()]
+    if "geometry" not in noms:
+        return ""
+    geo = metadonnees_geo(metadonnees_wkb(), srids, crs_present(noms))
+    return f", KV_METADATA {{geo: {litteral(json.dumps(geo))}}}"
+
+
+def litteral(valeur):
+    """Échappe une valeur pour l'inclure dans une requête SQL"""
+    return "'" + str(valeur).replace("'", "''") + "'"
+
+
+def selection_objets(source, filtre):
+    """
+    Retourne la requête des lignes d'un millésime avec leur clé d'objet (colonne cle).
+
+    Des bâtiments identiques en double ont la même clé de base (commune et géométrie) :
+    les exemplaires sont numérotés dans l'ordre de leurs attributs pour qu'une jointure
+    entre millésimes associe chaque exemplaire à un seul autre, sans multiplier les lignes.
+    """
+    attributs = ", ".join(f'"{c}"' for c in COLONNES_ATTRIBUTS)
+    return (f"""SELECT *, {CLE_OBJET} || '#' || row_number() OVER ("""
+            f"""PARTITION BY "type_objet", {CLE_OBJET} ORDER BY hash({attributs})) AS cle """
+            f"FROM read_parquet({litteral(source)}) WHERE {filtre}")
+
+
+def comparer_departement(con, avant, apres, departement, types, millesime_avant, millesime_apres, sortie):
+    """
+    Compare un département entre deux millésimes et écrit les objets modifiés.
+
+    La jointure se fait sur (type_objet, identifiant) à partir de projections légères
+    (empreintes des attributs et de la géométrie), puis seules les lignes modifiées sont
+    relues en entier : la ligne du nouveau millésime pour les ajouts et modifications,
+    celle de l'ancien pour les suppressions.
+
+    Returns:
+        dict: nombre d'objets par type de changement
+    """
+    filtre = f'"departement" = {litteral(departement)} AND "type_objet" IN ({", ".join(map(litteral, types))})'
+    attributs = ", ".join(f'"{c}"' for c in COLONNES_ATTRIBUTS)
+    projection = (f'SELECT "type_objet", cle, hash({attributs}) AS h_attributs, '
+                  f'hash("geometry") AS h_geometrie, "updated"')
+
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE cles AS
+        SELECT
+            COALESCE(n.type_objet, a.type_objet) AS type_objet,
+            COALESCE(n.cle, a.cle) AS cle,
+            CASE
+                WHEN a.cle IS NULL THEN 'ajout'
+                WHEN n.cle IS NULL THEN 'suppression'
+                WHEN a.h_geometrie != n.h_geometrie
+                    AND (a.h_attributs != n.h_attributs OR a.updated IS DISTINCT FROM n.updated) THEN 'attributs_geometrie'
+                WHEN a.h_geometrie != n.h_geometrie THEN 'geometrie'
+                ELSE 'attributs'
+            END AS changement
+        FROM ({projection} FROM ({selection_objets(avant, filtre)})) a
+        FULL OUTER JOIN ({projection} FROM ({selection_objets(apres, filtre)})) n
+            ON a.type_objet = n.type_objet AND a.cle = n.cle
+        WHERE a.cle IS NULL OR n.cle IS NULL
+            OR a.h_geometrie != n.h_geometrie OR a.h_attributs != n.h_attributs
+            OR a.updated IS DISTINCT FROM n.updated
+    """)
+
+    compte = dict(con.execute("SELECT changement, count(*) FROM cles GROUP BY changement").fetchall())
+    if not compte:
+        return compte
+
+    entete = (f"c.changement, DATE {litteral(millesime_avant)} AS millesime_avant, "
+              f"DATE {litteral(millesime_apres)} AS millesime_apres")
+    con.execute(f"""
+        COPY (
+            SELECT {entete}, s.* RENAME (cle AS cle_objet)
+            FROM cles c JOIN ({selection_objets(apres, filtre)}) s
+                ON c.type_objet = s.type_objet AND c.cle = s.cle
+            WHERE c.changement != 'suppression'
+            UNION ALL BY NAME
+            SELECT {entete}, s.* RENAME (cle AS cle_objet)
+            FROM cles c JOIN ({selection_objets(avant, filtre)}) s
+                ON c.type_objet = s.type_objet AND c.cle = s.cle
+            WHERE c.changement = 'suppression'
+            ORDER BY "commune", "type_objet", "changement"
+        ) TO {litteral(sortie)} (FORMAT parquet, COMPRESSION zstd{option_geo(con, apres, {srid_departement(departement)})})
+    """)
+    return compte
+
+
+def lire_millesime(con, chemin):
+    """
+    Retourne le millésime d'un millésime construit.
+
+    Une construction incrémentale reprend les exports des départements inchangés avec leur
+    colonne millesime d'origine : son manifeste donne le millésime construit.
+    """
+    manifeste = os.path.join(chemin, "manifeste.json")
+    if os.path.isfile(manifeste):
+        with open(manifeste, 'r', encoding='utf-8') as f:
+            return date.fromisoformat(json.load(f)["millesime"])
+    return con.execute(f'SELECT max("millesime") FROM read_parquet({litteral(motif_parquet(chemin))})').fetchone()[0]
+
+
+def detecter_changements(avant, apres, sortie, types):
+    """
+    Produit un fichier de changements par département entre deux millésimes construits.
+
+    Returns:
+        dict: résumé des changements par département
+    """
+    con = connexion()
+    millesime_avant, millesime_apres = lire_millesime(con, avant), lire_millesime(con, apres)
+    avant, apres = motif_parquet(avant), motif_parquet(apres)
+    os.makedirs(sortie, exist_ok=True)
+
+    departements = [d for (d,) in con.execute(f"""
+        SELECT DISTINCT "departement" FROM read_parquet({litteral(avant)})
+        UNION SELECT DISTINCT "departement" FROM read_parquet({litteral(apres)})
+        ORDER BY 1
+    """).fetchall()]
+    print(f"Comparaison {millesime_avant} -> {millesime_apres} sur {len(departements)} départements...")
+
+    resume = {"millesime_avant": str(millesime_avant), "millesime_apres": str(millesime_apres),
+              "types": types, "departements": {}}
+    for departement in departements:
+        fichier = os.path.join(sortie, f"changements_{departement}.parquet")
+        if os.path.exists(fichier):
+            os.remove(fichier)
+        with mesures.chrono(departement):
+            compte = comparer_departement(con, avant, apres, departement, types,
+                                          millesime_avant, millesime_apres, fichier)
+        resume["departements"][departement] = compte
+        mesures.compter("departements")
+        for changement, nombre in compte.items():
+            mesures.compter(changement, nombre)
+        mesures.evenement("departement", f"Département {departement}: {compte or 'aucun changement'}",
+                          departement=departement, changements=compte)
+
+    with open(os.path.join(sortie, "resume.json"), 'w', encoding='utf-8') as f:
+        json.dump(resume, f, indent=2, ensure_ascii=False)
+    return resume
+
+
+def construire_temporel(instantane, diffs, sortie, types):
+    """
+    Assemble une table temporelle à partir d'un millésime initial et des changements successifs.
+
+    Chaque version d'un objet porte une période de validité [valide_depuis, valide_jusqu) :
+    une version commence au millésime initial ou au millésime où elle apparaît dans un
+    fichier de changements, et se termine à la version suivante ou à la suppression de l'objet.
+    valide_jusqu est NULL pour les versions encore en vigueur.
+    """
+    con = connexion()
+    filtre_types = f'"type_objet" IN ({", ".join(map(litteral, types))})'
+    # un département sans changement n'a pas de fichier : un répertoire peut n'en contenir aucun
+    fichiers_diffs = [litteral(motif) for motif in (os.path.join(d, "changements_*.parquet") for d in diffs)
+                      if glob.glob(motif)]
+
+    requete = f"""
+        SELECT 'version' AS evenement, "millesime" AS date_evenement, *
+        FROM ({selection_objets(motif_parquet(instantane), filtre_types)})
+    """
+    if fichiers_diffs:
+        # la clé enregistrée par detection_changements suit la numérotation des doublons de chaque millésime
+        requete += f"""
+            UNION ALL BY NAME
+            SELECT
+                CASE WHEN changement = 'suppression' THEN 'suppression' ELSE 'version' END AS evenement,
+                millesime_apres AS date_evenement, cle_objet AS cle,
+                * EXCLUDE (changement, millesime_avant, millesime_apres, cle_objet)
+            FROM read_parquet([{", ".join(fichiers_diffs)}], union_by_name = true)
+            WHERE {filtre_types}
+        """
+    con.execute(f"CREATE OR REPLACE TEMP VIEW evenements AS {requete}")
+    sources_srid = [litteral(motif_parquet(instantane))] + fichiers_diffs
+    srids = {s for (s,) in con.execute(
+        f'SELECT DISTINCT "geom_srid" FROM read_parquet([{", ".join(sources_srid)}], union_by_name = true)').fetchall()}
+    con.execute(f"""
+        COPY (
+            SELECT * EXCLUDE (evenement, date_evenement, cle, "millesime"),
+                date_evenement AS valide_depuis, valide_jusqu
+            FROM (
+                SELECT *, lead(date_evenement) OVER (
+                    PARTITION BY "type_objet", cle ORDER BY date_evenement, evenement = 'version'
+                ) AS valide_jusqu
+                FROM evenements
+            )
+            WHERE evenement = 'version'
+            ORDER BY "departement", "commune", "type_objet", "id", valide_depuis
+        ) TO {litteral(sortie)} (FORMAT parquet, COMPRESSION zstd{option_geo(con, motif_parquet(instantane), srids)})
+    """)
+    return con.execute(f"SELECT count(*), count(valide_jusqu) FROM read_parquet({litteral(sortie)})").fetchone()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Détecte les changements de parcelles et bâtiments entre deux millésimes construits")
+    parser.add_argument('--before', required=True,
+                        help='Millésime de référence : fichier Parquet, répertoire de fichiers Parquet ou de construction incrémentale')
+    parser.add_argument('--after', help='Millésime comparé (même forme que --before)')
+    parser.add_argument('--output', required=True,
+                        help='Répertoire des fichiers de changements, ou fichier Parquet de la table temporelle avec --diffs')
+    parser.add_argument('--diffs', nargs='+',
+                        help='Répertoires de changements successifs : assemble une table temporelle à partir de --before')
+    parser.add_argument('--types', default='parcelles,batiments',
+                        help="Types d'objets comparés séparés par des virgules (par défaut: parcelles,batiments)")
+    ajouter_arguments(parser)
+    args = parser.parse_args()
+
+    global mesures
+    mesures = depuis_arguments("detection_changements", args)
+    types = [t.strip() for t in args.types.split(',') if t.strip()]
+
+    if bool(args.after) == bool(args.diffs):
+        print("Erreur: indiquer soit --after (comparaison de deux millésimes), soit --diffs (table temporelle).")
+        return 1
+
+    with profiler(args.profil, fichier_profil("detection_changements", args)):
+        if args.diffs:
+            versions, terminees = construire_temporel(args.before, args.diffs, args.output, types)
+            print(f"Table temporelle écrite dans {args.output}: {versions} versions dont {terminees} terminées")
+        else:
+            resume = detecter_changements(args.before, args.after, args.output, types)
+            totaux = {}
+            for compte in resume["departements"].values():
+                for changement, nombre in compte.items():
+                    totaux[changement] = totaux.get(changement, 0) + nombre
+            print(f"\nChangements {resume['millesime_avant']} -> {resume['millesime_apres']}:")
+            for changement, nombre in sorted(totaux.items()):
+                print(f"- {changement}: {nombre}")
+
+    afficher_resume(mesures.terminer(args.rapport))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
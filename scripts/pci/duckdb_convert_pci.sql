@@ -4,7 +4,7 @@
 SET memory_limit = '16GB';
 SET max_temp_directory_size = '125GB';
 SET VARIABLE my_workspace = 'D:\Users\jrmorreale\Documents\SIG\DGFIP\cloudcadastre';
-SET VARIABLE millesime = '2025-04-01'
+SET VARIABLE millesime = '2025-04-01';
 SET file_search_path = getvariable('my_workspace');
 
 INSTALL spatial;
@@ -145,7 +145,7 @@ SELECT
 	"geometry",
 	"geometry_bbox",
 	CASE 
-		WHEN "departement" NOT IN ('971', '972', '973', '974', '976', '00') THEN 2154
+		WHEN "departement" NOT IN ('971', '972', '973', '974', '976', '000') THEN 2154
 		WHEN "departement" IN ('971', '972') THEN 5490
 		WHEN "departement" = '973' THEN 2972
 		WHEN "departement" = '974' THEN 2975
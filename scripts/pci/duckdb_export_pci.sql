@@ -2,7 +2,7 @@ SET memory_limit = '16GB';
 SET max_temp_directory_size = '125GB';
 
 SET VARIABLE my_workspace = 'D:\Users\jrmorreale\Documents\SIG\DGFIP\cloudcadastre';
-SET VARIABLE millesime = '2025-04-01'
+SET VARIABLE millesime = '2025-04-01';
 SET file_search_path = getvariable('my_workspace');
 SET file_search_path = 'D:\Users\jrmorreale\Documents\SIG\DGFIP\cloudcadastre';
 
@@ -13,54 +13,88 @@ LOAD spatial;
 -- export découpé en plusieurs fichier parquet
 -- diviser par lots de départements
 -- permet d'éviter des erreurs OOM
+-- la cible de chaque COPY est une expression : elle doit être entre parenthèses pour être analysée
 
 COPY (
 	SELECT * FROM source_unique WHERE departement IN ('2A', '2B') 
-	ORDER BY "departement", "commune", "type_objet"[:8], "section") 
-	TO getvariable('my_workspace') || '\donnees\cloudcadastre_2A_2B.parquet' (FORMAT parquet, COMPRESSION zstd);
+	ORDER BY "departement", "commune", "type_objet"[:8], "section", "id") 
+	TO (getvariable('my_workspace') || '\donnees\cloudcadastre_2A_2B.parquet') (FORMAT parquet, COMPRESSION zstd);
 COPY (
 	SELECT * FROM source_unique WHERE departement NOT IN ('2A', '2B') AND "departement"::int <= 10 
-	ORDER BY "departement", "commune", "type_objet"[:8], "section") 
-	TO getvariable('my_workspace') || '\donnees\cloudcadastre_01_10.parquet' (FORMAT parquet, COMPRESSION zstd);
+	ORDER BY "departement", "commune", "type_objet"[:8], "section", "id") 
+	TO (getvariable('my_workspace') || '\donnees\cloudcadastre_01_10.parquet') (FORMAT parquet, COMPRESSION zstd);
 COPY (
 	SELECT * FROM source_unique WHERE departement NOT IN ('2A', '2B') AND "departement"::int > 10 AND "departement"::int <= 25 
-	ORDER BY  "departement", "commune", "type_objet"[:8], "section") 
-	TO getvariable('my_workspace') || '\donnees\cloudcadastre_11_25.parquet' (FORMAT parquet, COMPRESSION zstd);
+	ORDER BY  "departement", "commune", "type_objet"[:8], "section", "id") 
+	TO (getvariable('my_workspace') || '\donnees\cloudcadastre_11_25.parquet') (FORMAT parquet, COMPRESSION zstd);
 COPY (
 	SELECT * FROM source_unique WHERE departement NOT IN ('2A', '2B') AND "departement"::int > 25 AND "departement"::int <= 40 
-	ORDER BY  "departement", "commune", "type_objet"[:8], "section") 
-	TO getvariable('my_workspace') || '\donnees\cloudcadastre_26_40.parquet' (FORMAT parquet, COMPRESSION zstd);
+	ORDER BY  "departement", "commune", "type_objet"[:8], "section", "id") 
+	TO (getvariable('my_workspace') || '\donnees\cloudcadastre_26_40.parquet') (FORMAT parquet, COMPRESSION zstd);
 COPY (
 	SELECT * FROM source_unique WHERE departement NOT IN ('2A', '2B') AND "departement"::int > 40 AND "departement"::int <= 55 
-	ORDER BY  "departement", "commune", "type_objet"[:8], "section") 
-	TO getvariable('my_workspace') || '\donnees\cloudcadastre_41_55.parquet' (FORMAT parquet, COMPRESSION zstd);
+	ORDER BY  "departement", "commune", "type_objet"[:8], "section", "id") 
+	TO (getvariable('my_workspace') || '\donnees\cloudcadastre_41_55.parquet') (FORMAT parquet, COMPRESSION zstd);
 COPY (
 	SELECT * FROM source_unique WHERE departement NOT IN ('2A', '2B') AND "departement"::int > 55 AND "departement"::int <= 70 
-	ORDER BY  "departement", "commune", "type_objet"[:8], "section") 
-	TO getvariable('my_workspace') || '\donnees\cloudcadastre_56_70.parquet' (FORMAT parquet, COMPRESSION zstd);
+	ORDER BY  "departement", "commune", "type_objet"[:8], "section", "id") 
+	TO (getvariable('my_workspace') || '\donnees\cloudcadastre_56_70.parquet') (FORMAT parquet, COMPRESSION zstd);
 COPY (
 	SELECT * FROM source_unique WHERE departement NOT IN ('2A', '2B') AND "departement"::int > 70 AND "departement"::int <= 85 
-	ORDER BY  "departement", "commune", "type_objet"[:8], "section") 
-	TO getvariable('my_workspace') || '\donnees\cloudcadastre_71_85.parquet' (FORMAT parquet, COMPRESSION zstd);
+	ORDER BY  "departement", "commune", "type_objet"[:8], "section", "id") 
+	TO (getvariable('my_workspace') || '\donnees\cloudcadastre_71_85.parquet') (FORMAT parquet, COMPRESSION zstd);
 COPY (
 	SELECT * FROM source_unique WHERE departement NOT IN ('2A', '2B') AND "departement"::int > 85 AND "departement"::int <= 95 
-	ORDER BY  "departement", "commune", "type_objet"[:8], "section") 
-	TO getvariable('my_workspace') || '\donnees\cloudcadastre_86_95.parquet' (FORMAT parquet, COMPRESSION zstd);
+	ORDER BY  "departement", "commune", "type_objet"[:8], "section", "id") 
+	TO (getvariable('my_workspace') || '\donnees\cloudcadastre_86_95.parquet') (FORMAT parquet, COMPRESSION zstd);
+-- DROM : un fichier par SRID pour que chaque fichier ait un seul CRS dans ses métadonnées GeoParquet
+COPY (
+	SELECT * FROM source_unique WHERE departement IN ('971', '972') 
+	ORDER BY  "departement", "commune", "type_objet"[:8], "section", "id") 
+	TO (getvariable('my_workspace') || '\donnees\cloudcadastre_971_972.parquet') (FORMAT parquet, COMPRESSION zstd);
+COPY (
+	SELECT * FROM source_unique WHERE departement = '973' 
+	ORDER BY  "departement", "commune", "type_objet"[:8], "section", "id") 
+	TO (getvariable('my_workspace') || '\donnees\cloudcadastre_973.parquet') (FORMAT parquet, COMPRESSION zstd);
+COPY (
+	SELECT * FROM source_unique WHERE departement = '974' 
+	ORDER BY  "departement", "commune", "type_objet"[:8], "section", "id") 
+	TO (getvariable('my_workspace') || '\donnees\cloudcadastre_974.parquet') (FORMAT parquet, COMPRESSION zstd);
+COPY (
+	SELECT * FROM source_unique WHERE departement = '976' 
+	ORDER BY  "departement", "commune", "type_objet"[:8], "section", "id") 
+	TO (getvariable('my_workspace') || '\donnees\cloudcadastre_976.parquet') (FORMAT parquet, COMPRESSION zstd);
+-- autres codes au-delà de 95 (l'ancien lot 971_976 prenait tout "departement"::int > 95) : aucun fichier s'il n'y en a pas
 COPY (
 	SELECT * FROM source_unique WHERE departement NOT IN ('2A', '2B') AND "departement"::int > 95 
-	ORDER BY  "departement", "commune", "type_objet"[:8], "section") 
-	TO getvariable('my_workspace') || '\donnees\cloudcadastre_971_976.parquet' (FORMAT parquet, COMPRESSION zstd);
+		AND departement NOT IN ('971', '972', '973', '974', '976') 
+	ORDER BY  "departement", "commune", "type_objet"[:8], "section", "id") 
+	TO (getvariable('my_workspace') || '\donnees\cloudcadastre_97_autres.parquet') (FORMAT parquet, COMPRESSION zstd, WRITE_EMPTY_FILE false);
 
--- regroupement de tous les fichiers parquet
+-- regroupement des fichiers parquet de cet export, listés un par un : un lot d'un découpage précédent
+-- resté dans le répertoire (ex: cloudcadastre_971_976.parquet) doublerait ses lignes
+-- les autres codes au-delà de 95, rarement présents, sont relus dans la vue plutôt que dans un lot qui peut manquer
 COPY (
-	SELECT * FROM read_parquet(getvariable('my_workspace') || '\donnees\cloudcadastre_*.parquet')) 
-	TO getvariable('my_workspace') || '\donnees\cloudcadastrefusion.parquet' (FORMAT parquet, COMPRESSION zstd);
+	SELECT * FROM read_parquet([
+		getvariable('my_workspace') || '\donnees\cloudcadastre_01_10.parquet',
+		getvariable('my_workspace') || '\donnees\cloudcadastre_11_25.parquet',
+		getvariable('my_workspace') || '\donnees\cloudcadastre_26_40.parquet',
+		getvariable('my_workspace') || '\donnees\cloudcadastre_2A_2B.parquet',
+		getvariable('my_workspace') || '\donnees\cloudcadastre_41_55.parquet',
+		getvariable('my_workspace') || '\donnees\cloudcadastre_56_70.parquet',
+		getvariable('my_workspace') || '\donnees\cloudcadastre_71_85.parquet',
+		getvariable('my_workspace') || '\donnees\cloudcadastre_86_95.parquet',
+		getvariable('my_workspace') || '\donnees\cloudcadastre_971_972.parquet',
+		getvariable('my_workspace') || '\donnees\cloudcadastre_973.parquet',
+		getvariable('my_workspace') || '\donnees\cloudcadastre_974.parquet',
+		getvariable('my_workspace') || '\donnees\cloudcadastre_976.parquet'])
+	UNION ALL BY NAME
+	SELECT * FROM source_unique WHERE departement NOT IN ('2A', '2B') AND "departement"::int > 95 
+		AND departement NOT IN ('971', '972', '973', '974', '976')) 
+	TO (getvariable('my_workspace') || '\donnees\cloudcadastrefusion.parquet') (FORMAT parquet, COMPRESSION zstd);
 
--- export pour la commune de Lille Lomme Hellemmes
-COPY (
-	SELECT * FROM read_parquet(getvariable('my_workspace') || '\donnees\cloudcadastrefusion.parquet') 
-	WHERE commune = '59350') 
-	TO getvariable('my_workspace') || '\donnees\cloudcadastrefusion_lille.parquet' (FORMAT parquet, COMPRESSION zstd);
+-- les extraits, dont cloudcadastrefusion_lille.parquet (Lille Lomme Hellemmes, commune 59350), sont produits
+-- par extraction_multiple.py (extraits.json) en une seule lecture de cloudcadastrefusion.parquet
 
 .exit
 
@@ -0,0 +1,211 @@
+import os
+import re
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+
+from instrumentation import Instrumentation, ajouter_arguments, depuis_arguments, fichier_profil, profiler, afficher_resume
+
+
+def preparer_sql(texte, variables):
+    """
+    Adapte un script SQL du pipeline à un environnement d'exécution.
+
+    Les valeurs des instructions SET VARIABLE sont remplacées par celles fournies,
+    le chemin de recherche suit la variable my_workspace et les séparateurs de chemin
+    Windows sont convertis sur les autres systèmes.
+
+    Args:
+        texte (str): Contenu du script SQL
+        variables (dict): Valeurs à substituer, par nom de variable
+
+    Returns:
+        str: Script SQL prêt à être exécuté
+    """
+    def litteral(valeur):
+        return "'" + str(valeur).replace("'", "''") + "'"
+
+    def remplacer_variable(correspondance):
+        nom = correspondance.group(2)
+        if nom in variables:
+            return correspondance.group(1) + litteral(variables[nom])
+        return correspondance.group(0)
+
+    texte = re.sub(r"(SET\s+VARIABLE\s+(\w+)\s*=\s*)'[^']*'", remplacer_variable, texte, flags=re.IGNORECASE)
+    if 'my_workspace' in variables:
+        texte = re.sub(r"(SET\s+file_search_path\s*=\s*)'[^']*'",
+                       lambda c: c.group(1) + litteral(variables['my_workspace']), texte, flags=re.IGNORECASE)
+    if os.sep != '\\':
+        texte = texte.replace('\\', '/')
+    return texte
+
+
+def decouper_instructions(texte):
+    """
+    Découpe un script SQL en instructions, en ignorant les commandes du client duckdb (.timer, .exit...).
+
+    Les points-virgules situés dans les chaînes et les commentaires ne sont pas considérés
+    comme des séparateurs. Le découpage s'arrête à la commande .exit.
+
+    Returns:
+        list: Instructions SQL sans le point-virgule final
+    """
+    instructions = []
+    courante = []
+    i = 0
+    debut_ligne = True
+    while i < len(texte):
+        caractere = texte[i]
+        if debut_ligne and caractere == '.':
+            fin = texte.find('\n', i)
+            fin = len(texte) if fin == -1 else fin
+            if texte[i:fin].strip().startswith('.exit'):
+                break
+            i = fin
+            continue
+        if caractere == "'":
+            fin = i + 1
+            while fin < len(texte):
+                if texte[fin] == "'" and texte[fin + 1:fin + 2] == "'":
+                    fin += 2
+                elif texte[fin] == "'":
+                    break
+                else:
+                    fin += 1
+            courante.append(texte[i:fin + 1])
+            i = fin + 1
+            debut_ligne = False
+            continue
+        if texte.startswith('--', i):
+            fin = texte.find('\n', i)
+            i = len(texte) if fin == -1 else fin
+            continue
+        if texte.startswith('/*', i):
+            fin = texte.find('*/', i + 2)
+            i = len(texte) if fin == -1 else fin + 2
+            continue
+        if caractere == ';':
+            instruction = ''.join(courante).strip()
+            if instruction:
+                instructions.append(instruction)
+            courante = []
+        else:
+            courante.append(caractere)
+        if caractere == '\n':
+            debut_ligne = True
+        elif not caractere.isspace():
+            debut_ligne = False
+        i += 1
+    instruction = ''.join(courante).strip()
+    if instruction:
+        instructions.append(instruction)
+    return instructions
+
+
+def executer_script(chemin_sql, base, variables, mesures=None):
+    """
+    Exécute un script SQL instruction par instruction avec le module Python duckdb.
+
+    La durée de chaque instruction est enregistrée dans l'instrumentation fournie,
+    ce qui remplace la commande .timer du client duckdb.
+
+    Args:
+        chemin_sql (str): Chemin du script SQL
+        base (str): Chemin de la base DuckDB
+        variables (dict): Valeurs des variables à substituer
+        mesures (Instrumentation): Instrumentation de l'étape (par défaut: sans journal ni affichage)
+
+    Returns:
+        list: Liste de tuples (instruction, durée en secondes)
+    """
+    import duckdb
+
+    if mesures is None:
+        mesures = Instrumentation(os.path.splitext(os.path.basename(chemin_sql))[0])
+
+    with open(chemin_sql, 'r', encoding='utf-8') as f:
+        instructions = decouper_instructions(preparer_sql(f.read(), variables))
+
+    durees = []
+    with duckdb.connect(base) as con:
+        for instruction in instructions:
+            debut = time.perf_counter()
+            con.execute(instruction)
+            duree = time.perf_counter() - debut
+            resume = ' '.join(instruction.split())[:80]
+            durees.append((resume, duree))
+            mesures.compter("instructions")
+            mesures.observer('latence_s', duree, resume)
+            mesures.evenement("instruction", f"{duree:8.3f}s  {resume}", instruction=resume, duree_s=round(duree, 4))
+    return durees
+
+
+def executer_script_cli(duckdb_exe, chemin_sql, base, variables):
+    """
+    Exécute un script SQL préparé avec le client en ligne de commande duckdb.
+
+    Le client affiche lui-même la durée de chaque instruction (.timer) : seule la durée
+    du script complet est mesurée.
+
+    Returns:
+        int: code retour du client duckdb
+    """
+    with open(chemin_sql, 'r', encoding='utf-8') as f:
+        texte = preparer_sql(f.read(), variables)
+    with tempfile.NamedTemporaryFile('w', suffix='.sql', delete=False, encoding='utf-8') as f:
+        f.write(texte)
+        chemin_prepare = f.name
+    try:
+        return subprocess.run([duckdb_exe, '-bail', '-f', chemin_prepare, base]).returncode
+    finally:
+        os.remove(chemin_prepare)
+
+
+def lire_variables(definitions):
+    """Convertit une liste de définitions nom=valeur en dictionnaire"""
+    variables = {}
+    for definition in definitions or []:
+        nom, _, valeur = definition.partition('=')
+        variables[nom.strip()] = valeur
+    return variables
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exécute un script SQL du pipeline dans une base DuckDB")
+    parser.add_argument('--sql', required=True, help='Chemin du script SQL')
+    parser.add_argument('--base', required=True, help='Chemin de la base DuckDB')
+    parser.add_argument('--variable', action='append', metavar='NOM=VALEUR',
+                        help='Remplace la valeur d\'une variable SET VARIABLE (répétable), ex: my_workspace=/data')
+    parser.add_argument('--duckdb', help='Chemin du client duckdb à utiliser à la place du module Python')
+    ajouter_arguments(parser)
+    args = parser.parse_args()
+
+    variables = lire_variables(args.variable)
+
+    etape = os.path.splitext(os.path.basename(args.sql))[0]
+    mesures = depuis_arguments(etape, args)
+    code = 0
+    try:
+        if args.duckdb:
+            with mesures.chrono(args.sql):
+                code = executer_script_cli(args.duckdb, args.sql, args.base, variables)
+            if code:
+                raise RuntimeError(f"le client duckdb a retourné le code {code}")
+            mesures.compter("scripts")
+        else:
+            with profiler(args.profil, fichier_profil(etape, args)):
+                durees = executer_script(args.sql, args.base, variables, mesures)
+            print(f"{len(durees)} instructions exécutées en {sum(d for _, d in durees):.1f}s")
+    except Exception as e:
+        mesures.compter("echecs")
+        mesures.evenement("echec", erreur=str(e))
+        print(f"Erreur lors de l'exécution de {args.sql}: {e}")
+        code = 1
+    afficher_resume(mesures.terminer(args.rapport))
+    return code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
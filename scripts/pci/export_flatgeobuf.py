@@ -0,0 +1,200 @@
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import subprocess
+import concurrent.futures
+
+from instrumentation import Instrumentation, ajouter_arguments, depuis_arguments, fichier_profil, profiler, afficher_resume
+from detection_changements import motif_parquet, connexion, litteral
+
+# Colonnes non exportées : FlatGeobuf ne connaît pas les structures, l'index spatial remplace l'emprise
+COLONNES_EXCLUES = ("geometry_bbox",)
+
+INDEX_FILE = "index.json"
+
+# Mesures de l'étape, remplacées dans main() selon les options --verbose/--journal
+mesures = Instrumentation("export_flatgeobuf")
+
+
+def lister_couches(fichiers, types=None):
+    """
+    Liste les couches à exporter : une par département et type d'objet.
+
+    Seules les colonnes departement, type_objet et geom_srid sont lues. Une couche présente
+    dans plusieurs fichiers source (lots et fusion d'un même export) est refusée avant tout
+    export : chaque couche donne un seul fichier .fgb, écrit par un seul processus ogr2ogr.
+
+    Returns:
+        list: dictionnaires (fichier, departement, type_objet, srid, entites)
+    """
+    con = connexion()
+    liste = "[" + ", ".join(map(litteral, fichiers)) + "]"
+    filtre = f'WHERE "type_objet" IN ({", ".join(map(litteral, types))})' if types else ""
+    lignes = con.execute(f"""
+        SELECT "departement", "type_objet", list(DISTINCT filename ORDER BY filename),
+            min("geom_srid"), max("geom_srid"), count(*)
+        FROM read_parquet({liste}, filename = true)
+        {filtre}
+        GROUP BY ALL
+        ORDER BY 1, 2
+    """).fetchall()
+    couches = []
+    doublons = []
+    for departement, type_objet, sources, srid_min, srid_max, entites in lignes:
+        if len(sources) > 1:
+            doublons.append(f"{departement}/{type_objet} ({', '.join(os.path.basename(f) for f in sources)})")
+            continue
+        if srid_min != srid_max:
+            print(f"Attention: plusieurs SRID ({srid_min}, {srid_max}) pour {departement}/{type_objet}, "
+                  f"le premier est utilisé.")
+        couches.append({"fichier": sources[0], "departement": departement, "type_objet": type_objet,
+                        "srid": srid_min, "entites": entites})
+    if doublons:
+        raise ValueError(f"couches présentes dans plusieurs fichiers source: {'; '.join(doublons)}")
+    return couches
+
+
+def colonnes_exportees(fichier):
+    """
+    Retourne les colonnes d'un fichier source à reprendre dans les fichiers FlatGeobuf.
+
+    FlatGeobuf n'a qu'une géométrie par entité : si le fichier porte aussi une géométrie
+    dans un CRS commun (geometry_<crs>), seule la colonne geometry est sélectionnée.
+    """
+    import pyarrow.parquet as pq
+
+    schema = pq.read_schema(fichier)
+    geometries = json.loads(schema.metadata[b"geo"])["columns"] if schema.metadata and b"geo" in schema.metadata else {}
+    colonnes = [c for c in schema.names if c not in COLONNES_EXCLUES and c != "geometry"
+                and c not in geometries and c.removesuffix("_bbox") not in geometries]
+    return colonnes + ["geometry"] if len(geometries) > 1 else colonnes
+
+
+def exporter_couche(couche, sortie, colonnes, overwrite=False, verbose=False):
+    """
+    Exporte une couche (département, type d'objet) en FlatGeobuf avec ogr2ogr.
+
+    Le fichier porte l'index R-tree de Hilbert compacté de FlatGeobuf (SPATIAL_INDEX=YES) :
+    les entités sont réordonnées selon la courbe de Hilbert, ce qui permet à un client
+    de lire par requêtes HTTP Range uniquement les entités d'une emprise.
+
+    Returns:
+        tuple: (succès (bool), chemin du fichier (str), message (str), durée en secondes (float))
+    """
+    debut = time.perf_counter()
+    departement, type_objet = couche["departement"], couche["type_objet"]
+    output_file = os.path.join(sortie, departement, f"cadastre-{departement}-{type_objet}.fgb")
+
+    if os.path.exists(output_file) and not overwrite:
+        return False, output_file, f"Le fichier {output_file} existe déjà. Utilisez --overwrite pour l'écraser.", \
+            time.perf_counter() - debut
+    if os.path.exists(output_file):
+        # le pilote FlatGeobuf ne sait pas remplacer une couche dans un fichier existant
+        os.remove(output_file)
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+
+    cmd = ['ogr2ogr', '-f', 'FlatGeobuf', output_file, couche["fichier"],
+           '-where', f"departement = {litteral(departement)} AND type_objet = {litteral(type_objet)}",
+           '-select', ','.join(colonnes),
+           '-nln', f"{type_objet}_{departement}",
+           '-lco', 'SPATIAL_INDEX=YES']
+    # le SRID 0 (enregistrements sans localisation) n'a pas de système de coordonnées connu
+    if couche["srid"]:
+        cmd += ['-a_srs', f"EPSG:{couche['srid']}"]
+
+    if verbose:
+        print(f"Exécution de la commande: {' '.join(cmd)}")
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode == 0:
+        return True, output_file, f"Export réussi pour {output_file}", time.perf_counter() - debut
+    return False, output_file, f"Erreur lors de l'export de {output_file}: {result.stderr}", time.perf_counter() - debut
+
+
+def exporter(source, sortie, types=None, workers=4, overwrite=False, verbose=False):
+    """
+    Exporte un millésime construit en fichiers FlatGeobuf par département et type d'objet.
+
+    Les exports sont lancés en parallèle, un processus ogr2ogr par couche. Un fichier
+    index.json décrit les couches produites (SRID, nombre d'entités, taille).
+
+    Returns:
+        tuple: (nombre de succès, nombre d'échecs, nombre d'ignorés)
+    """
+    fichiers = sorted(glob.glob(motif_parquet(source)))
+    if not fichiers:
+        raise FileNotFoundError(f"Aucun fichier Parquet trouvé dans {source}")
+    couches = lister_couches(fichiers, types)
+    colonnes = {fichier: colonnes_exportees(fichier) for fichier in fichiers}
+    print(f"Export de {len(couches)} couches FlatGeobuf depuis {len(fichiers)} fichiers Parquet...")
+
+    index = []
+    succes = echecs = ignores = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(exporter_couche, couche, sortie, colonnes[couche["fichier"]], overwrite, verbose): couche
+                   for couche in couches}
+        for future in concurrent.futures.as_completed(futures):
+            couche = futures[future]
+            ok, output_file, message, duree = future.result()
+            mesures.observer('latence_s', duree, output_file)
+            if ok:
+                succes += 1
+                octets = os.path.getsize(output_file)
+                mesures.compter("fichiers")
+                mesures.compter("octets", octets)
+                mesures.evenement("exporte", message, fichier=output_file, octets=octets, duree_s=round(duree, 4))
+            elif "existe déjà" in message:
+                ignores += 1
+                mesures.compter("ignores")
+                mesures.evenement("existant", fichier=output_file)
+            else:
+                echecs += 1
+                mesures.compter("echecs")
+                mesures.evenement("echec", message, fichier=output_file, erreur=message)
+                continue
+            index.append({"departement": couche["departement"], "type_objet": couche["type_objet"],
+                          "srid": couche["srid"], "entites": couche["entites"],
+                          "fichier": os.path.relpath(output_file, sortie), "octets": os.path.getsize(output_file)})
+
+    index.sort(key=lambda c: (c["departement"], c["type_objet"]))
+    with open(os.path.join(sortie, INDEX_FILE), 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=2, ensure_ascii=False)
+    return succes, echecs, ignores
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporte un millésime construit en FlatGeobuf indexés par département et type d'objet")
+    parser.add_argument('--input', required=True,
+                        help='Fichier Parquet, répertoire de fichiers Parquet ou répertoire de construction incrémentale')
+    parser.add_argument('--output', required=True, help='Répertoire des fichiers FlatGeobuf (<dep>/cadastre-<dep>-<type>.fgb)')
+    parser.add_argument('--types', help="Types d'objets exportés séparés par des virgules (par défaut: tous)")
+    parser.add_argument('--workers', type=int, default=4, help='Nombre de processus ogr2ogr parallèles (par défaut: 4)')
+    parser.add_argument('--overwrite', action='store_true', help='Écrase les fichiers .fgb existants')
+    ajouter_arguments(parser)
+    args = parser.parse_args()
+
+    global mesures
+    mesures = depuis_arguments("export_flatgeobuf", args)
+    types = [t.strip() for t in args.types.split(',') if t.strip()] if args.types else None
+
+    os.makedirs(args.output, exist_ok=True)
+    try:
+        with profiler(args.profil, fichier_profil("export_flatgeobuf", args)):
+            succes, echecs, ignores = exporter(args.input, args.output, types, args.workers, args.overwrite, args.verbose)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"Erreur: {e}")
+        afficher_resume(mesures.terminer(args.rapport))
+        return 1
+
+    print(f"\nExport terminé:")
+    print(f"- Succès: {succes}")
+    print(f"- Échecs: {echecs}")
+    print(f"- Ignorés (fichiers existants): {ignores}")
+    afficher_resume(mesures.terminer(args.rapport))
+    return 1 if echecs else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,480 @@
+import os
+import re
+import sys
+import glob
+import json
+import queue
+import argparse
+import threading
+import concurrent.futures
+
+from instrumentation import Instrumentation, ajouter_arguments, depuis_arguments, fichier_profil, profiler, afficher_resume
+from detection_changements import motif_parquet
+from optimisation_parquet import options_ecriture, TAILLE_GROUPE
+from referentiel import srid_departement, departement_commune, SRID_METROPOLE
+from reprojection import colonne_commune, metadonnees_geo, transformateur
+
+INDEX_FILE = "index.json"
+
+# Mémoire tampon par extrait avant écriture d'un groupe de lignes (en Mo)
+TAMPON_MO = 32
+
+# Groupes de lignes lus d'avance pendant le routage du groupe courant
+GROUPES_EN_AVANCE = 2
+
+# Nombre de segments par côté de l'emprise d'un polygone avant reprojection : un bord droit
+# dans un CRS est courbe dans un autre, les sommets ajoutés gardent l'emprise reprojetée couvrante
+SEGMENTS_REPROJECTION = 64
+
+# Mesures de l'étape, remplacées dans main() selon les options --verbose/--journal
+mesures = Instrumentation("extraction_multiple")
+
+
+class Cible:
+    """
+    Extrait demandé : communes, départements, emprise ou polygone, éventuellement limité à des types d'objets.
+
+    Les critères renseignés se cumulent (ET) ; les codes d'une même liste s'additionnent (OU).
+    Une emprise ou un polygone est exprimé dans le SRID de la cible : il est comparé à la
+    colonne geometry_<srid> si elle existe, sinon il est reprojeté dans le SRID de chaque
+    département couvert et comparé à la colonne geometry des lignes de ce SRID.
+    """
+
+    def __init__(self, nom, communes=None, departements=None, bbox=None, geometrie=None, srid=SRID_METROPOLE,
+                 types=None):
+        import shapely
+
+        if not re.fullmatch(r'[\w.-]+', nom):
+            raise ValueError(f"Nom d'extrait invalide: {nom}")
+        self.nom = nom
+        self.communes = sorted(set(communes)) if communes else None
+        self.departements = sorted(set(departements)) if departements else None
+        self.types = sorted(set(types)) if types else None
+        self.srid = srid
+        self.geometrie = None
+        if geometrie is not None:
+            self.geometrie = shapely.from_wkt(geometrie) if isinstance(geometrie, str) else geometrie
+            shapely.prepare(self.geometrie)
+            bbox = shapely.bounds(self.geometrie).tolist()
+        self.bbox = tuple(bbox) if bbox else None
+        if not (self.communes or self.departements or self.bbox):
+            raise ValueError(f"L'extrait {nom} n'a ni commune, ni département, ni emprise")
+
+    def srids(self, srids_emprise=None):
+        """
+        Retourne les SRID de la colonne geometry des lignes de l'extrait (None si inconnus).
+
+        srids_emprise donne les SRID dans lesquels l'emprise est comparée à la colonne
+        geometry ; il est None si elle est comparée à une colonne dans un CRS commun.
+        """
+        ensembles = []
+        if self.communes:
+            ensembles.append({srid_departement(departement_commune(c)) for c in self.communes})
+        if self.departements:
+            ensembles.append({srid_departement(d) for d in self.departements})
+        if self.bbox and srids_emprise is not None:
+            ensembles.append(set(srids_emprise))
+        return set.intersection(*ensembles) if ensembles else None
+
+
+def lire_cibles(chemin):
+    """
+    Lit un fichier JSON de cibles : liste d'objets avec nom et au moins un critère parmi
+    communes, departements, bbox [xmin, ymin, xmax, ymax] ou geometrie (WKT), plus srid et types optionnels.
+    """
+    with open(chemin, encoding='utf-8') as f:
+        definitions = json.load(f)
+    return [Cible(d["nom"], d.get("communes"), d.get("departements"), d.get("bbox"), d.get("geometrie"),
+                  d.get("srid", SRID_METROPOLE), d.get("types")) for d in definitions]
+
+
+def lire_polygones(chemin, champ_nom, types=None):
+    """
+    Lit les polygones d'un fichier GeoJSON, un extrait par entité nommé par la propriété champ_nom.
+
+    Le SRID est celui du membre crs (urn:ogc:def:crs:EPSG::2154) s'il existe, sinon 4326 comme le prévoit GeoJSON.
+    """
+    import shapely
+
+    with open(chemin, encoding='utf-8') as f:
+        collection = json.load(f)
+    srid = 4326
+    nom_crs = collection.get("crs", {}).get("properties", {}).get("name", "")
+    if re.search(r'EPSG:+(\d+)$', nom_crs):
+        srid = int(re.search(r'EPSG:+(\d+)$', nom_crs).group(1))
+    cibles = []
+    for entite in collection["features"]:
+        geometrie = shapely.from_geojson(json.dumps(entite["geometry"]))
+        nom = re.sub(r'[^\w.-]+', '_', str(entite["properties"][champ_nom]))
+        cibles.append(Cible(nom, geometrie=geometrie, srid=srid, types=types))
+    return cibles
+
+
+class Sortie:
+    """
+    Fichier Parquet d'un extrait, écrit par groupes de lignes.
+
+    Les lignes routées sont mises en tampon et écrites dès que le tampon atteint la
+    taille d'un groupe de lignes ou la limite de mémoire : la mémoire occupée par extrait
+    est bornée quel que soit le nombre d'extraits.
+    """
+
+    def __init__(self, cible, chemin, schema, taille_groupe, limite_octets):
+        self.cible = cible
+        self.chemin = chemin
+        self.schema = schema
+        self.taille_groupe = taille_groupe
+        self.limite_octets = limite_octets
+        self.verrou = threading.Lock()
+        self.tampon = []
+        self.lignes_tampon = 0
+        self.octets_tampon = 0
+        self.lignes = 0
+        self.writer = None
+
+    def ajouter(self, table):
+        """Ajoute des lignes à l'extrait, en écrivant le tampon s'il est plein"""
+        with self.verrou:
+            self.tampon.append(table)
+            self.lignes_tampon += table.num_rows
+            self.octets_tampon += table.nbytes
+            if self.lignes_tampon >= self.taille_groupe or self.octets_tampon >= self.limite_octets:
+                self._vider()
+
+    def _vider(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if not self.tampon:
+            return
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.chemin + ".tmp", self.schema, **options_ecriture(self.schema))
+        table = pa.concat_tables(self.tampon)
+        self.writer.write_table(table, row_group_size=self.taille_groupe)
+        self.lignes += table.num_rows
+        mesures.compter("lignes", table.num_rows)
+        self.tampon, self.lignes_tampon, self.octets_tampon = [], 0, 0
+
+    def fermer(self):
+        """Écrit le reste du tampon et publie le fichier, retourne le nombre de lignes"""
+        import pyarrow.parquet as pq
+
+        with self.verrou:
+            self._vider()
+            if self.writer is None:
+                # extrait vide : un fichier sans ligne garde le schéma pour les lecteurs
+                self.writer = pq.ParquetWriter(self.chemin + ".tmp", self.schema, **options_ecriture(self.schema))
+            self.writer.close()
+            os.replace(self.chemin + ".tmp", self.chemin)
+        return self.lignes
+
+
+def chemins_statistiques(metadonnees):
+    """Retourne l'indice de chaque colonne feuille par chemin (ex: geometry_bbox.xmin)"""
+    return {metadonnees.schema.column(i).path: i for i in range(metadonnees.num_columns)}
+
+
+def projeter_cible(cible, srid):
+    """
+    Reprojette l'emprise et le polygone d'une cible dans un SRID.
+
+    Le polygone (ou le rectangle de l'emprise) est densifié avant reprojection. La cible
+    n'est pas reprojetée si elle ne recoupe pas le domaine de validité du SRID (départements
+    d'outre-mer pour un polygone en métropole) : aucune ligne de ce SRID ne peut la recouper.
+
+    Returns:
+        tuple: (emprise, polygone préparé ou None), ou None hors du domaine du SRID
+    """
+    import numpy as np
+    import pyproj
+    import shapely
+
+    if srid == cible.srid:
+        return cible.bbox, cible.geometrie
+    domaine = pyproj.CRS.from_epsg(srid).area_of_use
+    if domaine is not None:
+        ouest, sud, est, nord = transformateur(cible.srid, 4326).transform_bounds(*cible.bbox)
+        if ouest > domaine.east or est < domaine.west or sud > domaine.north or nord < domaine.south:
+            return None
+    forme = cible.geometrie if cible.geometrie is not None else shapely.box(*cible.bbox)
+    xmin, ymin, xmax, ymax = cible.bbox
+    forme = shapely.segmentize(forme, max(xmax - xmin, ymax - ymin) / SEGMENTS_REPROJECTION or 1)
+    transformation = transformateur(cible.srid, srid)
+    projetee = shapely.transform(forme, lambda c: np.column_stack(transformation.transform(c[:, 0], c[:, 1])))
+    emprise = tuple(shapely.bounds(projetee).tolist())
+    if not np.isfinite(emprise).all():
+        return None
+    if cible.geometrie is None:
+        # une cible définie par une emprise reste un filtre sur les emprises des géométries
+        return emprise, None
+    shapely.prepare(projetee)
+    return emprise, projetee
+
+
+def emprises_cible(cible, noms, srids):
+    """
+    Retourne la colonne de géométrie comparée à une cible et l'emprise à comparer par SRID.
+
+    Avec une colonne geometry_<srid> dans le SRID de la cible, la comparaison se fait sans
+    filtre sur geom_srid (clé None). Sinon l'emprise et le polygone sont reprojetés dans
+    chaque SRID présent (voir projeter_cible) et comparés aux lignes de ce SRID ; un fichier
+    sans colonne geom_srid est supposé être dans le SRID de la cible.
+
+    Returns:
+        tuple: (colonne, dictionnaire SRID -> (emprise, polygone)), sans SRID si aucune comparaison n'est possible
+    """
+    if colonne_commune(cible.srid) in noms:
+        return colonne_commune(cible.srid), {None: (cible.bbox, cible.geometrie)}
+    if "geom_srid" not in noms or not srids:
+        return "geometry", {None: (cible.bbox, cible.geometrie)}
+    emprises = {}
+    for srid in sorted(s for s in srids if s):
+        projection = projeter_cible(cible, srid)
+        if projection is not None:
+            emprises[srid] = projection
+    return "geometry", emprises
+
+
+def cibles_groupe(groupe, chemins, cibles, spatiales):
+    """
+    Retourne les cibles qui peuvent avoir des lignes dans un groupe de lignes d'après ses statistiques.
+
+    Un groupe sans statistique sur une colonne est conservé pour les critères de cette colonne.
+    """
+    def bornes(chemin):
+        if chemin not in chemins:
+            return None
+        statistiques = groupe.column(chemins[chemin]).statistics
+        if statistiques is None or not statistiques.has_min_max:
+            return None
+        return statistiques.min, statistiques.max
+
+    def recouvre(chemin, valeurs):
+        b = bornes(chemin)
+        return b is None or any(b[0] <= v <= b[1] for v in valeurs)
+
+    retenues = []
+    for cible in cibles:
+        if cible.communes and not recouvre("commune", cible.communes):
+            continue
+        if cible.departements and not recouvre("departement", cible.departements):
+            continue
+        if cible.types and not recouvre("type_objet", cible.types):
+            continue
+        if cible.bbox:
+            colonne, emprises = spatiales[cible.nom]
+            emprise = [bornes(f"{colonne}_bbox.{c}") for c in ("xmin", "ymin", "xmax", "ymax")]
+
+            def recoupe(srid, bbox):
+                if srid is not None and not recouvre("geom_srid", [srid]):
+                    return False
+                return None in emprise or not (emprise[0][0] > bbox[2] or emprise[2][1] < bbox[0]
+                                               or emprise[1][0] > bbox[3] or emprise[3][1] < bbox[1])
+
+            if not any(recoupe(srid, bbox) for srid, (bbox, _) in emprises.items()):
+                continue
+        retenues.append(cible)
+    return retenues
+
+
+def filtrer(table, cible, spatiale):
+    """Retourne les lignes d'un groupe de lignes qui appartiennent à un extrait"""
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import shapely
+
+    masque = pa.array(np.ones(table.num_rows, dtype=bool))
+    if cible.communes:
+        masque = pc.and_(masque, pc.is_in(table.column("commune"), value_set=pa.array(cible.communes)))
+    if cible.departements:
+        masque = pc.and_(masque, pc.is_in(table.column("departement"), value_set=pa.array(cible.departements)))
+    if cible.types:
+        masque = pc.and_(masque, pc.is_in(table.column("type_objet"), value_set=pa.array(cible.types)))
+    masque = pc.fill_null(masque, False).to_numpy(zero_copy_only=False)
+    if cible.bbox and masque.any():
+        colonne, emprises = spatiale
+        # les emprises nulles deviennent NaN et ne recoupent rien
+        emprise = table.column(f"{colonne}_bbox")
+        xmin, ymin, xmax, ymax = (pc.struct_field(emprise, c).to_numpy(zero_copy_only=False)
+                                  for c in ("xmin", "ymin", "xmax", "ymax"))
+        srids = table.column("geom_srid").to_numpy(zero_copy_only=False) if "geom_srid" in table.column_names else None
+        retenues = np.zeros(table.num_rows, dtype=bool)
+        for srid, (bbox, geometrie) in emprises.items():
+            selection = masque & (xmin <= bbox[2]) & (xmax >= bbox[0]) & (ymin <= bbox[3]) & (ymax >= bbox[1])
+            if srid is not None:
+                selection &= srids == srid
+            if geometrie is not None and selection.any():
+                # les emprises ne sont qu'un préfiltre : le polygone est testé sur les géométries restantes
+                indices = np.flatnonzero(selection)
+                geometries = shapely.from_wkb(table.column(colonne).take(indices).to_numpy(zero_copy_only=False))
+                selection[indices] = shapely.intersects(geometrie, geometries)
+            retenues |= selection
+        masque = retenues
+    return table.filter(pa.array(masque))
+
+
+def extraire(source, cibles, sortie, workers=4, taille_groupe=TAILLE_GROUPE, tampon_mo=TAMPON_MO):
+    """
+    Produit tous les extraits en une seule lecture du millésime construit.
+
+    Les groupes de lignes sont sélectionnés sur leurs statistiques (commune, département,
+    type d'objet, emprise) : un groupe qu'aucun extrait ne peut concerner n'est pas lu.
+    Un fil de lecture charge les groupes retenus à l'avance, puis chaque groupe est routé
+    en parallèle vers les extraits concernés.
+
+    Returns:
+        dict: nombre de lignes par extrait
+    """
+    import pyarrow.parquet as pq
+    from reprojection import srids_fichier
+
+    fichiers = sorted(glob.glob(motif_parquet(source)))
+    if not fichiers:
+        raise FileNotFoundError(f"Aucun fichier Parquet trouvé dans {source}")
+    noms = [c.nom for c in cibles]
+    if len(set(noms)) != len(noms):
+        raise ValueError("Deux extraits portent le même nom")
+
+    parquets = [pq.ParquetFile(f) for f in fichiers]
+    schema = parquets[0].schema_arrow
+    for fichier, parquet in zip(fichiers, parquets):
+        if not parquet.schema_arrow.equals(schema, check_metadata=False):
+            raise ValueError(f"Le schéma de {fichier} diffère de celui de {fichiers[0]}")
+
+    srids = set()
+    if any(c.bbox for c in cibles):
+        for parquet in parquets:
+            srids |= srids_fichier(parquet)
+    spatiales = {c.nom: emprises_cible(c, schema.names, srids) for c in cibles if c.bbox}
+    for cible in cibles:
+        if cible.bbox and not spatiales[cible.nom][1]:
+            print(f"Attention: l'emprise de l'extrait {cible.nom} (EPSG:{cible.srid}) ne recoupe le domaine "
+                  f"d'aucun SRID des fichiers, il sera vide.")
+
+    os.makedirs(sortie, exist_ok=True)
+    sorties = {}
+    for cible in cibles:
+        schema_cible = schema
+        srids_emprise = None
+        if cible.bbox and None not in spatiales[cible.nom][1]:
+            srids_emprise = set(spatiales[cible.nom][1])
+        srids_cible = cible.srids(srids_emprise)
+        if schema.metadata and b"geo" in schema.metadata and srids_cible is not None:
+            # le CRS de l'extrait se déduit des départements ou des SRID couverts par l'emprise
+            geo = metadonnees_geo(json.loads(schema.metadata[b"geo"]), srids_cible)
+            schema_cible = schema.with_metadata({**schema.metadata, b"geo": json.dumps(geo).encode("utf-8")})
+        sorties[cible.nom] = Sortie(cible, os.path.join(sortie, f"{cible.nom}.parquet"), schema_cible,
+                                    taille_groupe, tampon_mo * 1024 * 1024)
+
+    plan = []
+    for parquet in parquets:
+        metadonnees = parquet.metadata
+        chemins = chemins_statistiques(metadonnees)
+        for numero in range(metadonnees.num_row_groups):
+            concernees = cibles_groupe(metadonnees.row_group(numero), chemins, cibles, spatiales)
+            if concernees:
+                plan.append((parquet, numero, concernees))
+                mesures.compter("groupes_lus")
+            else:
+                mesures.compter("groupes_ignores")
+    total = sum(p.metadata.num_row_groups for p in parquets)
+    print(f"{len(cibles)} extraits, {len(plan)} groupes de lignes lus sur {total} dans {len(fichiers)} fichiers...")
+
+    # file bornée : la lecture n'avance que de GROUPES_EN_AVANCE groupes sur le routage
+    lus = queue.Queue(maxsize=GROUPES_EN_AVANCE)
+    erreur_lecture = []
+
+    def lire():
+        try:
+            for parquet, numero, concernees in plan:
+                table = parquet.read_row_group(numero)
+                groupe = parquet.metadata.row_group(numero)
+                mesures.compter("octets", sum(groupe.column(i).total_compressed_size for i in range(groupe.num_columns)))
+                lus.put((table, concernees))
+        except Exception as e:
+            erreur_lecture.append(e)
+        finally:
+            lus.put(None)
+
+    def router(table, cible):
+        selection = filtrer(table, cible, spatiales.get(cible.nom))
+        if selection.num_rows:
+            sorties[cible.nom].ajouter(selection)
+
+    lecteur = threading.Thread(target=lire, daemon=True)
+    lecteur.start()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        while (element := lus.get()) is not None:
+            table, concernees = element
+            for future in [executor.submit(router, table, cible) for cible in concernees]:
+                future.result()
+    lecteur.join()
+    if erreur_lecture:
+        raise erreur_lecture[0]
+
+    resultats = {}
+    for nom, fichier_sortie in sorties.items():
+        resultats[nom] = fichier_sortie.fermer()
+        mesures.compter("fichiers")
+        mesures.evenement("extrait", f"{fichier_sortie.chemin}: {resultats[nom]} lignes",
+                          extrait=nom, fichier=fichier_sortie.chemin, lignes=resultats[nom])
+
+    index = [{"nom": nom, "fichier": f"{nom}.parquet", "lignes": lignes,
+              "octets": os.path.getsize(sorties[nom].chemin)} for nom, lignes in sorted(resultats.items())]
+    with open(os.path.join(sortie, INDEX_FILE), 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=2, ensure_ascii=False)
+    return resultats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Produit de nombreux extraits (communes, départements, emprises, polygones) en une seule lecture d'un millésime construit")
+    parser.add_argument('--input', required=True,
+                        help='Fichier Parquet, répertoire de fichiers Parquet ou répertoire de construction incrémentale')
+    parser.add_argument('--output', required=True, help='Répertoire des extraits (<nom>.parquet et index.json)')
+    parser.add_argument('--targets', help='Fichier JSON des extraits: [{"nom": "mel", "communes": ["59350", ...], "types": ["parcelles"]}, '
+                                          '{"nom": "zone", "bbox": [xmin, ymin, xmax, ymax], "srid": 2154}, ...]')
+    parser.add_argument('--communes', help='Codes INSEE séparés par des virgules, un extrait commune_<code> par code')
+    parser.add_argument('--departements', help='Codes départements séparés par des virgules, un extrait departement_<code> par code')
+    parser.add_argument('--polygons', help='Fichier GeoJSON dont chaque entité définit un extrait')
+    parser.add_argument('--name-field', default='nom', help="Propriété GeoJSON donnant le nom de l'extrait (par défaut: nom)")
+    parser.add_argument('--types', help="Types d'objets des extraits --communes, --departements et --polygons séparés par des virgules (par défaut: tous)")
+    parser.add_argument('--workers', type=int, default=4, help='Nombre de fils de routage parallèles (par défaut: 4)')
+    parser.add_argument('--buffer-mb', type=int, default=TAMPON_MO,
+                        help=f"Mémoire tampon maximale par extrait en Mo (par défaut: {TAMPON_MO})")
+    ajouter_arguments(parser)
+    args = parser.parse_args()
+
+    global mesures
+    mesures = depuis_arguments("extraction_multiple", args)
+
+    def liste(valeur):
+        return [v.strip() for v in valeur.split(',') if v.strip()] if valeur else []
+
+    types = liste(args.types) or None
+    try:
+        cibles = lire_cibles(args.targets) if args.targets else []
+        cibles += [Cible(f"commune_{c}", communes=[c], types=types) for c in liste(args.communes)]
+        cibles += [Cible(f"departement_{d}", departements=[d], types=types) for d in liste(args.departements)]
+        if args.polygons:
+            cibles += lire_polygones(args.polygons, args.name_field, types)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Erreur: définition des extraits invalide: {e}")
+        return 1
+    if not cibles:
+        print("Erreur: aucun extrait demandé (--targets, --communes, --departements ou --polygons).")
+        return 1
+
+    with profiler(args.profil, fichier_profil("extraction_multiple", args)):
+        resultats = extraire(args.input, cibles, args.output, args.workers, tampon_mo=args.buffer_mb)
+
+    vides = [nom for nom, lignes in resultats.items() if not lignes]
+    print(f"\nExtraction terminée: {len(resultats)} extraits, {sum(resultats.values())} lignes")
+    if vides:
+        print(f"- Extraits vides: {', '.join(vides)}")
+    afficher_resume(mesures.terminer(args.rapport))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,355 @@
+import os
+import io
+import sys
+import struct
+import random
+import zipfile
+import argparse
+from datetime import date, timedelta
+
+from referentiel import srid_departement
+
+# Champs attributaires des shapefiles Etalab, par catégorie (nom, type dBase, longueur, décimales)
+CHAMPS_CATEGORIES = {
+    "communes": [("id", "C", 5, 0), ("nom", "C", 80, 0), ("created", "D", 8, 0), ("updated", "D", 8, 0)],
+    "sections": [("id", "C", 10, 0), ("commune", "C", 5, 0), ("prefixe", "C", 3, 0), ("code", "C", 2, 0),
+                 ("created", "D", 8, 0), ("updated", "D", 8, 0)],
+    "feuilles": [("id", "C", 12, 0), ("commune", "C", 5, 0), ("prefixe", "C", 3, 0), ("section", "C", 2, 0),
+                 ("numero", "C", 2, 0), ("qualite", "C", 2, 0), ("modeConfec", "C", 2, 0), ("echelle", "N", 6, 0),
+                 ("created", "D", 8, 0), ("updated", "D", 8, 0)],
+    "lieux_dits": [("nom", "C", 80, 0), ("commune", "C", 5, 0), ("created", "D", 8, 0), ("updated", "D", 8, 0)],
+    "prefixes_sections": [("id", "C", 8, 0), ("commune", "C", 5, 0), ("prefixe", "C", 3, 0), ("ancienne", "C", 5, 0),
+                          ("nom", "C", 80, 0), ("created", "D", 8, 0), ("updated", "D", 8, 0)],
+    "parcelles": [("id", "C", 14, 0), ("commune", "C", 5, 0), ("prefixe", "C", 3, 0), ("section", "C", 2, 0),
+                  ("numero", "C", 4, 0), ("contenance", "N", 10, 0), ("arpente", "L", 1, 0),
+                  ("created", "D", 8, 0), ("updated", "D", 8, 0)],
+    "batiments": [("type", "C", 2, 0), ("nom", "C", 80, 0), ("commune", "C", 5, 0),
+                  ("created", "D", 8, 0), ("updated", "D", 8, 0)],
+    "subdivisions_fiscales": [("parcelle", "C", 14, 0), ("lettre", "C", 2, 0),
+                              ("created", "D", 8, 0), ("updated", "D", 8, 0)],
+}
+
+# Nombre d'entités par catégorie, exprimé en proportion du nombre de parcelles d'une commune
+PROPORTIONS_CATEGORIES = {
+    "communes": 0,
+    "prefixes_sections": 0,
+    "sections": 0.02,
+    "feuilles": 0.02,
+    "lieux_dits": 0.05,
+    "parcelles": 1,
+    "batiments": 0.8,
+    "subdivisions_fiscales": 0.1,
+}
+
+# Origine approximative des coordonnées par système de projection (mêmes SRID que duckdb_convert_pci.sql)
+ORIGINES_SRID = {
+    2154: (650000.0, 6200000.0),
+    5490: (650000.0, 1780000.0),
+    2972: (350000.0, 500000.0),
+    2975: (340000.0, 7660000.0),
+    4471: (510000.0, 8580000.0),
+}
+
+NOMS_LIEUX_DITS = ["Le Bourg", "Les Prés", "La Côte", "Le Moulin", "Les Écarts", "La Fontaine", "Le Château", "Les Vignes"]
+
+TAILLE_CELLULE = 30.0
+
+
+def codes_insee(departement, nombre):
+    """Construit une liste de codes INSEE fictifs pour un département"""
+    taille = 5 - len(departement)
+    return [f"{departement}{i:0{taille}d}" for i in range(1, nombre + 1)]
+
+
+def polygone(rng, x, y, largeur, hauteur, sommets):
+    """Construit un anneau fermé dans le sens horaire (convention shapefile) avec des sommets intermédiaires"""
+    coins = [(x, y), (x, y + hauteur), (x + largeur, y + hauteur), (x + largeur, y)]
+    par_cote = max(1, sommets // 4)
+    anneau = []
+    for i in range(4):
+        (x0, y0), (x1, y1) = coins[i], coins[(i + 1) % 4]
+        for j in range(par_cote):
+            t = j / par_cote
+            anneau.append((round(x0 + (x1 - x0) * t + rng.uniform(-0.2, 0.2), 2),
+                           round(y0 + (y1 - y0) * t + rng.uniform(-0.2, 0.2), 2)))
+    anneau.append(anneau[0])
+    return anneau
+
+
+def ecrire_shapefile(anneaux, enregistrements, champs, encodage='latin-1'):
+    """
+    Sérialise des polygones et leurs attributs au format ESRI Shapefile.
+
+    Args:
+        anneaux (list): Liste d'anneaux (une liste de tuples (x, y) par entité)
+        enregistrements (list): Liste de dictionnaires d'attributs, alignée sur anneaux
+        champs (list): Définition des champs dBase (nom, type, longueur, décimales)
+        encodage (str): Encodage des chaînes dans le .dbf
+
+    Returns:
+        tuple: contenu binaire (shp, shx, dbf)
+    """
+    contenus = []
+    for anneau in anneaux:
+        xs = [p[0] for p in anneau]
+        ys = [p[1] for p in anneau]
+        contenu = struct.pack('<i4d2i', 5, min(xs), min(ys), max(xs), max(ys), 1, len(anneau))
+        contenu += struct.pack('<i', 0)
+        contenu += b''.join(struct.pack('<2d', x, y) for x, y in anneau)
+        contenus.append(contenu)
+
+    if anneaux:
+        emprise = (min(min(p[0] for p in a) for a in anneaux), min(min(p[1] for p in a) for a in anneaux),
+                   max(max(p[0] for p in a) for a in anneaux), max(max(p[1] for p in a) for a in anneaux))
+    else:
+        emprise = (0.0, 0.0, 0.0, 0.0)
+
+    def entete(longueur_octets):
+        return (struct.pack('>7i', 9994, 0, 0, 0, 0, 0, longueur_octets // 2)
+                + struct.pack('<2i', 1000, 5) + struct.pack('<8d', *emprise, 0, 0, 0, 0))
+
+    shp = io.BytesIO()
+    shx = io.BytesIO()
+    shp.write(entete(100 + sum(8 + len(c) for c in contenus)))
+    shx.write(entete(100 + 8 * len(contenus)))
+    position = 100
+    for numero, contenu in enumerate(contenus, 1):
+        shx.write(struct.pack('>2i', position // 2, len(contenu) // 2))
+        shp.write(struct.pack('>2i', numero, len(contenu) // 2))
+        shp.write(contenu)
+        position += 8 + len(contenu)
+
+    dbf = io.BytesIO()
+    longueur_enregistrement = 1 + sum(c[2] for c in champs)
+    longueur_entete = 32 + 32 * len(champs) + 1
+    # date de mise à jour fixe pour que deux générations identiques produisent des fichiers identiques
+    dbf.write(struct.pack('<4BIHH20x', 3, 120, 1, 1,
+                          len(enregistrements), longueur_entete, longueur_enregistrement))
+    for nom, type_champ, longueur, decimales in champs:
+        dbf.write(struct.pack('<11sc4xBB14x', nom.encode('ascii'), type_champ.encode('ascii'), longueur, decimales))
+    dbf.write(b'\r')
+    for enregistrement in enregistrements:
+        dbf.write(b' ')
+        for nom, type_champ, longueur, decimales in champs:
+            valeur = enregistrement.get(nom)
+            if valeur is None:
+                texte = ''
+            elif type_champ == 'D':
+                texte = valeur.strftime('%Y%m%d')
+            elif type_champ == 'L':
+                texte = 'T' if valeur else 'F'
+            else:
+                texte = str(valeur)
+            octets = texte.encode(encodage)[:longueur]
+            dbf.write(octets.rjust(longueur) if type_champ == 'N' else octets.ljust(longueur))
+    dbf.write(b'\x1a')
+
+    return shp.getvalue(), shx.getvalue(), dbf.getvalue()
+
+
+def generer_commune(insee, departement, index_commune, nb_parcelles, sommets, graine):
+    """
+    Génère les entités de toutes les catégories d'une commune.
+
+    Le tirage aléatoire ne dépend que de la graine et du code INSEE, une même commune
+    est donc identique d'une génération à l'autre.
+
+    Returns:
+        dict: {catégorie: (anneaux, enregistrements)}
+    """
+    rng = random.Random(f"{graine}-{insee}")
+    x0, y0 = ORIGINES_SRID[srid_departement(departement)]
+    # Chaque commune occupe une case de 10 km de côté dans une grille propre au département
+    x0 += (index_commune % 50) * 10000.0
+    y0 += (index_commune // 50) * 10000.0
+    if srid_departement(departement) == 2154:
+        # décalage par département pour que les départements métropolitains ne se superposent pas
+        y0 += (sum(map(ord, departement)) % 40) * 20000.0
+    colonnes = max(1, int(nb_parcelles ** 0.5))
+    lignes = -(-nb_parcelles // colonnes)
+    largeur = colonnes * TAILLE_CELLULE
+    hauteur = lignes * TAILLE_CELLULE
+
+    def dates():
+        created = date(2005, 1, 1) + timedelta(days=rng.randrange(6000))
+        return created, created + timedelta(days=rng.randrange(1500))
+
+    resultat = {categorie: ([], []) for categorie in CHAMPS_CATEGORIES}
+
+    created, updated = dates()
+    resultat["communes"][0].append(polygone(rng, x0, y0, largeur, hauteur, sommets * 4))
+    resultat["communes"][1].append({"id": insee, "nom": f"Commune {insee}", "created": created, "updated": updated})
+
+    created, updated = dates()
+    resultat["prefixes_sections"][0].append(polygone(rng, x0, y0, largeur, hauteur, sommets * 4))
+    resultat["prefixes_sections"][1].append({"id": f"{insee}000", "commune": insee, "prefixe": "000",
+                                             "ancienne": None, "nom": f"Commune {insee}",
+                                             "created": created, "updated": updated})
+
+    nb_sections = max(1, int(nb_parcelles * PROPORTIONS_CATEGORIES["sections"]))
+    codes_sections = [chr(65 + i // 26) + chr(65 + i % 26) for i in range(nb_sections)]
+    bande = hauteur / nb_sections
+    for i, code in enumerate(codes_sections):
+        created, updated = dates()
+        anneau = polygone(rng, x0, y0 + i * bande, largeur, bande, sommets * 2)
+        resultat["sections"][0].append(anneau)
+        resultat["sections"][1].append({"id": f"{insee}000{code}", "commune": insee, "prefixe": "000", "code": code,
+                                        "created": created, "updated": updated})
+        resultat["feuilles"][0].append(anneau)
+        resultat["feuilles"][1].append({"id": f"{insee}000{code}01", "commune": insee, "prefixe": "000",
+                                        "section": code, "numero": "01", "qualite": "02", "modeConfec": "02",
+                                        "echelle": 2000, "created": created, "updated": updated})
+
+    nb_lieux_dits = int(nb_parcelles * PROPORTIONS_CATEGORIES["lieux_dits"])
+    for i in range(nb_lieux_dits):
+        created, updated = dates()
+        x = x0 + rng.uniform(0, max(0.0, largeur - 4 * TAILLE_CELLULE))
+        y = y0 + rng.uniform(0, max(0.0, hauteur - 4 * TAILLE_CELLULE))
+        resultat["lieux_dits"][0].append(polygone(rng, x, y, 4 * TAILLE_CELLULE, 4 * TAILLE_CELLULE, sommets))
+        resultat["lieux_dits"][1].append({"nom": rng.choice(NOMS_LIEUX_DITS), "commune": insee,
+                                          "created": created, "updated": updated})
+
+    ids_parcelles = []
+    for i in range(nb_parcelles):
+        created, updated = dates()
+        colonne, ligne = i % colonnes, i // colonnes
+        x = x0 + colonne * TAILLE_CELLULE
+        y = y0 + ligne * TAILLE_CELLULE
+        code = codes_sections[min(nb_sections - 1, int((y - y0) // bande))]
+        identifiant = f"{insee}000{code}{i + 1:04d}"
+        ids_parcelles.append((identifiant, x, y))
+        resultat["parcelles"][0].append(polygone(rng, x, y, TAILLE_CELLULE, TAILLE_CELLULE, sommets))
+        resultat["parcelles"][1].append({"id": identifiant, "commune": insee, "prefixe": "000", "section": code,
+                                         "numero": f"{i + 1:04d}", "contenance": rng.randrange(200, 5000),
+                                         "arpente": rng.random() < 0.9, "created": created, "updated": updated})
+
+    nb_batiments = int(nb_parcelles * PROPORTIONS_CATEGORIES["batiments"])
+    for identifiant, x, y in rng.sample(ids_parcelles, min(nb_batiments, len(ids_parcelles))):
+        created, updated = dates()
+        resultat["batiments"][0].append(polygone(rng, x + 5, y + 5, 12, 10, sommets))
+        resultat["batiments"][1].append({"type": rng.choice(["01", "02"]), "nom": None, "commune": insee,
+                                         "created": created, "updated": updated})
+
+    nb_subdivisions = int(nb_parcelles * PROPORTIONS_CATEGORIES["subdivisions_fiscales"])
+    for identifiant, x, y in rng.sample(ids_parcelles, min(nb_subdivisions, len(ids_parcelles))):
+        created, updated = dates()
+        # une petite part des subdivisions n'est rattachée à aucune parcelle, comme dans les données sources
+        parcelle = None if rng.random() < 0.02 else identifiant
+        resultat["subdivisions_fiscales"][0].append(polygone(rng, x, y, TAILLE_CELLULE / 2, TAILLE_CELLULE, sommets))
+        resultat["subdivisions_fiscales"][1].append({"parcelle": parcelle, "lettre": "a",
+                                                     "created": created, "updated": updated})
+
+    return resultat
+
+
+def ecrire_commune(dossier_commune, insee, entites):
+    """Écrit une archive cadastre-<insee>-<catégorie>.zip par catégorie dans le dossier de la commune"""
+    os.makedirs(dossier_commune, exist_ok=True)
+    octets = 0
+    for categorie, (anneaux, enregistrements) in entites.items():
+        shp, shx, dbf = ecrire_shapefile(anneaux, enregistrements, CHAMPS_CATEGORIES[categorie])
+        chemin_zip = os.path.join(dossier_commune, f"cadastre-{insee}-{categorie}.zip")
+        with zipfile.ZipFile(chemin_zip, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+            # date fixe pour que deux générations identiques produisent des archives identiques
+            for extension, contenu in (("shp", shp), ("shx", shx), ("dbf", dbf)):
+                info = zipfile.ZipInfo(f"{categorie}.{extension}", date_time=(2020, 1, 1, 0, 0, 0))
+                info.compress_type = zipfile.ZIP_DEFLATED
+                zf.writestr(info, contenu)
+        octets += os.path.getsize(chemin_zip)
+    return octets
+
+
+def modifier_commune(entites, insee, millesime, graine):
+    """
+    Simule l'évolution d'une commune entre deux millésimes : parcelles redessinées,
+    attributs mis à jour, parcelles supprimées et nouvelles parcelles.
+    """
+    rng = random.Random(f"{graine}-{insee}-{millesime}")
+    date_millesime = date.fromisoformat(millesime)
+    anneaux, enregistrements = entites["parcelles"]
+    conservees = ([], [])
+    for anneau, enregistrement in zip(anneaux, enregistrements):
+        tirage = rng.random()
+        if tirage < 0.01:
+            continue
+        if tirage < 0.05:
+            anneau = [(x + 0.5, y) for x, y in anneau]
+            enregistrement = dict(enregistrement, updated=date_millesime)
+        elif tirage < 0.07:
+            enregistrement = dict(enregistrement, contenance=enregistrement["contenance"] + 10, updated=date_millesime)
+        conservees[0].append(anneau)
+        conservees[1].append(enregistrement)
+
+    numero = len(enregistrements)
+    for anneau, enregistrement in rng.sample(list(zip(anneaux, enregistrements)), max(1, len(anneaux) // 100)):
+        numero += 1
+        conservees[0].append([(x, y + 3 * TAILLE_CELLULE * len(anneaux) ** 0.5) for x, y in anneau])
+        conservees[1].append(dict(enregistrement, id=f"{enregistrement['id'][:10]}{numero:04d}", numero=f"{numero:04d}",
+                                  created=date_millesime, updated=date_millesime))
+    entites["parcelles"] = conservees
+
+    anneaux, enregistrements = entites["batiments"]
+    for i in rng.sample(range(len(anneaux)), len(anneaux) // 20):
+        anneaux[i] = [(x, y + 0.5) for x, y in anneaux[i]]
+        enregistrements[i] = dict(enregistrements[i], updated=date_millesime)
+    return entites
+
+
+def generer_jeu(sortie, millesime, departements, communes_par_departement, parcelles, sommets, graine=0,
+                modifications=0.0, verbose=False):
+    """
+    Génère une arborescence identique à celle publiée par Etalab :
+    data/etalab-cadastre/<millesime>/shp/departements/<dep>/communes/<insee>/cadastre-<insee>-<catégorie>.zip
+
+    Avec une même graine, seules les communes tirées selon le taux de modifications
+    diffèrent d'un millésime à l'autre, les autres archives sont identiques.
+
+    Returns:
+        tuple: (dossier racine du millésime, nombre d'archives, taille totale en octets)
+    """
+    racine = os.path.join(sortie, "data", "etalab-cadastre", millesime, "shp", "departements")
+    rng = random.Random(f"{graine}-{millesime}")
+    nb_archives = 0
+    octets = 0
+    for departement in departements:
+        for index, insee in enumerate(codes_insee(departement, communes_par_departement)):
+            entites = generer_commune(insee, departement, index, parcelles, sommets, graine)
+            if rng.random() < modifications:
+                entites = modifier_commune(entites, insee, millesime, graine)
+            dossier = os.path.join(racine, departement, "communes", insee)
+            octets += ecrire_commune(dossier, insee, entites)
+            nb_archives += len(entites)
+            if verbose:
+                print(f"Commune {insee} générée dans {dossier}")
+    return racine, nb_archives, octets
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Génère un jeu de données cadastral fictif avec l'arborescence Etalab")
+    parser.add_argument('--output', required=True, help='Répertoire de destination')
+    parser.add_argument('--millesime', default='2025-04-01', help='Millésime à générer (par défaut: 2025-04-01)')
+    parser.add_argument('--departements', default='59,2A,971',
+                        help='Liste des départements séparés par des virgules (par défaut: 59,2A,971)')
+    parser.add_argument('--communes', type=int, default=5, help='Nombre de communes par département (par défaut: 5)')
+    parser.add_argument('--parcelles', type=int, default=500, help='Nombre de parcelles par commune (par défaut: 500)')
+    parser.add_argument('--sommets', type=int, default=8, help='Nombre de sommets par polygone (par défaut: 8)')
+    parser.add_argument('--graine', type=int, default=0, help='Graine du générateur aléatoire (par défaut: 0)')
+    parser.add_argument('--modifications', type=float, default=0.0,
+                        help='Part des communes modifiées par rapport à la génération de base, entre 0 et 1 (par défaut: 0)')
+    parser.add_argument('--verbose', action='store_true', help='Affiche chaque commune générée')
+    args = parser.parse_args()
+
+    departements = [d.strip() for d in args.departements.split(',') if d.strip()]
+    racine, nb_archives, octets = generer_jeu(args.output, args.millesime, departements, args.communes,
+                                              args.parcelles, args.sommets, args.graine, args.modifications,
+                                              args.verbose)
+
+    print(f"Jeu de données généré dans {racine}")
+    print(f"- Départements: {len(departements)}")
+    print(f"- Archives: {nb_archives}")
+    print(f"- Taille: {octets / 1e6:.1f} Mo")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
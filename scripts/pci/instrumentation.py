@@ -0,0 +1,272 @@
+import os
+import sys
+import json
+import time
+import heapq
+import argparse
+import threading
+import contextlib
+from collections import defaultdict
+
+# Nombre de fichiers les plus lents conservés par étape
+NB_PLUS_LENTS = 20
+
+
+class Instrumentation:
+    """
+    Collecte les mesures d'une étape du pipeline : événements structurés (JSON lines),
+    compteurs, histogrammes et fichiers les plus lents.
+
+    Les événements ne sont affichés dans la console qu'en mode verbeux, le journal
+    JSON lines conserve tous les événements pour une analyse ultérieure.
+    """
+
+    def __init__(self, etape, journal=None, verbose=False):
+        self.etape = etape
+        self.verbose = verbose
+        self.journal = journal
+        self.compteurs = defaultdict(int)
+        self.histogrammes = defaultdict(list)
+        self.plus_lents = []
+        self.debut = time.time()
+        self._debut_chrono = time.perf_counter()
+        self._verrou = threading.Lock()
+        self._fichier = None
+        if journal:
+            dossier = os.path.dirname(journal)
+            if dossier:
+                os.makedirs(dossier, exist_ok=True)
+            self._fichier = open(journal, 'a', encoding='utf-8')
+
+    def evenement(self, type_evenement, message=None, **champs):
+        """Enregistre un événement dans le journal et l'affiche en mode verbeux"""
+        if self._fichier:
+            ligne = json.dumps({"ts": round(time.time(), 3), "etape": self.etape, "type": type_evenement, **champs},
+                               ensure_ascii=False, default=str)
+            with self._verrou:
+                self._fichier.write(ligne + '\n')
+        if self.verbose and message:
+            print(message)
+
+    def compter(self, nom, valeur=1):
+        """Incrémente un compteur"""
+        with self._verrou:
+            self.compteurs[nom] += valeur
+
+    def observer(self, nom, valeur, fichier=None):
+        """Ajoute une valeur à un histogramme, les latences associées à un fichier alimentent le classement des plus lents"""
+        with self._verrou:
+            self.histogrammes[nom].append(valeur)
+            if fichier is not None and nom == 'latence_s':
+                element = (valeur, fichier)
+                if len(self.plus_lents) < NB_PLUS_LENTS:
+                    heapq.heappush(self.plus_lents, element)
+                elif element > self.plus_lents[0]:
+                    heapq.heapreplace(self.plus_lents, element)
+
+    @contextlib.contextmanager
+    def chrono(self, fichier=None):
+        """Mesure la latence d'un traitement et l'ajoute à l'histogramme latence_s"""
+        debut = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observer('latence_s', time.perf_counter() - debut, fichier)
+
+    def resume(self):
+        """Construit le rapport de l'étape : durée, compteurs, histogrammes, débits et fichiers les plus lents"""
+        duree = time.perf_counter() - self._debut_chrono
+        with self._verrou:
+            compteurs = dict(self.compteurs)
+            histogrammes = {nom: statistiques(valeurs) for nom, valeurs in self.histogrammes.items()}
+            plus_lents = [{"fichier": f, "latence_s": round(v, 3)} for v, f in sorted(self.plus_lents, reverse=True)]
+        debits = {}
+        if duree > 0:
+            if 'octets' in compteurs:
+                debits["mo_s"] = round(compteurs['octets'] / 1e6 / duree, 2)
+            if 'fichiers' in compteurs:
+                debits["fichiers_s"] = round(compteurs['fichiers'] / duree, 1)
+        return {
+            "etape": self.etape,
+            "debut": self.debut,
+            "duree_s": round(duree, 3),
+            "compteurs": compteurs,
+            "debits": debits,
+            "histogrammes": histogrammes,
+            "plus_lents": plus_lents,
+        }
+
+    def terminer(self, rapport=None):
+        """Écrit le résumé de l'étape dans le journal (et dans un fichier JSON si demandé) puis ferme le journal"""
+        resume = self.resume()
+        self.evenement("fin", **{"resume": resume})
+        if self._fichier:
+            self._fichier.close()
+            self._fichier = None
+        if rapport:
+            with open(rapport, 'w', encoding='utf-8') as f:
+                json.dump(resume, f, indent=2, ensure_ascii=False)
+        return resume
+
+
+def statistiques(valeurs):
+    """Résume un histogramme : nombre, somme, min, max, moyenne et centiles"""
+    if not valeurs:
+        return {"nombre": 0}
+    triees = sorted(valeurs)
+
+    def centile(p):
+        return round(triees[min(len(triees) - 1, int(p * len(triees)))], 4)
+
+    return {
+        "nombre": len(triees),
+        "somme": round(sum(triees), 3),
+        "min": round(triees[0], 4),
+        "max": round(triees[-1], 4),
+        "moyenne": round(sum(triees) / len(triees), 4),
+        "p50": centile(0.5),
+        "p95": centile(0.95),
+        "p99": centile(0.99),
+    }
+
+
+@contextlib.contextmanager
+def profiler(mode, sortie):
+    """
+    Active un profileur autour d'un bloc de code.
+
+    Args:
+        mode (str): None, 'cprofile' ou 'pyinstrument' (dépendance optionnelle)
+        sortie (str): Fichier de résultat (.prof pour cProfile, .html pour pyinstrument)
+    """
+    if not mode:
+        yield
+        return
+
+    if mode == 'cprofile':
+        import cProfile
+        profil = cProfile.Profile()
+        profil.enable()
+        try:
+            yield
+        finally:
+            profil.disable()
+            profil.dump_stats(sortie + '.prof')
+            print(f"Profil cProfile écrit dans {sortie}.prof")
+    elif mode == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            print("Attention: pyinstrument n'est pas installé, profilage désactivé.")
+            yield
+            return
+        profil = Profiler()
+        profil.start()
+        try:
+            yield
+        finally:
+            profil.stop()
+            with open(sortie + '.html', 'w', encoding='utf-8') as f:
+                f.write(profil.output_html())
+            print(f"Profil pyinstrument écrit dans {sortie}.html")
+    else:
+        raise ValueError(f"Profileur inconnu: {mode}")
+
+
+def ajouter_arguments(parser):
+    """Ajoute les options d'instrumentation communes à tous les scripts"""
+    parser.add_argument('--verbose', action='store_true', help='Affiche un message par fichier traité')
+    parser.add_argument('--journal', help='Fichier JSON lines où enregistrer les événements et mesures (ajout en fin de fichier)')
+    parser.add_argument('--rapport', help="Fichier JSON où écrire le rapport de l'étape")
+    parser.add_argument('--profil', choices=['cprofile', 'pyinstrument'],
+                        help="Profile l'exécution (résultat écrit à côté du journal ou dans le répertoire courant)")
+
+
+def depuis_arguments(etape, args):
+    """Crée l'instrumentation d'une étape à partir des options de la ligne de commande"""
+    return Instrumentation(etape, journal=args.journal, verbose=args.verbose)
+
+
+def fichier_profil(etape, args):
+    """Préfixe du fichier de profil d'une étape"""
+    dossier = os.path.dirname(args.journal) if args.journal else '.'
+    return os.path.join(dossier or '.', f"profil_{etape}")
+
+
+def afficher_resume(resume):
+    """Affiche le résumé d'une étape de façon compacte"""
+    latence = resume["histogrammes"].get("latence_s", {})
+    ligne = f"[{resume['etape']}] {resume['duree_s']:.1f}s"
+    if resume["debits"]:
+        ligne += ", " + ", ".join(f"{v} {k.replace('_', '/')}" for k, v in resume["debits"].items())
+    if latence.get("nombre"):
+        ligne += f", latence p50 {latence['p50']}s / p95 {latence['p95']}s"
+    print(ligne)
+    compteurs = resume["compteurs"]
+    if compteurs:
+        print("  " + ", ".join(f"{nom}: {valeur}" for nom, valeur in sorted(compteurs.items())))
+
+
+def rapport_execution(journaux):
+    """
+    Agrège les journaux JSON lines d'une exécution complète.
+
+    Returns:
+        dict: durée et débits par étape, tentatives et échecs, fichiers les plus lents toutes étapes confondues
+    """
+    etapes = []
+    for journal in journaux:
+        with open(journal, 'r', encoding='utf-8') as f:
+            for ligne in f:
+                try:
+                    evenement = json.loads(ligne)
+                except json.JSONDecodeError:
+                    continue
+                if evenement.get("type") == "fin":
+                    etapes.append(evenement["resume"])
+
+    etapes.sort(key=lambda e: e["debut"])
+    plus_lents = sorted(({"etape": e["etape"], **l} for e in etapes for l in e["plus_lents"]),
+                        key=lambda l: l["latence_s"], reverse=True)[:NB_PLUS_LENTS]
+    return {
+        "duree_totale_s": round(sum(e["duree_s"] for e in etapes), 3),
+        "etapes": [{
+            "etape": e["etape"],
+            "duree_s": e["duree_s"],
+            "debits": e["debits"],
+            "fichiers": e["compteurs"].get("fichiers", 0),
+            "echecs": e["compteurs"].get("echecs", 0),
+            "tentatives": e["compteurs"].get("tentatives", 0),
+            "latence_s": e["histogrammes"].get("latence_s", {"nombre": 0}),
+        } for e in etapes],
+        "plus_lents": plus_lents,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Construit le rapport d'exécution à partir des journaux JSON lines des étapes")
+    parser.add_argument('journaux', nargs='+', help='Journaux JSON lines produits par les scripts (option --journal)')
+    parser.add_argument('--output', help='Fichier JSON où écrire le rapport')
+    args = parser.parse_args()
+
+    rapport = rapport_execution(args.journaux)
+
+    print(f"Durée totale: {rapport['duree_totale_s']:.1f}s")
+    for etape in rapport["etapes"]:
+        debits = ", ".join(f"{v} {k.replace('_', '/')}" for k, v in etape["debits"].items())
+        print(f"- {etape['etape']}: {etape['duree_s']:.1f}s, {etape['fichiers']} fichiers ({debits or 'débit inconnu'}), "
+              f"{etape['echecs']} échecs, {etape['tentatives']} tentatives supplémentaires")
+    if rapport["plus_lents"]:
+        print("\nFichiers les plus lents:")
+        for element in rapport["plus_lents"][:10]:
+            print(f"- [{element['etape']}] {element['latence_s']}s {element['fichier']}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(rapport, f, indent=2, ensure_ascii=False)
+        print(f"\nRapport écrit dans {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
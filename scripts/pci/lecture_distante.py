@@ -0,0 +1,91 @@
+# Lecture de fichiers par plages d'octets (requêtes HTTP Range), partagée par les benchmarks et la recherche
+
+import io
+
+import requests
+
+# Deux plages d'octets séparées de moins de cet écart sont lues en une seule requête
+ECART_FUSION = 4096
+
+
+class FichierHttp(io.RawIOBase):
+    """Fichier distant lu par requêtes HTTP Range, avec décompte des octets et des requêtes"""
+
+    def __init__(self, url, session=None):
+        self.url = url
+        self.session = session or requests.Session()
+        self.position = 0
+        self.taille = None
+        self.octets = 0
+        self.requetes = 0
+
+    def lire(self, debut, longueur):
+        """Lit longueur octets à partir de debut en une requête Range"""
+        reponse = self.session.get(self.url, headers={'Range': f'bytes={debut}-{debut + longueur - 1}'})
+        self.requetes += 1
+        if reponse.status_code == 416:
+            return b''
+        reponse.raise_for_status()
+        if reponse.status_code != 206:
+            raise IOError(f"Le serveur ne prend pas en charge les requêtes Range: {self.url}")
+        self.octets += len(reponse.content)
+        if self.taille is None:
+            self.taille = int(reponse.headers['Content-Range'].rsplit('/', 1)[1])
+        return reponse.content
+
+    def lire_fin(self, longueur):
+        """Lit les longueur derniers octets du fichier en une requête Range"""
+        reponse = self.session.get(self.url, headers={'Range': f'bytes=-{longueur}'})
+        self.requetes += 1
+        reponse.raise_for_status()
+        if reponse.status_code != 206:
+            raise IOError(f"Le serveur ne prend pas en charge les requêtes Range: {self.url}")
+        self.octets += len(reponse.content)
+        self.taille = int(reponse.headers['Content-Range'].rsplit('/', 1)[1])
+        return reponse.content
+
+    def size(self):
+        if self.taille is None:
+            reponse = self.session.head(self.url)
+            self.requetes += 1
+            reponse.raise_for_status()
+            self.taille = int(reponse.headers['Content-Length'])
+        return self.taille
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        else:
+            self.position = self.size() + offset
+        return self.position
+
+    def readinto(self, tampon):
+        longueur = min(len(tampon), self.size() - self.position)
+        if longueur <= 0:
+            return 0
+        donnees = self.lire(self.position, longueur)
+        tampon[:len(donnees)] = donnees
+        self.position += len(donnees)
+        return len(donnees)
+
+
+def fusionner_plages(plages, ecart=ECART_FUSION):
+    """Fusionne des plages (début, fin) triées lorsqu'elles sont séparées de moins de ecart"""
+    fusionnees = []
+    for debut, fin in sorted(plages):
+        if fusionnees and debut - fusionnees[-1][1] <= ecart:
+            fusionnees[-1][1] = max(fusionnees[-1][1], fin)
+        else:
+            fusionnees.append([debut, fin])
+    return fusionnees
@@ -0,0 +1,253 @@
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import concurrent.futures
+
+from instrumentation import Instrumentation, ajouter_arguments, depuis_arguments, fichier_profil, profiler, afficher_resume
+from reprojection import CRS_COMMUNS, colonne_commune, type_emprise, ajouter_geometrie_commune, srids_fichier, \
+    metadonnees_geo, metadonnees_wkb, crs_present
+
+# Colonnes interrogées par égalité (recherche d'une parcelle, d'une commune) : filtres de Bloom et index de pages
+COLONNES_INDEXEES = ("id", "parcelle", "commune")
+
+# Ordre de tri des exports, déclaré dans les métadonnées sorting_columns s'il est vérifié sur le fichier
+# (type_objet[:8] dans les exports SQL donne le même ordre que type_objet, les préfixes étant distincts)
+COLONNES_TRI = ("departement", "commune", "type_objet", "section", "id")
+
+# Un groupe de lignes couvre quelques communes : les statistiques de commune et id écartent les autres
+TAILLE_GROUPE = 65536
+
+# Une page de 1024 identifiants triés couvre un intervalle étroit : une recherche ne lit qu'une page par colonne
+LIGNES_PAR_PAGE = 1024
+
+# Taux de faux positifs des filtres de Bloom
+TAUX_FAUX_POSITIFS = 0.01
+
+# Mesures de l'étape, remplacées dans main() selon les options --verbose/--journal
+mesures = Instrumentation("optimisation_parquet")
+
+
+def fichiers_entree(chemin):
+    """
+    Retourne les fichiers Parquet à réécrire : un fichier, tous ceux d'un répertoire ou ceux
+    d'une construction incrémentale (exports départementaux et fusion).
+
+    Contrairement aux outils de lecture (voir detection_changements.motif_parquet), qui ne lisent
+    que les lots d'un répertoire d'exports, la fusion et les extraits sont aussi réécrits : ce sont
+    les fichiers interrogés par identifiant.
+    """
+    if os.path.isdir(os.path.join(chemin, "export")):
+        motifs = [os.path.join(chemin, "export", "*.parquet"), os.path.join(chemin, "*.parquet")]
+    elif os.path.isdir(chemin):
+        motifs = [os.path.join(chemin, "*.parquet")]
+    else:
+        motifs = [chemin]
+    return sorted(f for motif in motifs for f in glob.glob(motif) if not f.endswith(".tmp"))
+
+
+def colonnes_triees(parquet, colonnes=COLONNES_TRI):
+    """
+    Retourne les colonnes de tri présentes si le fichier est trié selon elles, sinon une liste vide.
+
+    Les statistiques de la première colonne écartent sans lecture un fichier dont les groupes
+    de lignes se chevauchent (fichiers concaténés dans l'ordre de leurs noms, où '2A' suit '40') ;
+    sinon les colonnes de tri sont lues par lots et l'ordre de chaque lot est vérifié
+    (tri stable de pyarrow, valeurs nulles en dernier comme dans DuckDB).
+    """
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    tri = [c for c in colonnes if c in parquet.schema_arrow.names]
+    if not tri:
+        return []
+    chemins = [parquet.metadata.schema.column(i).path for i in range(parquet.metadata.num_columns)]
+    indice = chemins.index(tri[0])
+    precedent = None
+    for numero in range(parquet.metadata.num_row_groups):
+        statistiques = parquet.metadata.row_group(numero).column(indice).statistics
+        if statistiques is None or not statistiques.has_min_max:
+            break
+        if precedent is not None and statistiques.min < precedent:
+            return []
+        precedent = statistiques.max
+
+    derniere = None
+    for lot in parquet.iter_batches(columns=tri, batch_size=TAILLE_GROUPE):
+        table = pa.Table.from_batches([lot])
+        if derniere is not None:
+            table = pa.concat_tables([derniere, table])
+        indices = pc.sort_indices(table, sort_keys=[(c, "ascending") for c in tri])
+        if not np.array_equal(indices.to_numpy(), np.arange(table.num_rows)):
+            return []
+        derniere = table.slice(table.num_rows - 1)
+    return tri
+
+
+def tri_declare(parquet):
+    """Retourne les colonnes déclarées dans les métadonnées sorting_columns d'un fichier Parquet"""
+    import pyarrow.parquet as pq
+
+    if not parquet.metadata.num_row_groups or not parquet.metadata.row_group(0).sorting_columns:
+        return []
+    cles, _ = pq.SortingColumn.to_ordering(parquet.schema_arrow, parquet.metadata.row_group(0).sorting_columns)
+    return [nom for nom, _ in cles]
+
+
+def options_ecriture(schema, taille_groupe=TAILLE_GROUPE, lignes_par_page=LIGNES_PAR_PAGE, fpp=TAUX_FAUX_POSITIFS,
+                     tri=None):
+    """
+    Retourne les options de pyarrow.parquet.ParquetWriter pour un export optimisé pour la recherche par identifiant.
+
+    DuckDB n'écrit de filtres de Bloom que pour les colonnes encodées par dictionnaire
+    (donc pas pour id, dont les valeurs sont uniques) et n'écrit pas d'index de pages.
+    L'ordre de tri n'est déclaré (sorting_columns) que si l'appelant garantit que les
+    lignes écrites sont triées selon les colonnes tri.
+    """
+    import pyarrow.parquet as pq
+
+    indexees = [c for c in COLONNES_INDEXEES if c in schema.names]
+    geometries = {"geometry"}
+    if schema.metadata and b"geo" in schema.metadata:
+        geometries.update(json.loads(schema.metadata[b"geo"])["columns"])
+    options = {
+        "compression": "zstd",
+        "write_statistics": True,
+        "write_page_index": True,
+        "max_rows_per_page": lignes_par_page,
+        "bloom_filter_options": {c: {"ndv": taille_groupe, "fpp": fpp} for c in indexees},
+        # un dictionnaire sur id serait aussi gros que la colonne et masquerait l'index de pages
+        "use_dictionary": [c for c in schema.names if c != "id" and c not in geometries],
+    }
+    if tri:
+        options["sorting_columns"] = pq.SortingColumn.from_ordering(schema, [(c, "ascending") for c in tri])
+    return options
+
+
+def optimiser_fichier(source, sortie=None, taille_groupe=TAILLE_GROUPE, lignes_par_page=LIGNES_PAR_PAGE,
+                      fpp=TAUX_FAUX_POSITIFS, crs_commun=None):
+    """
+    Réécrit un fichier Parquet avec filtres de Bloom, index de pages et groupes de lignes réguliers.
+
+    Le fichier est relu par lots, l'ordre des lignes et les métadonnées du schéma sont
+    conservés ; l'ordre de tri des exports n'est déclaré que s'il est vérifié (voir
+    colonnes_triees), la fusion de duckdb_export_pci.sql n'étant pas triée. Le CRS de
+    la colonne geometry est renseigné dans les métadonnées GeoParquet, qui sont créées
+    pour un export écrit sans elles.
+    Avec crs_commun (4326 ou 3857), la géométrie reprojetée est ajoutée dans la colonne
+    geometry_<crs> si elle n'existe pas encore. Sans sortie, le fichier est remplacé une
+    fois la réécriture terminée.
+
+    Returns:
+        tuple: (nombre de lignes, nombre de groupes de lignes, taille en octets)
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    destination = sortie or source
+    temporaire = destination + ".tmp"
+    parquet = pq.ParquetFile(source)
+    schema = parquet.schema_arrow
+    ajout = bool(crs_commun) and colonne_commune(crs_commun) not in schema.names and "geom_srid" in schema.names
+    if ajout:
+        schema = schema.append(pa.field(colonne_commune(crs_commun), pa.binary())) \
+            .append(pa.field(colonne_commune(crs_commun) + "_bbox", type_emprise()))
+    geo = json.loads(schema.metadata[b"geo"]) if schema.metadata and b"geo" in schema.metadata else None
+    if geo is None and "geometry" in schema.names and "geom_srid" in schema.names:
+        # export écrit par DuckDB à partir de géométries lues en WKB (voir detection_changements.connexion)
+        geo = metadonnees_wkb()
+    if geo is not None:
+        geo = metadonnees_geo(geo, srids_fichier(parquet), crs_present(schema.names))
+        schema = schema.with_metadata({**(schema.metadata or {}), b"geo": json.dumps(geo).encode("utf-8")})
+    options = options_ecriture(schema, taille_groupe, lignes_par_page, fpp, colonnes_triees(parquet))
+    lignes = 0
+    try:
+        with pq.ParquetWriter(temporaire, schema, **options) as writer:
+            tampon = []
+            en_tampon = 0
+            for lot in parquet.iter_batches(batch_size=min(taille_groupe, 65536)):
+                if ajout:
+                    lot = ajouter_geometrie_commune(lot, crs_commun)
+                tampon.append(lot)
+                en_tampon += lot.num_rows
+                if en_tampon >= taille_groupe:
+                    table = pa.Table.from_batches(tampon, schema)
+                    writer.write_table(table.slice(0, taille_groupe), row_group_size=taille_groupe)
+                    reste = table.slice(taille_groupe)
+                    tampon, en_tampon = reste.to_batches(), reste.num_rows
+                    lignes += taille_groupe
+            if en_tampon:
+                writer.write_table(pa.Table.from_batches(tampon, schema), row_group_size=taille_groupe)
+                lignes += en_tampon
+    except BaseException:
+        if os.path.exists(temporaire):
+            os.remove(temporaire)
+        raise
+    parquet.close()
+    os.replace(temporaire, destination)
+    return lignes, pq.read_metadata(destination).num_row_groups, os.path.getsize(destination)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Réécrit les exports Parquet avec filtres de Bloom et index de pages pour la recherche par identifiant")
+    parser.add_argument('--input', required=True,
+                        help='Fichier Parquet, répertoire de fichiers Parquet ou répertoire de construction incrémentale')
+    parser.add_argument('--output', help='Fichier de sortie (un seul fichier en entrée), par défaut le fichier est remplacé')
+    parser.add_argument('--row-group-size', type=int, default=TAILLE_GROUPE,
+                        help=f'Nombre de lignes par groupe de lignes (par défaut: {TAILLE_GROUPE})')
+    parser.add_argument('--rows-per-page', type=int, default=LIGNES_PAR_PAGE,
+                        help=f'Nombre maximal de lignes par page de données (par défaut: {LIGNES_PAR_PAGE})')
+    parser.add_argument('--fpp', type=float, default=TAUX_FAUX_POSITIFS,
+                        help=f'Taux de faux positifs des filtres de Bloom (par défaut: {TAUX_FAUX_POSITIFS})')
+    parser.add_argument('--common-crs', type=int, choices=CRS_COMMUNS,
+                        help='Ajoute la géométrie reprojetée dans ce CRS (colonne geometry_<crs>) pour les requêtes couvrant plusieurs territoires')
+    parser.add_argument('--workers', type=int, default=2, help='Nombre de fichiers réécrits en parallèle (par défaut: 2)')
+    ajouter_arguments(parser)
+    args = parser.parse_args()
+
+    global mesures
+    mesures = depuis_arguments("optimisation_parquet", args)
+
+    fichiers = fichiers_entree(args.input)
+    if not fichiers:
+        print(f"Aucun fichier Parquet trouvé dans {args.input}.")
+        return 1
+    if args.output and len(fichiers) > 1:
+        print("Erreur: --output n'est possible qu'avec un seul fichier en entrée.")
+        return 1
+
+    def optimiser(fichier):
+        debut = time.perf_counter()
+        resultat = optimiser_fichier(fichier, args.output, args.row_group_size, args.rows_per_page, args.fpp,
+                                      args.common_crs)
+        return resultat, time.perf_counter() - debut
+
+    print(f"Optimisation de {len(fichiers)} fichiers Parquet...")
+    echecs = 0
+    with profiler(args.profil, fichier_profil("optimisation_parquet", args)), \
+            concurrent.futures.ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(optimiser, fichier): fichier for fichier in fichiers}
+        for future in concurrent.futures.as_completed(futures):
+            fichier = futures[future]
+            try:
+                (lignes, groupes, octets), duree = future.result()
+            except Exception as e:
+                echecs += 1
+                mesures.compter("echecs")
+                mesures.evenement("echec", f"Erreur lors de l'optimisation de {fichier}: {e}", fichier=fichier, erreur=str(e))
+                continue
+            mesures.observer('latence_s', duree, fichier)
+            mesures.compter("fichiers")
+            mesures.compter("octets", octets)
+            mesures.evenement("optimise", f"{fichier}: {lignes} lignes, {groupes} groupes de lignes",
+                              fichier=fichier, lignes=lignes, groupes=groupes, octets=octets)
+
+    afficher_resume(mesures.terminer(args.rapport))
+    return 1 if echecs else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+import io
+import os
+import sys
+import glob
+import argparse
+
+from instrumentation import Instrumentation, ajouter_arguments, depuis_arguments, fichier_profil, profiler, afficher_resume
+from detection_changements import motif_parquet
+from lecture_distante import FichierHttp
+
+# Mesures de l'étape, remplacées dans main() selon les options --verbose/--journal
+mesures = Instrumentation("recherche_parcelles")
+
+
+class FichierLocal(io.RawIOBase):
+    """Fichier local lu par plages, avec le même décompte d'octets et de lectures que FichierHttp"""
+
+    def __init__(self, chemin):
+        self.url = chemin
+        self.fichier = open(chemin, 'rb')
+        self.octets = 0
+        self.requetes = 0
+
+    def lire(self, debut, longueur):
+        """Lit longueur octets à partir de debut"""
+        self.fichier.seek(debut)
+        donnees = self.fichier.read(longueur)
+        self.requetes += 1
+        self.octets += len(donnees)
+        return donnees
+
+    def lire_fin(self, longueur):
+        """Lit les longueur derniers octets du fichier"""
+        return self.lire(max(0, self.size() - longueur), longueur)
+
+    def size(self):
+        return os.fstat(self.fichier.fileno()).st_size
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.fichier.tell()
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self.fichier.seek(offset, whence)
+
+    def readinto(self, tampon):
+        n = self.fichier.readinto(tampon)
+        self.requetes += 1
+        self.octets += n
+        return n
+
+    def close(self):
+        self.fichier.close()
+        super().close()
+
+
+def ouvrir(chemin):
+    """Ouvre un fichier local ou distant (http://, https://) pour une lecture par plages"""
+    if chemin.startswith(('http://', 'https://')):
+        return FichierHttp(chemin)
+    return FichierLocal(chemin)
+
+
+def rechercher(fichiers, identifiants, colonne="id"):
+    """
+    Recherche un lot d'identifiants dans des fichiers Parquet.
+
+    Le filtre is_in est confié à pyarrow : les groupes de lignes dont les statistiques de la colonne
+    excluent tous les identifiants ne sont pas lus. Les exports optimisés par optimisation_parquet.py
+    (groupes de lignes réguliers, triés par commune puis id) limitent la lecture à quelques groupes.
+
+    Returns:
+        tuple: (table Arrow des objets trouvés ou None, octets lus, nombre de lectures)
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    valeurs = sorted(set(identifiants))
+    tables = []
+    octets = lectures = 0
+    for chemin in fichiers:
+        fichier = ouvrir(chemin)
+        try:
+            table = pq.read_table(pa.PythonFile(fichier, mode='r'), filters=[(colonne, 'in', valeurs)])
+        finally:
+            octets += fichier.octets
+            lectures += fichier.requetes
+            fichier.close()
+        mesures.compter("fichiers")
+        if table.num_rows:
+            tables.append(table)
+    mesures.compter("octets", octets)
+    mesures.compter("lectures", lectures)
+    if not tables:
+        return None, octets, lectures
+    return pa.concat_tables(tables, promote_options="default"), octets, lectures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recherche des parcelles (ou autres objets) par identifiant dans les exports Parquet")
+    parser.add_argument('--input', required=True,
+                        help='Fichier Parquet, répertoire de fichiers Parquet, répertoire de construction incrémentale ou URL')
+    parser.add_argument('--ids', help='Identifiants séparés par des virgules, ex: 59350000AB0123')
+    parser.add_argument('--ids-file', help='Fichier texte contenant un identifiant par ligne')
+    parser.add_argument('--column', default='id', help='Colonne recherchée : id ou parcelle (par défaut: id)')
+    parser.add_argument('--output', help='Fichier Parquet des objets trouvés (par défaut: affichage)')
+    ajouter_arguments(parser)
+    args = parser.parse_args()
+
+    global mesures
+    mesures = depuis_arguments("recherche_parcelles", args)
+
+    identifiants = [i.strip() for i in (args.ids or '').split(',') if i.strip()]
+    if args.ids_file:
+        with open(args.ids_file, 'r', encoding='utf-8') as f:
+            identifiants += [ligne.strip() for ligne in f if ligne.strip()]
+    if not identifiants:
+        print("Erreur: indiquer des identifiants avec --ids ou --ids-file.")
+        return 1
+
+    if args.input.startswith(('http://', 'https://')):
+        fichiers = [args.input]
+    else:
+        fichiers = sorted(glob.glob(motif_parquet(args.input)))
+    if not fichiers:
+        print(f"Aucun fichier Parquet trouvé dans {args.input}.")
+        return 1
+
+    with profiler(args.profil, fichier_profil("recherche_parcelles", args)):
+        table, octets, lectures = rechercher(fichiers, identifiants, args.column)
+
+    trouves = table.num_rows if table is not None else 0
+    print(f"{trouves} objets trouvés pour {len(set(identifiants))} identifiants "
+          f"({octets / 1024:.1f} Ko lus en {lectures} lectures)")
+    if table is not None:
+        if args.output:
+            import pyarrow.parquet as pq
+            pq.write_table(table, args.output, compression='zstd')
+            print(f"Résultats écrits dans {args.output}")
+        else:
+            colonnes = [c for c in ("commune", "type_objet", "id", "section", "numero", "contenance") if c in table.column_names]
+            for ligne in table.select(colonnes).to_pylist():
+                print("  " + ", ".join(f"{c}={v}" for c, v in ligne.items()))
+    afficher_resume(mesures.terminer(args.rapport))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
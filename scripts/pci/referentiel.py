@@ -0,0 +1,24 @@
+# Règles de référence partagées par les scripts, alignées sur les vues de duckdb_convert_pci.sql
+
+# SRID EPSG par département hors métropole et Corse (vue source_unique)
+SRID_DEPARTEMENTS = {
+    '971': 5490,  # RGAF09 / UTM zone 20N
+    '972': 5490,
+    '973': 2972,  # RGFG95 / UTM zone 22N
+    '974': 2975,  # RGR92 / UTM zone 40S
+    '976': 4471,  # RGM04 / UTM zone 38S
+    '000': 0,     # enregistrements sans attribut de localisation
+}
+
+# SRID des départements de métropole et de Corse (RGF93 / Lambert-93)
+SRID_METROPOLE = 2154
+
+
+def srid_departement(departement):
+    """Retourne le SRID attendu pour un département (même règle que la vue source_unique)"""
+    return SRID_DEPARTEMENTS.get(departement, SRID_METROPOLE)
+
+
+def departement_commune(insee):
+    """Retourne le code département d'une commune (même règle que duckdb_convert_pci.sql)"""
+    return insee[:3] if insee.startswith('97') else insee[:2]
@@ -0,0 +1,154 @@
+# Systèmes de coordonnées des exports : métadonnées GeoParquet et géométrie précalculée dans un CRS commun
+
+import json
+import threading
+
+# CRS communs proposés pour les requêtes couvrant métropole et DROM et pour les clients web
+CRS_COMMUNS = (4326, 3857)
+
+# Transformateurs pyproj par fil d'exécution (un Transformer ne doit pas être partagé entre threads)
+_local = threading.local()
+
+
+def colonne_commune(crs):
+    """Retourne le nom de la colonne de géométrie précalculée dans un CRS commun"""
+    return f"geometry_{crs}"
+
+
+def crs_projjson(srid):
+    """Retourne la définition PROJJSON d'un SRID EPSG (None pour le SRID 0, sans localisation)"""
+    import pyproj
+
+    return pyproj.CRS.from_epsg(srid).to_json_dict() if srid else None
+
+
+def transformateur(source, cible):
+    """Retourne un transformateur pyproj (ordre x/y, c'est-à-dire longitude/latitude) propre au thread courant"""
+    import pyproj
+
+    cache = getattr(_local, "transformateurs", None)
+    if cache is None:
+        cache = _local.transformateurs = {}
+    if (source, cible) not in cache:
+        cache[(source, cible)] = pyproj.Transformer.from_crs(source, cible, always_xy=True)
+    return cache[(source, cible)]
+
+
+def reprojeter(geometries, srids, cible):
+    """
+    Reprojette des géométries shapely vers un CRS commun.
+
+    Les géométries sont traitées en bloc par SRID source (un seul appel pyproj par SRID),
+    ce qui revient à une transformation par département dans un export trié.
+    Les géométries de SRID 0 ou nul n'ont pas de localisation connue et restent nulles.
+
+    Returns:
+        numpy.ndarray: géométries reprojetées
+    """
+    import numpy as np
+    import shapely
+
+    resultat = np.full(len(geometries), None, dtype=object)
+    srids = np.asarray(srids, dtype=float)
+    for srid in np.unique(srids[~np.isnan(srids)]):
+        if not srid:
+            continue
+        masque = srids == srid
+        transformation = transformateur(int(srid), cible)
+        resultat[masque] = shapely.transform(
+            geometries[masque], lambda c: np.column_stack(transformation.transform(c[:, 0], c[:, 1])))
+    return resultat
+
+
+def type_emprise():
+    """Retourne le type Arrow de la couverture (emprise) d'une colonne de géométrie"""
+    import pyarrow as pa
+
+    return pa.struct([pa.field(nom, pa.float64()) for nom in ("xmin", "ymin", "xmax", "ymax")])
+
+
+def ajouter_geometrie_commune(lot, cible):
+    """
+    Ajoute à un lot Arrow la géométrie reprojetée dans le CRS cible et son emprise.
+
+    Returns:
+        pyarrow.RecordBatch: lot avec les colonnes geometry_<crs> (WKB) et geometry_<crs>_bbox
+    """
+    import numpy as np
+    import pyarrow as pa
+    import shapely
+
+    geometries = shapely.from_wkb(lot.column("geometry").to_numpy(zero_copy_only=False))
+    srids = lot.column("geom_srid").to_numpy(zero_copy_only=False)
+    reprojetees = reprojeter(geometries, srids, cible)
+
+    absentes = shapely.is_missing(reprojetees)
+    bornes = shapely.bounds(reprojetees)
+    emprise = pa.StructArray.from_arrays([pa.array(bornes[:, i], pa.float64()) for i in range(4)],
+                                         fields=list(type_emprise()),
+                                         mask=pa.array(absentes | np.isnan(bornes[:, 0])))
+    colonne = colonne_commune(cible)
+    wkb = pa.array(shapely.to_wkb(reprojetees, output_dimension=2), pa.binary())
+    return pa.RecordBatch.from_arrays(lot.columns + [wkb, emprise], names=lot.schema.names + [colonne, colonne + "_bbox"])
+
+
+def srids_fichier(parquet):
+    """
+    Retourne les SRID (colonne geom_srid) présents dans un fichier Parquet.
+
+    Les statistiques des groupes de lignes suffisent lorsque chaque groupe n'a qu'un SRID,
+    ce qui est le cas d'un export trié par département ; sinon la colonne est lue.
+    """
+    import pyarrow.compute as pc
+
+    if "geom_srid" not in parquet.schema_arrow.names:
+        return set()
+    # indice de la colonne feuille : les structures (geometry_bbox) occupent une colonne par champ
+    chemins = [parquet.metadata.schema.column(i).path for i in range(parquet.metadata.num_columns)]
+    indice = chemins.index("geom_srid")
+    srids = set()
+    for numero in range(parquet.metadata.num_row_groups):
+        statistiques = parquet.metadata.row_group(numero).column(indice).statistics
+        if statistiques is None or not statistiques.has_min_max or statistiques.min != statistiques.max:
+            break
+        srids.add(statistiques.min)
+    else:
+        return srids
+    colonne = parquet.read(columns=["geom_srid"]).column(0)
+    return {s for s in pc.unique(colonne).to_pylist() if s is not None}
+
+
+def metadonnees_wkb(colonne="geometry"):
+    """Retourne les métadonnées GeoParquet minimales d'un fichier écrit sans elles (colonne WKB en BLOB)"""
+    return {"version": "1.1.0", "primary_column": colonne,
+            "columns": {colonne: {"encoding": "WKB", "geometry_types": []}}}
+
+
+def crs_present(noms):
+    """Retourne le CRS commun dont la colonne geometry_<crs> figure parmi les colonnes, None sinon"""
+    return next((crs for crs in CRS_COMMUNS if colonne_commune(crs) in noms), None)
+
+
+def metadonnees_geo(geo, srids, cible=None):
+    """
+    Retourne les métadonnées GeoParquet avec le CRS de chaque colonne de géométrie.
+
+    Sans CRS, les lecteurs GeoParquet supposent des coordonnées en longitude/latitude
+    (OGC:CRS84) : la colonne geometry reçoit le CRS de son SRID s'il est unique
+    (le SRID 0 des enregistrements sans localisation est ignoré), sinon un CRS nul
+    (inconnu) puisque le fichier mélange plusieurs projections.
+    """
+    geo = json.loads(json.dumps(geo))
+    principale = geo["columns"][geo["primary_column"]]
+    localises = {s for s in srids if s}
+    principale["crs"] = crs_projjson(localises.pop()) if len(localises) == 1 else None
+    if cible:
+        colonne = colonne_commune(cible)
+        geo["columns"][colonne] = {
+            "encoding": "WKB",
+            "geometry_types": principale.get("geometry_types", []),
+            "crs": crs_projjson(cible),
+            "covering": {"bbox": {borne: [colonne + "_bbox", borne] for borne in ("xmin", "ymin", "xmax", "ymax")}},
+        }
+    geo["version"] = "1.1.0"
+    return geo
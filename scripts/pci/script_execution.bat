@@ -25,4 +25,14 @@ python %SCRIPT_PATH%\convert_shp_to_parquet.py --workers 8 --overwrite --root %W
 %DUCKDB_PATH%\duckdb.exe -f %SCRIPT_PATH%\duckdb_convert_pci.sql %DATASAVE_PATH%\cloudcadastre.duckdb 
 
 :: export to Parquet (monolithic)
-%DUCKDB_PATH%\duckdb.exe -f %SCRIPT_PATH%\duckdb_export_pci.sql %DATASAVE_PATH%\cloudcadastre.duckdb
\ No newline at end of file
+:: the DROM batch used to be a single file, split by SRID since: remove it so readers of the directory do not count it twice
+if exist %DATASAVE_PATH%\cloudcadastre_971_976.parquet del %DATASAVE_PATH%\cloudcadastre_971_976.parquet
+:: the 97_autres batch is only written when it has rows: remove the one of a previous export
+if exist %DATASAVE_PATH%\cloudcadastre_97_autres.parquet del %DATASAVE_PATH%\cloudcadastre_97_autres.parquet
+%DUCKDB_PATH%\duckdb.exe -f %SCRIPT_PATH%\duckdb_export_pci.sql %DATASAVE_PATH%\cloudcadastre.duckdb
+
+:: bloom filters and page index for lookups by id
+python %SCRIPT_PATH%\optimisation_parquet.py --workers 2 --input %DATASAVE_PATH%
+
+:: extracts (one scan for all communes/departements/zones)
+python %SCRIPT_PATH%\extraction_multiple.py --input %DATASAVE_PATH%\cloudcadastrefusion.parquet --output %DATASAVE_PATH% --targets %SCRIPT_PATH%\extraits.json
@@ -0,0 +1,148 @@
+import io
+import os
+import re
+import sys
+import html
+import time
+import argparse
+import threading
+from datetime import datetime
+from urllib.parse import quote
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+
+class GestionnaireIndexNginx(SimpleHTTPRequestHandler):
+    """
+    Sert un répertoire local avec des pages d'index au format autoindex de nginx.
+
+    Les requêtes Range sur un seul intervalle d'octets sont prises en charge, comme
+    par nginx, pour les clients qui lisent des portions de fichiers (FlatGeobuf, Parquet).
+    """
+
+    verbose = False
+    # délai ajouté à chaque requête et débit maximal (octets/s) pour simuler un serveur distant
+    delai = 0.0
+    debit = 0.0
+
+    def send_head(self):
+        if self.delai:
+            time.sleep(self.delai)
+        intervalle = re.fullmatch(r'bytes=(\d*)-(\d*)', self.headers.get('Range', '').strip())
+        chemin = self.translate_path(self.path)
+        if intervalle is None or os.path.isdir(chemin) or intervalle.groups() == ('', ''):
+            return super().send_head()
+        try:
+            f = open(chemin, 'rb')
+        except OSError:
+            self.send_error(404, "Fichier introuvable")
+            return None
+
+        taille = os.fstat(f.fileno()).st_size
+        debut, fin = intervalle.groups()
+        if debut == '':
+            debut, fin = max(0, taille - int(fin)), taille - 1
+        else:
+            debut, fin = int(debut), min(int(fin), taille - 1) if fin else taille - 1
+        if debut >= taille or debut > fin:
+            f.close()
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{taille}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return None
+
+        f.seek(debut)
+        contenu = f.read(fin - debut + 1)
+        f.close()
+        if self.debit:
+            time.sleep(len(contenu) / self.debit)
+        self.send_response(206)
+        self.send_header("Content-Type", self.guess_type(chemin))
+        self.send_header("Content-Range", f"bytes {debut}-{fin}/{taille}")
+        self.send_header("Content-Length", str(len(contenu)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        return io.BytesIO(contenu)
+
+    def list_directory(self, path):
+        try:
+            entrees = sorted(os.scandir(path), key=lambda e: (not e.is_dir(), e.name))
+        except OSError:
+            self.send_error(404, "Répertoire introuvable")
+            return None
+
+        titre = html.escape(self.path.split('?', 1)[0])
+        lignes = [f'<html>\r\n<head><title>Index of {titre}</title></head>\r\n<body>\r\n'
+                  f'<h1>Index of {titre}</h1><hr><pre><a href="../">../</a>\r\n']
+        for entree in entrees:
+            nom = entree.name + ('/' if entree.is_dir() else '')
+            stats = entree.stat()
+            date = datetime.fromtimestamp(stats.st_mtime).strftime('%d-%b-%Y %H:%M')
+            taille = '-' if entree.is_dir() else str(stats.st_size)
+            lien = f'<a href="{quote(nom)}">{html.escape(nom[:50])}</a>'
+            lignes.append(f'{lien}{" " * max(1, 51 - len(nom[:50]))}{date} {taille:>19}\r\n')
+        lignes.append('</pre><hr></body>\r\n</html>\r\n')
+
+        contenu = ''.join(lignes).encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(contenu)))
+        self.end_headers()
+        return io.BytesIO(contenu)
+
+    def log_message(self, format, *args):
+        if self.verbose:
+            super().log_message(format, *args)
+
+
+def demarrer_serveur(racine, port=0, hote='127.0.0.1', verbose=False, delai=0.0, debit=0.0):
+    """
+    Démarre le serveur dans un thread en arrière-plan.
+
+    Args:
+        racine (str): Répertoire servi
+        port (int): Port d'écoute, 0 pour laisser le système en choisir un
+        hote (str): Adresse d'écoute
+        verbose (bool): Affiche chaque requête reçue
+        delai (float): Délai en secondes ajouté à chaque requête
+        debit (float): Débit maximal des réponses partielles en octets par seconde (0: illimité)
+
+    Returns:
+        tuple: (serveur, URL de base)
+    """
+    gestionnaire = type('Gestionnaire', (GestionnaireIndexNginx,), {'verbose': verbose, 'delai': delai, 'debit': debit})
+    serveur = ThreadingHTTPServer((hote, port), partial(gestionnaire, directory=racine))
+    serveur.daemon_threads = True
+    thread = threading.Thread(target=serveur.serve_forever, daemon=True)
+    thread.start()
+    return serveur, f"http://{hote}:{serveur.server_address[1]}/"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sert un jeu de données local avec des pages d'index de type nginx")
+    parser.add_argument('--input', required=True, help='Répertoire à servir')
+    parser.add_argument('--port', type=int, default=8000, help="Port d'écoute (par défaut: 8000)")
+    parser.add_argument('--host', default='127.0.0.1', help="Adresse d'écoute (par défaut: 127.0.0.1)")
+    parser.add_argument('--verbose', action='store_true', help='Affiche chaque requête reçue')
+    parser.add_argument('--delay', type=float, default=0.0,
+                        help='Délai en millisecondes ajouté à chaque requête pour simuler un serveur distant (par défaut: 0)')
+    parser.add_argument('--bandwidth', type=float, default=0.0,
+                        help='Débit maximal des requêtes Range en Mo/s pour simuler un serveur distant (par défaut: illimité)')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.input):
+        print(f"Erreur: {args.input} n'est pas un répertoire valide.")
+        return 1
+
+    serveur, url = demarrer_serveur(args.input, args.port, args.host, args.verbose, args.delay / 1000, args.bandwidth * 1e6)
+    print(f"Serveur démarré sur {url} (Ctrl+C pour arrêter)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        serveur.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
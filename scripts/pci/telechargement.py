@@ -9,15 +9,29 @@ import sys
 from tqdm import tqdm
 import concurrent.futures
 import threading
+import time
 from bs4 import BeautifulSoup
 import re
 
+from instrumentation import Instrumentation, ajouter_arguments, depuis_arguments, fichier_profil, profiler, afficher_resume
+
 # Variable globale pour la barre de progression partagée entre les threads
 progress_lock = threading.Lock()
 
 # Fichier pour enregistrer les téléchargements réussis
 DOWNLOAD_LOG_FILE = "downloads_completed.json"
 
+# Mesures de l'étape, remplacées dans main() selon les options --verbose/--journal
+mesures = Instrumentation("telechargement")
+
+# Nombre de nouvelles tentatives après une erreur réseau (par défaut)
+RETRIES = 2
+
+# Délais (en secondes) d'établissement de la connexion et d'attente entre deux paquets reçus :
+# sans délai, une connexion bloquée n'échoue jamais et les nouvelles tentatives ne sont pas lancées
+DELAI_CONNEXION = 10
+DELAI_LECTURE = 60
+
 def discover_downloaded_files(output_dir):
     """Reconstruit le fichier de log en scannant les fichiers existants dans le dossier de sortie"""
     print(f"Reconstruction du fichier de suivi à partir des fichiers existants dans {output_dir}...")
@@ -165,7 +179,24 @@ def is_file_already_downloaded(url, destination_folder):
     # Vérifier si le fichier existe et n'est pas vide
     return os.path.exists(file_path) and os.path.getsize(file_path) > 0
 
-def download_file(url, destination_folder, pbar=None, resume=False, base_output_dir=None):
+def get_with_retries(url, retries=RETRIES, delai_lecture=DELAI_LECTURE):
+    """Effectue une requête GET en réessayant après une erreur réseau"""
+    for tentative in range(retries + 1):
+        try:
+            response = requests.get(url, allow_redirects=True, timeout=(DELAI_CONNEXION, delai_lecture))
+            response.raise_for_status()
+            return response
+        except requests.exceptions.RequestException as e:
+            # les erreurs client (404...) ne sont pas transitoires, inutile de réessayer
+            erreur_client = e.response is not None and e.response.status_code < 500
+            if tentative == retries or erreur_client:
+                raise
+            mesures.compter("tentatives")
+            mesures.evenement("nouvelle_tentative", f"Nouvelle tentative pour {url}: {e}", url=url, erreur=str(e))
+            time.sleep(tentative + 1)
+
+def download_file(url, destination_folder, pbar=None, resume=False, base_output_dir=None,
+                  retries=RETRIES, delai_lecture=DELAI_LECTURE):
     """Télécharge un fichier depuis l'URL vers le dossier de destination"""
     try:
         # Obtenir le nom du fichier depuis l'URL
@@ -179,8 +210,8 @@ def download_file(url, destination_folder, pbar=None, resume=False, base_output_
         if resume and base_output_dir:
             download_log = load_download_log(base_output_dir, resume)
             if url in download_log["downloaded_urls"]:
-                with progress_lock:
-                    print(f"URL déjà téléchargée (d'après le log): {url}")
+                mesures.compter("ignores")
+                mesures.evenement("deja_telecharge", f"URL déjà téléchargée (d'après le log): {url}", url=url)
                 if pbar:
                     pbar.update(1)
                 return True
@@ -194,35 +225,35 @@ def download_file(url, destination_folder, pbar=None, resume=False, base_output_
                     # Ajouter l'URL au log
                     if base_output_dir:
                         save_download_log(base_output_dir, url)
-                    with progress_lock:
-                        print(f"Le fichier {file_name} existe déjà dans {destination_folder}")
+                    mesures.compter("ignores")
+                    mesures.evenement("existant", f"Le fichier {file_name} existe déjà dans {destination_folder}", url=url)
                     if pbar:
                         pbar.update(1)
                     return True
                 else:
                     # En mode normal, on signale simplement que le fichier existe déjà
-                    with progress_lock:
-                        print(f"Le fichier {file_name} existe déjà dans {destination_folder}")
+                    mesures.compter("ignores")
+                    mesures.evenement("existant", f"Le fichier {file_name} existe déjà dans {destination_folder}", url=url)
                     if pbar:
                         pbar.update(1)
                     return True
             else:
                 # Le fichier existe mais est vide, on le supprime pour le retélécharger
                 os.remove(file_path)
-                with progress_lock:
-                    print(f"Le fichier {file_name} existe mais est vide, retéléchargement...")
-        
-        # Effectuer la requête en respectant le protocole de l'URL
-        response = requests.get(url, allow_redirects=True)
-        response.raise_for_status()
+                mesures.evenement("vide", f"Le fichier {file_name} existe mais est vide, retéléchargement...", url=url)
         
-        # Vérifier si la réponse est une page d'index de dossier
-        if is_directory_listing(url, response.text):
-            return None  # Ce n'est pas un fichier mais un dossier
-        
-        # Télécharger le fichier
-        with open(file_path, 'wb') as f:
-            f.write(response.content)
+        # seuls les téléchargements effectifs sont chronométrés, pas les fichiers déjà présents
+        with mesures.chrono(url):
+            # Effectuer la requête en respectant le protocole de l'URL
+            response = get_with_retries(url, retries, delai_lecture)
+            
+            # Vérifier si la réponse est une page d'index de dossier
+            if is_directory_listing(url, response.text):
+                return None  # Ce n'est pas un fichier mais un dossier
+            
+            # Télécharger le fichier
+            with open(file_path, 'wb') as f:
+                f.write(response.content)
         
         # Vérifier que le fichier a bien été écrit et n'est pas vide
         if os.path.getsize(file_path) > 0:
@@ -230,11 +261,12 @@ def download_file(url, destination_folder, pbar=None, resume=False, base_output_
             if base_output_dir:
                 save_download_log(base_output_dir, url)
             
-            with progress_lock:
-                print(f"Téléchargement réussi: {file_path}")
+            mesures.compter("fichiers")
+            mesures.compter("octets", len(response.content))
+            mesures.evenement("telecharge", f"Téléchargement réussi: {file_path}", url=url, octets=len(response.content))
         else:
-            with progress_lock:
-                print(f"Erreur: Le fichier téléchargé {file_path} est vide")
+            mesures.compter("echecs")
+            mesures.evenement("echec", f"Erreur: Le fichier téléchargé {file_path} est vide", url=url, erreur="fichier vide")
             return False
         
         if pbar:
@@ -243,13 +275,14 @@ def download_file(url, destination_folder, pbar=None, resume=False, base_output_
         return True
         
     except requests.exceptions.RequestException as e:
-        with progress_lock:
-            print(f"Erreur lors du téléchargement de {url}: {e}")
+        mesures.compter("echecs")
+        mesures.evenement("echec", f"Erreur lors du téléchargement de {url}: {e}", url=url, erreur=str(e))
         if pbar:
             pbar.update(1)
         return False
 
-def explore_directory(url, base_output_dir, files_to_download, visited_urls=None, resume=False):
+def explore_directory(url, base_output_dir, files_to_download, visited_urls=None, resume=False,
+                      retries=RETRIES, delai_lecture=DELAI_LECTURE):
     """Explore récursivement un répertoire et ajoute tous les fichiers à télécharger"""
     if visited_urls is None:
         visited_urls = set()
@@ -260,12 +293,11 @@ def explore_directory(url, base_output_dir, files_to_download, visited_urls=None
     visited_urls.add(url)
     
     try:
-        with progress_lock:
-            print(f"Exploration du répertoire: {url}")
+        mesures.compter("repertoires")
+        mesures.evenement("exploration", f"Exploration du répertoire: {url}", url=url)
         
         # Utiliser le protocole spécifié dans l'URL
-        response = requests.get(url, allow_redirects=True)
-        response.raise_for_status()
+        response = get_with_retries(url, retries, delai_lecture)
         
         # Vérifier si la réponse est une page d'index de dossier
         if is_directory_listing(url, response.text):
@@ -279,7 +311,8 @@ def explore_directory(url, base_output_dir, files_to_download, visited_urls=None
             for link in links:
                 if link.endswith('/'):
                     # C'est un dossier, l'explorer récursivement
-                    explore_directory(link, base_output_dir, files_to_download, visited_urls, resume)
+                    explore_directory(link, base_output_dir, files_to_download, visited_urls, resume,
+                                      retries, delai_lecture)
                 else:
                     # C'est un fichier, vérifier s'il est déjà téléchargé en mode reprise
                     dest_folder = create_directory_structure(url, base_output_dir)
@@ -299,15 +332,15 @@ def explore_directory(url, base_output_dir, files_to_download, visited_urls=None
             files_to_download.append((url, destination_folder))
     
     except requests.exceptions.RequestException as e:
-        with progress_lock:
-            print(f"Erreur lors de l'exploration de {url}: {e}")
+        mesures.compter("echecs")
+        mesures.evenement("echec", f"Erreur lors de l'exploration de {url}: {e}", url=url, erreur=str(e))
 
-def download_directory_recursive(url, output_dir, num_workers=1, resume=False):
+def download_directory_recursive(url, output_dir, num_workers=1, resume=False, retries=RETRIES, delai_lecture=DELAI_LECTURE):
     """Télécharge récursivement tous les fichiers d'un répertoire"""
     files_to_download = []
     
     # Explorer le répertoire pour trouver tous les fichiers
-    explore_directory(url, output_dir, files_to_download, resume=resume)
+    explore_directory(url, output_dir, files_to_download, resume=resume, retries=retries, delai_lecture=delai_lecture)
     
     if not files_to_download:
         print(f"Aucun fichier trouvé à télécharger pour l'URL: {url}")
@@ -330,7 +363,7 @@ def download_directory_recursive(url, output_dir, num_workers=1, resume=False):
         if num_workers > 1:
             with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
                 # Soumettre toutes les tâches de téléchargement
-                futures = [executor.submit(download_file, url, folder, pbar, resume, output_dir) 
+                futures = [executor.submit(download_file, url, folder, pbar, resume, output_dir, retries, delai_lecture) 
                           for url, folder in files_to_download]
                 
                 # Attendre que tous les téléchargements soient terminés
@@ -343,7 +376,7 @@ def download_directory_recursive(url, output_dir, num_workers=1, resume=False):
         else:
             # Mode séquentiel
             for url, folder in files_to_download:
-                result = download_file(url, folder, pbar, resume, output_dir)
+                result = download_file(url, folder, pbar, resume, output_dir, retries, delai_lecture)
                 if result is True:
                     success_count += 1
                 elif result is False:
@@ -351,7 +384,8 @@ def download_directory_recursive(url, output_dir, num_workers=1, resume=False):
     
     return success_count, failure_count
 
-def download_from_tsv(tsv_file, output_dir, num_workers=1, format_filter=None, resume=False):
+def download_from_tsv(tsv_file, output_dir, num_workers=1, format_filter=None, resume=False,
+                      retries=RETRIES, delai_lecture=DELAI_LECTURE):
     """Traite le fichier TSV et télécharge les fichiers"""
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
@@ -443,7 +477,8 @@ def download_from_tsv(tsv_file, output_dir, num_workers=1, format_filter=None, r
         # Traiter chaque URL
         for i, url in enumerate(download_urls, 1):
             print(f"\nTraitement de l'URL {i}/{total_urls}: {url}")
-            success_count, failure_count = download_directory_recursive(url, output_dir, num_workers, resume)
+            success_count, failure_count = download_directory_recursive(url, output_dir, num_workers, resume,
+                                                                        retries, delai_lecture)
             total_success_count += success_count
             total_failure_count += failure_count
             
@@ -501,9 +536,17 @@ def main():
     parser.add_argument('--format', help='Filtre par format de données (utilise la colonne "format" du TSV)')
     parser.add_argument('--list-formats', action='store_true', help='Liste tous les formats disponibles dans le fichier TSV et quitte')
     parser.add_argument('--resume', action='store_true', help='Reprend les téléchargements précédemment interrompus')
+    parser.add_argument('--retries', type=int, default=RETRIES,
+                        help=f'Nombre de nouvelles tentatives après une erreur réseau (par défaut: {RETRIES})')
+    parser.add_argument('--timeout', type=float, default=DELAI_LECTURE,
+                        help=f'Délai en secondes sans données reçues avant une nouvelle tentative (par défaut: {DELAI_LECTURE})')
+    ajouter_arguments(parser)
     
     args = parser.parse_args()
     
+    global mesures
+    mesures = depuis_arguments("telechargement", args)
+    
     # Si l'option --list-formats est activée, afficher les formats disponibles et quitter
     if args.list_formats:
         print(f"Lecture des formats disponibles dans {args.tsv}...")
@@ -515,6 +558,7 @@ def main():
             print(f"\nUtilisez l'option --format pour sélectionner un format spécifique.")
         else:
             print("Aucun format n'a été trouvé ou le fichier ne contient pas de colonne 'format'.")
+        afficher_resume(mesures.terminer(args.rapport))
         return
     
     print(f"Fichier TSV: {args.tsv}")
@@ -536,7 +580,11 @@ def main():
                 json.dump(download_log, f, indent=2)
             print(f"Fichier de suivi créé avec {len(download_log['downloaded_urls'])} entrées")
     
-    download_from_tsv(args.tsv, args.output, args.workers, args.format, args.resume)
+    with profiler(args.profil, fichier_profil("telechargement", args)):
+        download_from_tsv(args.tsv, args.output, args.workers, args.format, args.resume,
+                          max(0, args.retries), args.timeout)
+    
+    afficher_resume(mesures.terminer(args.rapport))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,97 @@
+# Jeux d'exports fictifs construits à partir de generer_jeu_test.py, sans ogr2ogr ni extension spatial
+
+import os
+import sys
+import json
+from datetime import date
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from generer_jeu_test import codes_insee, generer_commune, modifier_commune  # noqa: E402
+from referentiel import srid_departement, departement_commune  # noqa: E402
+
+# Colonnes de la vue source_unique de duckdb_convert_pci.sql
+COLONNES_TEXTE = ["departement", "commune", "type_objet", "id", "section", "parcelle", "numero", "prefixe", "code",
+                  "lettre", "nom", "qualite", "modeConfec", "ancienne", "type"]
+
+
+def lignes_commune(insee, departement, entites, millesime):
+    """Convertit les entités d'une commune en lignes de la vue source_unique"""
+    import shapely
+
+    lignes = []
+    for categorie, (anneaux, enregistrements) in entites.items():
+        for anneau, enregistrement in zip(anneaux, enregistrements):
+            ligne = {c: enregistrement.get(c) for c in COLONNES_TEXTE + ["created", "updated", "echelle", "contenance"]}
+            ligne.update(millesime=date.fromisoformat(millesime), departement=departement, type_objet=categorie,
+                         commune=insee, geometry=shapely.to_wkb(shapely.Polygon(anneau)))
+            if categorie == "subdivisions_fiscales" and enregistrement["parcelle"] is None:
+                ligne.update(departement="000", commune="00000")
+            ligne["geom_srid"] = srid_departement(ligne["departement"])
+            lignes.append(ligne)
+    return lignes
+
+
+def ecrire_export(chemin, departements, millesime, communes=2, parcelles=40, modifications=0.0, graine=0):
+    """
+    Écrit un export trié comme un lot de duckdb_export_pci.sql, avec des métadonnées GeoParquet sans CRS.
+
+    Returns:
+        str: chemin du fichier écrit
+    """
+    import random
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    import shapely
+
+    rng = random.Random(f"{graine}-{millesime}")
+    lignes = []
+    for departement in departements:
+        for index, insee in enumerate(codes_insee(departement, communes)):
+            entites = generer_commune(insee, departement, index, parcelles, 8, graine)
+            if rng.random() < modifications:
+                entites = modifier_commune(entites, insee, millesime, graine)
+            lignes += lignes_commune(insee, departement_commune(insee), entites, millesime)
+    lignes.sort(key=lambda l: (l["departement"], l["commune"], l["type_objet"], l["section"] or "", l["id"] or ""))
+
+    bornes = shapely.bounds(shapely.from_wkb([l["geometry"] for l in lignes]))
+    colonnes = {
+        "millesime": pa.array([l["millesime"] for l in lignes], pa.date32()),
+        **{c: pa.array([l[c] for l in lignes], pa.string()) for c in COLONNES_TEXTE},
+        "created": pa.array([l["created"] for l in lignes], pa.date32()),
+        "updated": pa.array([l["updated"] for l in lignes], pa.date32()),
+        "echelle": pa.array([l["echelle"] for l in lignes], pa.int64()),
+        "contenance": pa.array([l["contenance"] for l in lignes], pa.int64()),
+        "geometry": pa.array([l["geometry"] for l in lignes], pa.binary()),
+        "geometry_bbox": pa.StructArray.from_arrays([pa.array(bornes[:, i], pa.float32()) for i in range(4)],
+                                                    ["xmin", "ymin", "xmax", "ymax"]),
+        "geom_srid": pa.array([l["geom_srid"] for l in lignes], pa.int32()),
+    }
+    geo = {"version": "1.0.0", "primary_column": "geometry",
+           "columns": {"geometry": {"encoding": "WKB", "geometry_types": ["Polygon"]}}}
+    table = pa.table(colonnes).replace_schema_metadata({b"geo": json.dumps(geo).encode("utf-8")})
+    os.makedirs(os.path.dirname(chemin), exist_ok=True)
+    pq.write_table(table, chemin, compression="zstd")
+    return chemin
+
+
+@pytest.fixture(scope="session")
+def millesimes(tmp_path_factory):
+    """
+    Deux millésimes construits (répertoires donnees) avec un lot de métropole (59, 2A) et un lot
+    des DROM (971), optimisés comme par script_execution.bat : chaque lot déclare son propre CRS.
+    """
+    from optimisation_parquet import optimiser_fichier
+
+    racine = tmp_path_factory.mktemp("millesimes")
+    dossiers = {}
+    for nom, millesime, modifications in (("avant", "2025-01-01", 0.0), ("apres", "2025-04-01", 1.0)):
+        donnees = racine / nom / "donnees"
+        for lot, departements in (("59_2A", ["59", "2A"]), ("971_972", ["971"])):
+            fichier = ecrire_export(str(donnees / f"cloudcadastre_{lot}.parquet"), departements, millesime,
+                                    modifications=modifications)
+            optimiser_fichier(fichier)
+        dossiers[nom] = str(donnees)
+    return dossiers
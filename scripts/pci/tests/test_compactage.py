@@ -0,0 +1,31 @@
+import json
+
+import numpy as np
+import pyarrow.parquet as pq
+import shapely
+
+from conftest import ecrire_export
+from compactage_geometrie import compacter_fichier, pas_grille
+from optimisation_parquet import optimiser_fichier
+
+
+def test_couverture_simple_precision_quantifiee(tmp_path):
+    source = ecrire_export(str(tmp_path / "cloudcadastre_59.parquet"), ["59"], "2025-04-01")
+    optimiser_fichier(source)
+    sortie = str(tmp_path / "compact.parquet")
+    resultat = compacter_fichier(source, sortie, "wkb", 0.01)
+    assert resultat["pas"] == pas_grille(0.01) == 1 / 128
+
+    table = pq.read_table(sortie, columns=["geometry", "geometry_bbox"])
+    bornes = shapely.bounds(shapely.from_wkb(table.column("geometry").to_numpy(zero_copy_only=False)))
+    bbox = table.column("geometry_bbox").combine_chunks()
+    # GDAL écrit la couverture en float32 : elle doit encore contenir chaque géométrie quantifiée
+    assert str(bbox.type.field("xmin").type) == "float"
+    for i, champ in enumerate(("xmin", "ymin")):
+        assert np.all(bbox.field(champ).to_numpy() <= bornes[:, i])
+    for i, champ in enumerate(("xmax", "ymax")):
+        assert np.all(bbox.field(champ).to_numpy() >= bornes[:, i + 2])
+
+    geo = json.loads(pq.read_schema(sortie).metadata[b"geo"])
+    assert geo["columns"]["geometry"]["encoding"] == "WKB"
+    assert geo["columns"]["geometry"]["crs"]["id"]["code"] == 2154
@@ -0,0 +1,29 @@
+import os
+import json
+from datetime import date
+
+import pyarrow.parquet as pq
+
+from conftest import ecrire_export
+from construction_incrementale import reutiliser_departement, fusionner
+from detection_changements import connexion, lire_millesime
+
+
+def test_departement_repris_sans_reecriture(tmp_path):
+    precedent, build = tmp_path / "2025-01-01", tmp_path / "2025-04-01"
+    origine = ecrire_export(str(precedent / "export" / "cloudcadastre_59.parquet"), ["59"], "2025-01-01")
+    ecrire_export(str(build / "export" / "cloudcadastre_971.parquet"), ["971"], "2025-04-01")
+
+    reutiliser_departement(str(precedent), str(build), "59")
+    repris = build / "export" / "cloudcadastre_59.parquet"
+    assert os.path.samefile(origine, repris)
+
+    fusionner(str(build), "2025-04-01")
+    fusion = pq.read_table(str(build / "cloudcadastrefusion.parquet"), columns=["millesime"])
+    assert set(fusion.column(0).to_pylist()) == {date(2025, 4, 1)}
+
+    # le département repris garde son millésime : celui de la construction vient du manifeste
+    (build / "manifeste.json").write_text(json.dumps({"millesime": "2025-04-01"}))
+    with connexion() as con:
+        assert lire_millesime(con, str(build)) == date(2025, 4, 1)
+        assert lire_millesime(con, str(precedent)) == date(2025, 1, 1)
@@ -0,0 +1,51 @@
+import pyarrow as pa
+import shapely
+
+from controle_qualite import controler_lot
+
+
+def carre(x, y, cote=10.0):
+    return shapely.to_wkb(shapely.box(x, y, x + cote, y + cote))
+
+
+def test_compteurs_controler_lot():
+    noeud_papillon = shapely.to_wkb(shapely.Polygon([(700000, 7000000), (700010, 7000010),
+                                                     (700010, 7000000), (700000, 7000010)]))
+    lignes = [
+        # departement, type_objet, commune, id, parcelle, geom_srid, geometry
+        ("59", "parcelles", "59350", "59350000AB0001", None, 2154, carre(700000, 7000000)),
+        ("59", "parcelles", "59350", None, None, 2154, noeud_papillon),
+        ("59", "parcelles", None, "59350000AB0003", None, 2154, None),
+        ("59", "subdivisions_fiscales", "59350", None, "59350000AB0001", 2154, carre(700000, 7000000, 5)),
+        # subdivision sans parcelle : département '000', SRID 0 comme dans la vue source_unique
+        ("000", "subdivisions_fiscales", "00000", None, None, 0, carre(700000, 7000000)),
+        # SRID 2154 attribué à '000' par la comparaison avec '00' de duckdb_convert_pci.sql
+        ("000", "subdivisions_fiscales", "00000", None, None, 2154, carre(700000, 7000000)),
+        ("971", "parcelles", "97101", "97101000AB0001", None, 5490, carre(0, 0)),
+    ]
+    colonnes = list(zip(*lignes))
+    lot = pa.table({
+        "departement": pa.array(colonnes[0], pa.string()),
+        "type_objet": pa.array(colonnes[1], pa.string()),
+        "commune": pa.array(colonnes[2], pa.string()),
+        "id": pa.array(colonnes[3], pa.string()),
+        "parcelle": pa.array(colonnes[4], pa.string()),
+        "geom_srid": pa.array(colonnes[5], pa.int32()),
+        "geometry": pa.array(colonnes[6], pa.binary()),
+    })
+
+    agregats, parcelles, references = controler_lot(lot)
+    compteurs = {(l["departement"], l["type_objet"]): l for l in agregats.to_pylist()}
+
+    parcelles_59 = compteurs[("59", "parcelles")]
+    assert parcelles_59["departement_count"] == 3
+    assert (parcelles_59["vides_sum"], parcelles_59["invalides_sum"], parcelles_59["reparables_sum"]) == (1, 1, 1)
+    assert (parcelles_59["id_nul_sum"], parcelles_59["commune_nulle_sum"]) == (1, 1)
+    assert parcelles_59["srid_incorrect_sum"] == parcelles_59["hors_emprise_sum"] == 0
+
+    orphelines = compteurs[("000", "subdivisions_fiscales")]
+    assert (orphelines["parcelle_nulle_sum"], orphelines["srid_incorrect_sum"], orphelines["hors_emprise_sum"]) == (2, 1, 0)
+    assert compteurs[("971", "parcelles")]["hors_emprise_sum"] == 1
+
+    assert parcelles.column("id").to_pylist() == ["59350000AB0001", None, "59350000AB0003", "97101000AB0001"]
+    assert references.column("parcelle").to_pylist() == ["59350000AB0001"]
@@ -0,0 +1,28 @@
+import os
+
+import pyarrow.parquet as pq
+
+from conftest import ecrire_export
+from detection_changements import motif_parquet
+from optimisation_parquet import fichiers_entree, optimiser_fichier, tri_declare
+
+
+def test_fusion_optimisee_avec_les_lots(tmp_path):
+    donnees = tmp_path / "donnees"
+    for nom in ("cloudcadastre_59.parquet", "cloudcadastre_971_972.parquet", "cloudcadastrefusion.parquet"):
+        (donnees / nom).parent.mkdir(exist_ok=True)
+        (donnees / nom).touch()
+    assert [os.path.basename(f) for f in fichiers_entree(str(donnees))] == [
+        "cloudcadastre_59.parquet", "cloudcadastre_971_972.parquet", "cloudcadastrefusion.parquet"]
+    # les outils de lecture ne reprennent pas la fusion, qui doublerait les lignes des lots
+    assert motif_parquet(str(donnees)).endswith("cloudcadastre_*.parquet")
+
+
+def test_optimisation_index_et_tri(tmp_path):
+    fichier = ecrire_export(str(tmp_path / "cloudcadastre_59.parquet"), ["59"], "2025-04-01")
+    lignes, groupes, _ = optimiser_fichier(fichier, taille_groupe=64)
+    parquet = pq.ParquetFile(fichier)
+    assert lignes == parquet.metadata.num_rows and groupes == parquet.metadata.num_row_groups > 1
+    assert tri_declare(parquet) == ["departement", "commune", "type_objet", "section", "id"]
+    colonne = parquet.metadata.row_group(0).column(parquet.schema_arrow.names.index("departement"))
+    assert colonne.has_column_index and colonne.has_offset_index
@@ -0,0 +1,117 @@
+# Tests de fumée : chaque outil est lancé en ligne de commande sur le jeu fictif, comme dans le pipeline
+
+import os
+import sys
+import json
+import shutil
+import subprocess
+
+import pytest
+
+DOSSIER_SCRIPTS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def spatial_disponible():
+    """Indique si l'extension spatial de DuckDB peut être chargée (scripts SQL du pipeline)"""
+    import duckdb
+
+    try:
+        duckdb.connect().execute("LOAD spatial")
+        return True
+    except duckdb.Error:
+        return False
+
+
+avec_ogr2ogr = pytest.mark.skipif(shutil.which("ogr2ogr") is None, reason="ogr2ogr introuvable")
+avec_spatial = pytest.mark.skipif(not spatial_disponible(), reason="extension spatial de DuckDB indisponible")
+
+
+def lancer(script, *options):
+    """Lance un script du pipeline et vérifie son code retour"""
+    resultat = subprocess.run([sys.executable, os.path.join(DOSSIER_SCRIPTS, script), *map(str, options)],
+                              capture_output=True, text=True, encoding="utf-8")
+    assert resultat.returncode == 0, resultat.stdout + resultat.stderr
+    return resultat.stdout
+
+
+def lancer_benchmark(travail, *options):
+    """Lance benchmark.py sur un petit jeu servi par serveur_test.py et retourne le statut de chaque étape"""
+    historique = os.path.join(travail, "historique.json")
+    lancer("benchmark.py", "--work", os.path.join(travail, "benchmark"), "--history", historique,
+           "--communes", 1, "--parcelles", 20, "--workers", 2, *options)
+    with open(historique, encoding="utf-8") as f:
+        return {e["etape"]: e["statut"] for e in json.load(f)[-1]["etapes"]}
+
+
+@pytest.fixture
+def donnees(millesimes, tmp_path):
+    """Copie du répertoire donnees du millésime « après », avec la fusion des lots optimisée comme par le pipeline"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from optimisation_parquet import optimiser_fichier
+
+    dossier = tmp_path / "donnees"
+    shutil.copytree(millesimes["apres"], dossier)
+    lots = [pq.read_table(str(f)) for f in sorted(dossier.glob("cloudcadastre_*.parquet"))]
+    fusion = str(dossier / "cloudcadastrefusion.parquet")
+    pq.write_table(pa.concat_tables(lots, promote_options="default").replace_schema_metadata(), fusion)
+    optimiser_fichier(fusion)
+    return dossier
+
+
+def test_telechargement_et_decompression(tmp_path):
+    statuts = lancer_benchmark(str(tmp_path), "--stages", "telechargement,decompression,cpg")
+    assert statuts == {"telechargement": "ok", "decompression": "ok", "cpg": "ok"}
+
+
+@avec_ogr2ogr
+@avec_spatial
+def test_pipeline_complet(tmp_path):
+    statuts = lancer_benchmark(str(tmp_path))
+    assert set(statuts.values()) == {"ok"}, statuts
+
+
+@avec_spatial
+def test_export_sql(donnees, tmp_path):
+    import duckdb
+
+    base = str(tmp_path / "cloudcadastre.duckdb")
+    with duckdb.connect(base) as con:
+        con.execute("SET enable_geoparquet_conversion = false")
+        con.execute(f"CREATE TABLE source_unique AS SELECT * FROM read_parquet('{donnees}/cloudcadastre_*.parquet')")
+    lancer("executer_sql.py", "--sql", os.path.join(DOSSIER_SCRIPTS, "duckdb_export_pci.sql"), "--base", base,
+           "--variable", f"my_workspace={tmp_path}")
+    assert (donnees / "cloudcadastre_971_972.parquet").exists() and (donnees / "cloudcadastre_2A_2B.parquet").exists()
+    assert not (donnees / "cloudcadastre_97_autres.parquet").exists()
+    lancer("optimisation_parquet.py", "--input", donnees)
+    lancer("controle_qualite.py", "--input", donnees, "--output", tmp_path / "qualite.json")
+
+
+def test_optimisation_et_lecture_des_lots(donnees, tmp_path):
+    lancer("optimisation_parquet.py", "--input", donnees, "--common-crs", 4326)
+    lancer("extraction_multiple.py", "--input", donnees / "cloudcadastrefusion.parquet",
+           "--output", tmp_path / "extraits", "--departements", "59,971")
+    assert (tmp_path / "extraits" / "departement_971.parquet").exists()
+    lancer("controle_qualite.py", "--input", donnees, "--output", tmp_path / "qualite.json")
+
+
+def test_detection_changements(millesimes, tmp_path):
+    sortie = tmp_path / "changements"
+    lancer("detection_changements.py", "--before", millesimes["avant"], "--after", millesimes["apres"],
+           "--output", sortie)
+    lancer("detection_changements.py", "--before", millesimes["avant"], "--diffs", sortie,
+           "--output", tmp_path / "temporel.parquet")
+
+
+def test_recherche_et_compactage(donnees, tmp_path):
+    import pyarrow.parquet as pq
+
+    identifiant = pq.read_table(str(donnees / "cloudcadastre_971_972.parquet"), columns=["id"]).column(0).drop_null()[0]
+    sortie = lancer("recherche_parcelles.py", "--input", donnees, "--ids", identifiant)
+    assert sortie.startswith("1 objets trouvés")
+    lancer("compactage_geometrie.py", "--input", donnees, "--output", tmp_path / "compact", "--grid", 0.01)
+
+
+@avec_ogr2ogr
+def test_export_flatgeobuf(donnees, tmp_path):
+    lancer("export_flatgeobuf.py", "--input", donnees, "--output", tmp_path / "flatgeobuf", "--types", "parcelles")
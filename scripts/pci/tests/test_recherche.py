@@ -0,0 +1,23 @@
+import os
+
+import pyarrow.parquet as pq
+
+from conftest import ecrire_export
+from optimisation_parquet import optimiser_fichier
+from recherche_parcelles import rechercher
+
+
+def test_recherche_lot_et_groupes_ecartes(tmp_path):
+    fichier = ecrire_export(str(tmp_path / "cloudcadastre_59.parquet"), ["59"], "2025-04-01", communes=3,
+                            parcelles=400)
+    optimiser_fichier(fichier, taille_groupe=256)
+    parcelles = pq.read_table(fichier, columns=["type_objet", "id"]).to_pylist()
+    ids = sorted(l["id"] for l in parcelles if l["type_objet"] == "parcelles")
+    lot = ids[:3] + [ids[0][:-4] + "9999"]
+
+    table, octets, lectures = rechercher([fichier], lot)
+    assert sorted(table.column("id").to_pylist()) == ids[:3]
+    # seuls les groupes de lignes dont les statistiques d'id couvrent le lot sont lus
+    assert 0 < octets < os.path.getsize(fichier) and lectures > 0
+
+    assert rechercher([fichier], ["00000000ZZ0000"])[0] is None
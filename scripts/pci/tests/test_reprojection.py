@@ -0,0 +1,65 @@
+import os
+import json
+
+import pyarrow.parquet as pq
+
+from detection_changements import connexion, litteral, detecter_changements, construire_temporel
+from export_flatgeobuf import lister_couches
+from optimisation_parquet import optimiser_fichier
+
+
+def crs_epsg(fichier, colonne="geometry"):
+    """Code EPSG déclaré pour une colonne dans les métadonnées GeoParquet (None si le CRS est nul)"""
+    crs = json.loads(pq.read_schema(fichier).metadata[b"geo"])["columns"][colonne]["crs"]
+    return crs and crs["id"]["code"]
+
+
+def test_lots_declarent_leur_crs(millesimes):
+    donnees = millesimes["avant"]
+    assert crs_epsg(os.path.join(donnees, "cloudcadastre_59_2A.parquet")) == 2154
+    assert crs_epsg(os.path.join(donnees, "cloudcadastre_971_972.parquet")) == 5490
+
+
+def test_lecture_metropole_et_drom(millesimes):
+    motif = os.path.join(millesimes["avant"], "cloudcadastre_*.parquet")
+    with connexion() as con:
+        srids = con.execute(f'SELECT "geom_srid", count(*), count(hash("geometry")) FROM read_parquet({litteral(motif)}) '
+                            "GROUP BY ALL ORDER BY 1").fetchall()
+    assert {2154, 5490} <= {s for s, _, _ in srids}
+    assert all(lignes == geometries for _, lignes, geometries in srids)
+
+
+def test_changements_metropole_et_drom(millesimes, tmp_path):
+    resume = detecter_changements(millesimes["avant"], millesimes["apres"], str(tmp_path / "diff"), ["parcelles"])
+    assert resume["departements"]["971"] and resume["departements"]["59"]
+    assert crs_epsg(str(tmp_path / "diff" / "changements_971.parquet")) == 5490
+    assert crs_epsg(str(tmp_path / "diff" / "changements_59.parquet")) == 2154
+
+    sortie = str(tmp_path / "temporel.parquet")
+    versions, terminees = construire_temporel(millesimes["avant"], [str(tmp_path / "diff")], sortie, ["parcelles"])
+    assert versions > terminees > 0
+    assert crs_epsg(sortie) is None
+
+
+def test_fusion_metropole_et_drom(millesimes, tmp_path):
+    motif = os.path.join(millesimes["avant"], "cloudcadastre_*.parquet")
+    sortie = str(tmp_path / "cloudcadastrefusion.parquet")
+    with connexion() as con:
+        con.execute(f"COPY (SELECT * FROM read_parquet({litteral(motif)})) TO {litteral(sortie)} (FORMAT parquet)")
+    optimiser_fichier(sortie, crs_commun=4326)
+    assert crs_epsg(sortie) is None
+    assert crs_epsg(sortie, "geometry_4326") == 4326
+
+    couches = lister_couches([sortie], ["parcelles"])
+    assert {(c["departement"], c["srid"]) for c in couches} == {("59", 2154), ("2A", 2154), ("971", 5490)}
+
+
+def test_srids_statistiques_apres_structure(tmp_path):
+    from conftest import ecrire_export
+    from reprojection import srids_fichier
+
+    fichier = ecrire_export(str(tmp_path / "lot.parquet"), ["971"], "2025-04-01", communes=1, parcelles=1)
+    table = pq.read_table(fichier)
+    # une seule ligne : les statistiques de geometry_bbox ont aussi min = max
+    pq.write_table(table.slice(0, 1), fichier)
+    assert srids_fichier(pq.ParquetFile(fichier)) == {5490}
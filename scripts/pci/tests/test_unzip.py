@@ -0,0 +1,23 @@
+import zipfile
+
+from unzip_agglist import chemin_extraction, extract_single_zip
+
+MEMBRES = ["../hors/parcelles.shp", "/absolu/parcelles.dbf", "communes/./59350//parcelles.shx", "sections.zip"]
+
+
+def test_membres_assainis_a_jour(tmp_path):
+    archive = tmp_path / "cadastre-59350-parcelles.zip"
+    with zipfile.ZipFile(archive, "w") as zf:
+        for nom in MEMBRES:
+            zf.writestr(nom, nom * 10)
+
+    with zipfile.ZipFile(archive) as zf:
+        for info in zf.infolist():
+            assert chemin_extraction(info, str(tmp_path / "ref")) == zf.extract(info, str(tmp_path / "ref"))
+
+    # les membres déjà extraits sont reconnus, y compris ceux dont le nom a été assaini
+    *_, extraits, a_jour, imbriquees, erreur = extract_single_zip(str(archive))
+    assert (extraits, a_jour, erreur) == (len(MEMBRES), 0, None)
+    *_, extraits, a_jour, imbriquees, erreur = extract_single_zip(str(archive))
+    assert (extraits, a_jour) == (0, len(MEMBRES))
+    assert imbriquees == [str(tmp_path / "sections.zip")]
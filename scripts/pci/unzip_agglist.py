@@ -5,66 +5,228 @@ import argparse
 from datetime import datetime
 import re
 from collections import defaultdict
+import time
+import zlib
 import multiprocessing
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from functools import partial
 
-def extract_single_zip(zip_path, verbose=True):
-    """Décompresse un fichier ZIP."""
+from instrumentation import Instrumentation, ajouter_arguments, depuis_arguments, fichier_profil, profiler, afficher_resume
+
+# Mesures de l'étape, remplacées dans main() selon les options --verbose/--journal
+mesures = Instrumentation("decompression")
+
+# Catégories des archives Etalab (prefixes_sections avant sections, dont le nom est inclus)
+CATEGORIES = [
+    "batiments", "communes", "feuilles", "lieux_dits",
+    "parcelles", "prefixes_sections", "sections", "subdivisions_fiscales"
+]
+
+def categorie_nom(nom):
+    """Retourne la catégorie contenue dans un nom de fichier ou d'archive, None si aucune."""
+    nom = os.path.basename(nom).lower()
+    for category in CATEGORIES:
+        if category in nom:
+            return category
+    return None
+
+def member_selected(nom, categorie_archive, categories):
+    """Indique si un membre d'archive fait partie des catégories demandées (toutes si categories est None)."""
+    if categories is None:
+        return True
+    categorie = categorie_nom(nom) or categorie_archive
+    if categorie is None:
+        # archive conteneur (ex: archive départementale) dont les catégories sont filtrées à la décompression
+        return nom.lower().endswith('.zip')
+    return categorie in categories
+
+def horodatage_zip(info):
+    """Retourne la date d'un membre d'archive en secondes depuis l'epoch (heure locale, comme zipfile)."""
+    return time.mktime(info.date_time + (0, 0, -1))
+
+def crc_fichier(chemin):
+    """Calcule le CRC32 d'un fichier par blocs."""
+    crc = 0
+    with open(chemin, 'rb') as f:
+        for bloc in iter(lambda: f.read(1024 * 1024), b''):
+            crc = zlib.crc32(bloc, crc)
+    return crc
+
+def chemin_extraction(info, root):
+    """
+    Retourne le chemin où ZipFile.extract écrit un membre sous root.
+
+    Même assainissement que ZipFile._extract_member : séparateurs du système, lettre de lecteur,
+    composants vides, "." et ".." retirés, caractères interdits remplacés sous Windows.
+    """
+    nom = info.filename.replace('/', os.path.sep)
+    if os.path.altsep:
+        nom = nom.replace(os.path.altsep, os.path.sep)
+    nom = os.path.splitdrive(nom)[1]
+    nom = os.path.sep.join(x for x in nom.split(os.path.sep) if x not in ('', os.path.curdir, os.path.pardir))
+    if os.path.sep == '\\':
+        nom = zipfile.ZipFile._sanitize_windows_name(nom, os.path.sep)
+    return os.path.normpath(os.path.join(root, nom))
+
+def member_up_to_date(info, destination, verify_crc=False):
+    """
+    Indique si la copie locale d'un membre est à jour.
+
+    La taille et la date (posée depuis l'archive à la décompression) doivent correspondre ;
+    avec verify_crc, le CRC32 de la copie locale est comparé à celui du répertoire central.
+    """
+    try:
+        stat = os.stat(destination)
+    except FileNotFoundError:
+        return False
+    if stat.st_size != info.file_size:
+        return False
+    if verify_crc:
+        return crc_fichier(destination) == info.CRC
+    # les dates zip ont une résolution de 2 secondes
+    return abs(stat.st_mtime - horodatage_zip(info)) < 2
+
+def archives_contenues(zip_path, categories=None):
+    """
+    Retourne les chemins (absolus) où seront extraites les archives imbriquées d'un fichier ZIP.
+
+    Seul le répertoire central est lu ; une archive illisible n'en contient aucune
+    (son échec est signalé à la décompression).
+    """
+    root = os.path.dirname(os.path.abspath(zip_path))
+    categorie_archive = categorie_nom(zip_path)
+    try:
+        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            return [chemin_extraction(info, root) for info in zip_ref.infolist()
+                    if not info.is_dir() and info.filename.lower().endswith('.zip')
+                    and member_selected(info.filename, categorie_archive, categories)]
+    except (OSError, zipfile.BadZipFile):
+        return []
+
+def extract_single_zip(zip_path, categories=None, verify_crc=False, verbose=False):
+    """
+    Décompresse les membres utiles d'un fichier ZIP.
+
+    Le répertoire central est lu d'abord : seuls les membres des catégories demandées
+    dont la copie locale est absente ou diffère (taille, date ou CRC) sont extraits,
+    puis leur date est fixée à celle de l'archive. Les archives imbriquées extraites
+    sont retournées pour être décompressées à leur tour.
+
+    Retourne (chemin, succès, durée, octets décompressés, membres extraits, membres à jour,
+    archives imbriquées, erreur).
+    """
+    debut = time.perf_counter()
+    extraits = a_jour = octets = 0
+    imbriquees = []
     try:
-        if verbose:
-            print(f"Décompression de {zip_path}...")
         root = os.path.dirname(zip_path)
+        categorie_archive = categorie_nom(zip_path)
         with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            zip_ref.extractall(root)
-        return zip_path, True
+            for info in zip_ref.infolist():
+                if info.is_dir() or not member_selected(info.filename, categorie_archive, categories):
+                    continue
+                destination = chemin_extraction(info, root)
+                if info.filename.lower().endswith('.zip'):
+                    imbriquees.append(destination)
+                if member_up_to_date(info, destination, verify_crc):
+                    a_jour += 1
+                    continue
+                if verbose:
+                    print(f"Décompression de {zip_path}: {info.filename}")
+                chemin = zip_ref.extract(info, root)
+                horodatage = horodatage_zip(info)
+                os.utime(chemin, (horodatage, horodatage))
+                extraits += 1
+                octets += info.file_size
+        return zip_path, True, time.perf_counter() - debut, octets, extraits, a_jour, imbriquees, None
     except Exception as e:
         if verbose:
             print(f"Erreur lors de la décompression de {zip_path}: {e}")
-        return zip_path, False
+        return zip_path, False, time.perf_counter() - debut, octets, extraits, a_jour, imbriquees, str(e)
+
+def extract_zip_files(directory, num_processes=None, verbose=False, quiet=False, categories=None, verify_crc=False):
+    """
+    Parcourt le répertoire et décompresse tous les fichiers ZIP trouvés en parallèle.
 
-def extract_zip_files(directory, num_processes=None, verbose=True):
-    """Parcourt le répertoire et décompresse tous les fichiers ZIP trouvés en parallèle."""
-    if verbose:
+    Les résultats sont traités au fil de l'eau ; les archives imbriquées découvertes
+    sont soumises dès que l'archive qui les contient est traitée.
+    """
+    if not quiet:
         print(f"Recherche de fichiers ZIP dans {directory}...")
     
     zip_files = []
     for root, _, files in os.walk(directory):
         for file in files:
             if file.lower().endswith('.zip'):
-                zip_files.append(os.path.join(root, file))
+                chemin = os.path.join(root, file)
+                # une archive d'une catégorie non demandée n'est pas ouverte
+                if categories is None or categorie_nom(file) in categories or categorie_nom(file) is None:
+                    zip_files.append(chemin)
     
     if not zip_files:
-        if verbose:
+        if not quiet:
             print("Aucun fichier ZIP trouvé.")
         return 0
     
-    if verbose:
+    if not quiet:
         print(f"Trouvé {len(zip_files)} fichiers ZIP à décompresser.")
     
+    # Une archive imbriquée déjà extraite par une exécution précédente n'est soumise qu'une fois
+    # son archive parente traitée : en parallèle, la parente pourrait être en train de la réécrire
+    trouvees = set(os.path.abspath(z) for z in zip_files)
+    attendues = {}
+    for zip_path in zip_files:
+        enfants = [c for c in archives_contenues(zip_path, categories) if c in trouvees and c != os.path.abspath(zip_path)]
+        if enfants:
+            attendues[os.path.abspath(zip_path)] = enfants
+    differees = set(c for enfants in attendues.values() for c in enfants)
+    zip_files = [z for z in zip_files if os.path.abspath(z) not in differees]
+    
     # Utiliser le nombre de processus spécifié ou la moitié des processeurs disponibles par défaut
     if num_processes is None:
         num_processes = max(1, multiprocessing.cpu_count() // 2)
     
-    if verbose:
+    if not quiet:
         print(f"Décompression en parallèle avec {num_processes} processus...")
     
-    extract_function = partial(extract_single_zip, verbose=verbose)
+    extract_function = partial(extract_single_zip, categories=categories, verify_crc=verify_crc, verbose=verbose)
     
     success_count = 0
     failure_count = 0
+    extracted_count = 0
+    up_to_date_count = 0
+    soumises = set(os.path.abspath(z) for z in zip_files)
     
     with ProcessPoolExecutor(max_workers=num_processes) as executor:
-        results = list(executor.map(extract_function, zip_files))
-        
-        for _, success in results:
-            if success:
-                success_count += 1
-            else:
-                failure_count += 1
+        en_cours = {executor.submit(extract_function, zip_path) for zip_path in zip_files}
+        while en_cours:
+            terminees, en_cours = wait(en_cours, return_when=FIRST_COMPLETED)
+            for future in terminees:
+                zip_path, success, duree, octets, extraits, a_jour, imbriquees, erreur = future.result()
+                mesures.observer('latence_s', duree, zip_path)
+                extracted_count += extraits
+                up_to_date_count += a_jour
+                mesures.compter("membres_extraits", extraits)
+                mesures.compter("membres_a_jour", a_jour)
+                if success:
+                    success_count += 1
+                    mesures.compter("fichiers")
+                    mesures.compter("octets", octets)
+                    mesures.evenement("decompresse", zip_path=zip_path, octets=octets, extraits=extraits,
+                                      a_jour=a_jour, duree_s=round(duree, 4))
+                else:
+                    failure_count += 1
+                    mesures.compter("echecs")
+                    mesures.evenement("echec", zip_path=zip_path, erreur=erreur)
+                # les imbriquées attendues sont aussi soumises si la parente a échoué en cours de route
+                for imbriquee in imbriquees + attendues.get(os.path.abspath(zip_path), []):
+                    if os.path.abspath(imbriquee) not in soumises and os.path.exists(imbriquee):
+                        soumises.add(os.path.abspath(imbriquee))
+                        en_cours.add(executor.submit(extract_function, imbriquee))
     
-    if verbose:
-        print(f"Décompression terminée: {success_count} réussis, {failure_count} échecs sur {len(zip_files)} fichiers ZIP.")
+    if not quiet:
+        print(f"Décompression terminée: {success_count} réussis, {failure_count} échecs sur {len(soumises)} fichiers ZIP "
+              f"({extracted_count} fichiers extraits, {up_to_date_count} déjà à jour).")
     
     return success_count
 
@@ -80,13 +242,8 @@ def find_shp_files(directory):
     print(f"Trouvé {len(shp_files)} fichiers SHP.")
     return shp_files
 
-def categorize_shp_files(shp_files):
-    """Catégorise les fichiers SHP selon les critères spécifiés."""
-    categories = [
-        "batiments", "communes", "feuilles", "lieux_dits", 
-        "parcelles", "prefixes_sections", "sections", "subdivisions_fiscales"
-    ]
-    
+def categorize_shp_files(shp_files, categories=None):
+    """Catégorise les fichiers SHP selon les critères spécifiés (toutes les catégories si categories est None)."""
     # Structure pour stocker les fichiers par date et par catégorie
     by_date_category = defaultdict(lambda: defaultdict(list))
     
@@ -104,12 +261,9 @@ def categorize_shp_files(shp_files):
         date_key = f"{creation_time.year}_{creation_time.month:02d}"
         
         # Vérifier si le nom du fichier contient l'une des catégories
-        file_categorized = False
-        for category in categories:
-            if category in filename:
-                by_date_category[date_key][category].append(file_path)
-                file_categorized = True
-                break
+        category = categorie_nom(filename)
+        if category is not None and (categories is None or category in categories):
+            by_date_category[date_key][category].append(file_path)
     
     return by_date_category
 
@@ -130,30 +284,32 @@ def write_lists_to_files(by_date_category, output_dir):
                     for file_path in files:
                         f.write(f"{file_path}\n")
                 files_created += 1
-                print(f"Créé {output_path} avec {len(files)} fichiers")
+                mesures.evenement("liste", f"Créé {output_path} avec {len(files)} fichiers",
+                                  chemin=output_path, fichiers=len(files))
     
     return files_created
 
-def main():
-    parser = argparse.ArgumentParser(description='Traitement de fichiers ZIP et SHP')
-    parser.add_argument('--input', required=True, help='Répertoire à parcourir pour trouver les fichiers ZIP et SHP')
-    parser.add_argument('--output', required=True, help='Répertoire où écrire les listes de fichiers')
-    parser.add_argument('--processes', type=int, default=None, 
-                        help='Nombre de processus pour la décompression parallèle (par défaut: moitié des CPU disponibles)')
-    parser.add_argument('--quiet', action='store_true', help='Réduire les messages de progression')
-    
-    args = parser.parse_args()
-    verbose = not args.quiet
-    
+def traiter(args, verbose):
+    """Décompresse les archives puis écrit les listes de fichiers SHP ; retourne le code retour du programme"""
     if not os.path.isdir(args.input):
         print(f"Erreur: {args.input} n'est pas un répertoire valide.")
         return 1
     
-    if verbose:
+    categories = None
+    if args.categories:
+        categories = {c.strip() for c in args.categories.split(',') if c.strip()}
+        inconnues = categories - set(CATEGORIES)
+        if inconnues:
+            print(f"Erreur: catégories inconnues: {', '.join(sorted(inconnues))}.")
+            return 1
+    
+    if not args.quiet:
         print("=== Début du traitement ===")
     
     # Étape 1: Décompresser les fichiers ZIP avec parallélisation
-    zip_count = extract_zip_files(args.input, num_processes=args.processes, verbose=verbose)
+    with profiler(args.profil, fichier_profil("decompression", args)):
+        zip_count = extract_zip_files(args.input, num_processes=args.processes, verbose=verbose, quiet=args.quiet,
+                                      categories=categories, verify_crc=args.verify_crc)
     
     # Étape 2: Trouver tous les fichiers SHP
     shp_files = find_shp_files(args.input)
@@ -163,12 +319,12 @@ def main():
         return 0
     
     # Étape 3: Catégoriser les fichiers SHP
-    by_date_category = categorize_shp_files(shp_files)
+    by_date_category = categorize_shp_files(shp_files, categories)
     
     # Étape 4: Écrire les listes dans des fichiers (par date et catégorie uniquement)
     files_created = write_lists_to_files(by_date_category, args.output)
     
-    if verbose:
+    if not args.quiet:
         print(f"\n=== Traitement terminé ===")
         print(f"Fichiers ZIP traités: {zip_count}")
         print(f"Fichiers SHP trouvés: {len(shp_files)}")
@@ -176,5 +332,33 @@ def main():
     
     return 0
 
+def main():
+    parser = argparse.ArgumentParser(description='Traitement de fichiers ZIP et SHP')
+    parser.add_argument('--input', required=True, help='Répertoire à parcourir pour trouver les fichiers ZIP et SHP')
+    parser.add_argument('--output', required=True, help='Répertoire où écrire les listes de fichiers')
+    parser.add_argument('--processes', type=int, default=None, 
+                        help='Nombre de processus pour la décompression parallèle (par défaut: moitié des CPU disponibles)')
+    parser.add_argument('--categories',
+                        help=f"Catégories à décompresser séparées par des virgules, ex: parcelles,batiments (par défaut: toutes). "
+                             f"Valeurs possibles: {', '.join(CATEGORIES)}")
+    parser.add_argument('--verify-crc', action='store_true',
+                        help='Compare le CRC32 des fichiers déjà décompressés à celui de l\'archive (plus lent que taille et date)')
+    parser.add_argument('--quiet', action='store_true', help='Réduire les messages de progression')
+    ajouter_arguments(parser)
+    
+    args = parser.parse_args()
+    verbose = args.verbose and not args.quiet
+    
+    global mesures
+    mesures = depuis_arguments("decompression", args)
+    
+    # le rapport est écrit quelle que soit l'issue, y compris pour une option invalide
+    try:
+        return traiter(args, verbose)
+    finally:
+        resume = mesures.terminer(args.rapport)
+        if not args.quiet:
+            afficher_resume(resume)
+
 if __name__ == "__main__":
     sys.exit(main())
\ No newline at end of file